@@ -1,11 +1,26 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 
-from sadco.api.routers import survey, survey_download, vos_survey, download_audit
+from sadco.api.lib.download_job import start_download_job_maintenance, stop_download_job_maintenance
+from sadco.api.routers import survey, survey_download, vos_survey, download_audit, download_job
+from sadco.api.routers.vos_survey import start_vos_count_cube_update, stop_vos_count_cube_update
 from sadco.db import Session
 from odp.version import VERSION
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    start_download_job_maintenance()
+    start_vos_count_cube_update()
+    yield
+    stop_download_job_maintenance()
+    stop_vos_count_cube_update()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="SADCO API",
     description="SADCO | SADCO Data Api",
     version=VERSION,
@@ -17,6 +32,7 @@ app.include_router(survey.router, prefix='/survey', tags=['Survey'])
 app.include_router(survey_download.router, prefix='/survey/download', tags=['Survey', 'Download'])
 app.include_router(vos_survey.router, prefix='/vos_survey', tags=['Survey'])
 app.include_router(download_audit.router, prefix='/downloads', tags=['Downloads', 'Audit'])
+app.include_router(download_job.router, prefix='/download_jobs', tags=['Downloads'])
 
 app.add_middleware(
     CORSMiddleware,
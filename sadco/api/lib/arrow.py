@@ -0,0 +1,68 @@
+import pyarrow as pa
+from sqlalchemy import types
+
+from sadco.api.lib.numeric import FLOAT_NUMERIC_PRECISION
+
+
+def get_arrow_schema(statement) -> pa.Schema:
+    """
+    Builds an arrow schema for the rows of a select statement from the declared types of its columns.
+    """
+    return pa.schema([
+        pa.field(column.key, get_arrow_type(column.type)) for column in statement.selected_columns
+    ])
+
+
+def get_arrow_type(column_type: types.TypeEngine) -> pa.DataType:
+    """
+    Maps a SQLAlchemy column type to the arrow type that holds its values without loss. Numeric columns with a
+    declared precision keep it as decimals; types without an arrow equivalent are written as strings.
+    """
+    match column_type:
+        case types.Float():
+            return pa.float64()
+        case types.Numeric(precision=precision, scale=scale) if precision:
+            return pa.decimal128(precision, scale or 0)
+        case types.Numeric():
+            return pa.float64()
+        case types.SmallInteger():
+            return pa.int16()
+        case types.BigInteger():
+            return pa.int64()
+        case types.Integer():
+            return pa.int32()
+        case types.DateTime():
+            return pa.timestamp('us')
+        case types.Date():
+            return pa.date32()
+        case types.Time():
+            return pa.time64('us')
+        case types.Boolean():
+            return pa.bool_()
+        case _:
+            return pa.string()
+
+
+def get_record_batch(rows, schema: pa.Schema) -> pa.RecordBatch:
+    """
+    Converts a list of rows to an arrow record batch with the given schema.
+    """
+    columns = zip(*rows) if rows else [[] for _ in schema]
+
+    return pa.record_batch(
+        [get_arrow_array(values, field.type) for values, field in zip(columns, schema)],
+        schema=schema,
+    )
+
+
+def get_arrow_array(values, arrow_type: pa.DataType) -> pa.Array:
+    if pa.types.is_decimal(arrow_type) and arrow_type.precision <= FLOAT_NUMERIC_PRECISION:
+        # These values are fetched as floats, and are rounded to the decimal's scale in a single cast
+        return pa.array(values, type=pa.float64()).cast(arrow_type)
+
+    if pa.types.is_floating(arrow_type):
+        values = [float(value) if value is not None else None for value in values]
+    elif pa.types.is_string(arrow_type):
+        values = [str(value) if value is not None else None for value in values]
+
+    return pa.array(values, type=arrow_type)
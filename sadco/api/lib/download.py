@@ -1,53 +1,845 @@
+import base64
+import gzip
 import hashlib
+import io
 import json
+import queue
+import re
+import tempfile
+import threading
+import time
 import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import dataclass
 from datetime import datetime, timezone
-from io import StringIO, BytesIO
+from enum import Enum
+from functools import partial
+from itertools import chain
+from typing import BinaryIO, Callable
 
 import pandas as pd
-from fastapi.responses import StreamingResponse
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zstandard
+from fastapi import HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from sqlalchemy import Column, MetaData, Table
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import Select
+from starlette.background import BackgroundTask
+from starlette.status import (HTTP_206_PARTIAL_CONTENT, HTTP_404_NOT_FOUND, HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE,
+                              HTTP_422_UNPROCESSABLE_ENTITY)
 
+from sadco.api.lib.arrow import get_arrow_schema, get_record_batch
 from sadco.api.lib.auth import Authorized
+from sadco.api.lib.download_cache import MaterialisingStream, get_cache_key, get_cached_chunks, get_cached_file
+from sadco.api.lib.netcdf import NetCDFLayout, get_netcdf_chunks, get_netcdf_dimensions
+from sadco.api.lib.numeric import get_float_numeric_statement
+from sadco.api.lib.odv import ODV_FEATURE_TYPE, get_odv_chunks
+from sadco.db import Session, engine
 from sadco.db.models import DownloadAudit
 
+# Number of rows fetched from the server-side cursor and encoded per CSV chunk
+DOWNLOAD_BATCH_SIZE = 10000
 
-def get_csv_data(items, survey_id, data_variant) -> dict:
+# Size of the chunks in which COPY output is handed from the database thread to the response
+COPY_CHUNK_SIZE = 64 * 1024
+
+# Number of COPY chunks that may be waiting to be sent before the database thread blocks
+COPY_QUEUE_SIZE = 16
+
+# Number of connections on which the surveys of a batch download are queried at the same time
+BATCH_DOWNLOAD_CONNECTIONS = 4
+
+# Size of the chunks in which finished files are read back to be sent
+FILE_CHUNK_SIZE = 64 * 1024
+
+
+class DownloadFormat(str, Enum):
+    """File formats in which survey data can be downloaded"""
+    CSV = 'csv'
+    PARQUET = 'parquet'
+    ARROW = 'arrow'
+    NETCDF = 'netcdf'
+    ODV = 'odv'
+
+
+# Media type and file extension of each download format
+DOWNLOAD_FILE_TYPES = {
+    DownloadFormat.CSV: ('application/zip', 'zip'),
+    DownloadFormat.PARQUET: ('application/vnd.apache.parquet', 'parquet'),
+    DownloadFormat.ARROW: ('application/vnd.apache.arrow.stream', 'arrows'),
+    DownloadFormat.NETCDF: ('application/x-netcdf', 'nc'),
+    DownloadFormat.ODV: ('application/zip', 'odv.zip'),
+}
+
+
+class DownloadCompression(str, Enum):
+    """Compression of csv downloads: a zip archive, deflated or stored, or a gzip or zstandard stream"""
+    DEFLATE = 'deflate'
+    STORE = 'store'
+    GZIP = 'gzip'
+    ZSTD = 'zstd'
+
+
+# Media type and file extension of each csv compression
+CSV_COMPRESSION_FILE_TYPES = {
+    DownloadCompression.DEFLATE: ('application/zip', 'zip'),
+    DownloadCompression.STORE: ('application/zip', 'zip'),
+    DownloadCompression.GZIP: ('application/gzip', 'csv.gz'),
+    DownloadCompression.ZSTD: ('application/zstd', 'csv.zst'),
+}
+
+# Compression of csv downloads for which no compression is requested
+DEFAULT_COMPRESSION = DownloadCompression.DEFLATE
+
+# Compression level of each codec for which no level is requested, and the levels that may be requested
+COMPRESSION_LEVELS = {
+    DownloadCompression.DEFLATE: (6, range(0, 10)),
+    DownloadCompression.GZIP: (6, range(0, 10)),
+    DownloadCompression.ZSTD: (3, range(1, 23)),
+}
+
+
+@dataclass
+class Compression:
+    codec: DownloadCompression = DEFAULT_COMPRESSION
+    level: int = None
+
+
+def get_compression(
+        compression: DownloadCompression = Query(DEFAULT_COMPRESSION, title='Compression of csv files'),
+        compression_level: int = Query(None, title='Compression level'),
+) -> Compression:
+    if compression not in COMPRESSION_LEVELS:
+        if compression_level is not None:
+            raise HTTPException(
+                HTTP_422_UNPROCESSABLE_ENTITY,
+                f'The {compression.value} compression does not take a compression level'
+            )
+
+        return Compression(compression)
+
+    default_level, levels = COMPRESSION_LEVELS[compression]
+
+    if compression_level is None:
+        compression_level = default_level
+    elif compression_level not in levels:
+        raise HTTPException(
+            HTTP_422_UNPROCESSABLE_ENTITY,
+            f'The {compression.value} compression level must be from {levels.start} to {levels.stop - 1}'
+        )
+
+    return Compression(compression, compression_level)
+
+
+class StreamBuffer(io.RawIOBase):
+    """
+    A write-only, non-seekable file object for file writers (zipfile, pyarrow) to write into, which is drained
+    after every write so that the file can be sent progressively. Because it cannot seek, zipfile writes each
+    entry's sizes and CRC in a data descriptor after the entry's data.
     """
-    Converts a list of dictionary items to a streaming response of a zipped folder containing a csv file
-    :param items: A list of dictionaries that contain the information for each row of the csv
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def get_download_data(statement, survey_id, data_variant, on_complete: Callable[[dict], None],
+                      download_format: DownloadFormat = DownloadFormat.CSV, unique: bool = False,
+                      use_copy: bool = False, netcdf_layout: NetCDFLayout = None, request: Request = None,
+                      materialise: bool = False, compression: Compression = Compression(),
+                      by_survey: bool = False) -> Response:
+    """
+    Returns a streaming response of a file containing the rows of a select statement. Rows are fetched, encoded,
+    compressed and sent in batches, so the download starts immediately and memory use does not grow with the
+    size of the result. Completed files are kept in the download cache, and a file that is found there is sent
+    as is, without running the statement, as described for get_file_response.
+    :param statement: The select statement whose rows make up the file
     :param survey_id: The id of the applicable survey for file naming purposes
     :param data_variant: The variant of the data for file naming purposes
+    :param on_complete: Called with the size and checksum of the file once it has been sent in full
+    :param download_format: A zipped csv file, a parquet file, an arrow IPC stream, a netCDF file, or a zipped ODV
+        spreadsheet file
+    :param unique: Whether duplicate rows should be removed from the result
+    :param use_copy: Whether a csv should be produced by the database using COPY, rather than encoded row by row
+    :param netcdf_layout: The dimensions of a netCDF file, which also give the stations of an ODV file; the netcdf
+        format is unavailable without one, and the odv format without a profile layout
+    :param request: The download request, whose method and Range headers apply to a cached file
+    :param compression: The compression of a csv file; files in other formats are compressed by their writers
+    :param materialise: Whether a file that is not cached should be produced into the cache in full even if its
+        download is interrupted, so that the download can be resumed from the cache. The file is produced on a
+        thread of its own, as described for MaterialisingStream, and is sent as it is produced. A HEAD request is
+        answered with the size and checksum of a cached file; the file is not produced for a HEAD request, which is
+        answered without them if the file is not cached.
+    :param by_survey: Whether the statement only reads the data of the survey survey_id, so that the file is cached
+        by the version of that survey's data, as described for get_data_version
     """
-    data_frame = pd.DataFrame(items)
+    check_download_format(download_format, netcdf_layout)
+
+    if download_format != DownloadFormat.CSV:
+        compression = Compression()
+
+    media_type, _ = get_download_file_type(download_format, compression)
+    file_name = get_download_file_name(survey_id, data_variant, download_format, compression)
+
+    cache_key = get_download_cache_key(statement, file_name, download_format, unique, use_copy, compression,
+                                       survey_id.replace('-', '/') if by_survey else None)
+    cached_file = get_cached_file(cache_key)
+
+    if cached_file:
+        return get_file_response(cached_file.path, cached_file.file_info, media_type, file_name, on_complete,
+                                 request)
+
+    if request and request.method == 'HEAD':
+        return StreamingResponse(
+            iter(()), media_type=media_type, headers={'Content-Disposition': f'attachment; filename={file_name}'}
+        )
+
+    row_counter = RowCounter()
+    get_chunks = partial(get_file_chunks, statement, survey_id, download_format, unique, use_copy, netcdf_layout,
+                         on_rows=row_counter, compression=compression)
+
+    if materialise:
+        file_chunks = MaterialisingStream(cache_key, get_chunks)
+    else:
+        file_chunks = get_cached_chunks(cache_key, get_chunks())
+
+    response = StreamingResponse(get_audited_chunks(file_chunks, on_complete, row_counter), media_type=media_type)
+    response.headers['Content-Disposition'] = f'attachment; filename={file_name}'
 
-    stream = StringIO()
+    return response
 
-    data_frame.to_csv(stream, index=False)
 
-    zip_buffer = BytesIO()
+def get_download_cache_key(statement, file_name: str, download_format: DownloadFormat = DownloadFormat.CSV,
+                           unique: bool = False, use_copy: bool = False,
+                           compression: Compression = Compression(), survey_id: str = None) -> str:
+    """
+    Returns the key under which a download is cached. Parameters are as for get_download_data.
+    :param survey_id: The survey whose data the statement reads, as described for get_data_version
+    """
+    return get_cache_key(
+        statement,
+        survey_id,
+        download_format=download_format.value,
+        file_name=file_name,
+        unique=unique,
+        use_copy=use_copy,
+        compression=compression.codec.value,
+        compression_level=compression.level,
+    )
 
-    file_info = get_file_stream_info(stream)
 
-    with zipfile.ZipFile(zip_buffer, mode="w") as zip_archive:
-        stream.seek(0)
-        zip_archive.writestr(f"survey_{survey_id}.csv", stream.read())
+def check_download_format(download_format: DownloadFormat, netcdf_layout: NetCDFLayout = None):
+    """Raises a 422 if the data cannot be laid out in the format, as described for get_download_data."""
+    if download_format == DownloadFormat.NETCDF and netcdf_layout is None:
+        raise HTTPException(HTTP_422_UNPROCESSABLE_ENTITY, 'The netcdf format is not available for this data')
 
-    response = StreamingResponse(iter([zip_buffer.getvalue()]), media_type="application/zip")
-    response.headers["Content-Disposition"] = f"attachment; filename=survey_{survey_id}_{data_variant}.zip"
+    if download_format == DownloadFormat.ODV and (netcdf_layout is None or
+                                                  netcdf_layout.feature_type != ODV_FEATURE_TYPE):
+        raise HTTPException(HTTP_422_UNPROCESSABLE_ENTITY, 'The odv format is only available for profile data')
 
-    return {
-        'zipped_response': response,
-        'file_info': file_info
+
+def get_file_response(file_path: str, file_info: dict, media_type: str, file_name: str,
+                      on_complete: Callable[[dict], None], request: Request = None) -> Response:
+    """
+    Returns a response of a finished file, giving its size in Content-Length, and its checksum in Content-MD5 and,
+    as a strong validator, in ETag. A single byte range requested with a Range header is sent as a 206 partial
+    response, so that an interrupted download can be resumed. The download is audited once: on_complete is
+    called for a request that starts at the beginning of the file, but not for a HEAD request or a request that
+    resumes the download.
+    :param file_info: The size and checksum of the file
+    """
+    etag = f'"{file_info["checksum"]}"'
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'Content-Disposition': f'attachment; filename="{file_name}"',
+        'Content-MD5': base64.b64encode(bytes.fromhex(file_info['checksum'])).decode(),
+        'ETag': etag,
     }
 
+    if request and request.method == 'HEAD':
+        return FileResponse(file_path, media_type=media_type, headers=headers)
+
+    byte_range = get_byte_range(request, etag, file_info['size']) if request else None
+    background = BackgroundTask(on_complete, file_info) if not byte_range or byte_range[0] == 0 else None
+
+    if not byte_range:
+        return FileResponse(file_path, media_type=media_type, headers=headers, background=background)
+
+    first, last = byte_range
+    headers['Content-Range'] = f'bytes {first}-{last}/{file_info["size"]}'
+    headers['Content-Length'] = str(last - first + 1)
+
+    return StreamingResponse(
+        get_file_range_chunks(open(file_path, 'rb'), first, last),
+        status_code=HTTP_206_PARTIAL_CONTENT,
+        media_type=media_type,
+        headers=headers,
+        background=background,
+    )
+
+
+def get_byte_range(request: Request, etag: str, size: int) -> tuple[int, int] | None:
+    """
+    Returns the first and last byte of the byte range requested by the Range header of a request, or None if the
+    whole file is to be sent: if there is no Range header, if it cannot be parsed or requests several ranges, or
+    if the request's If-Range header does not match the file's ETag. A 416 is raised if the range lies beyond the
+    end of the file.
+    """
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
 
-def get_file_stream_info(stream: StringIO) -> dict:
-    stream_value = stream.getvalue()
-    return {
-        'checksum': hashlib.md5(stream_value.encode()).hexdigest(),
-        'size': len(stream_value),
+    if not range_header or (if_range and if_range != etag):
+        return None
+
+    if not (match := re.fullmatch(r'bytes=(\d*)-(\d*)', range_header.strip())) or match.groups() == ('', ''):
+        return None
+
+    first, last = match.groups()
+    if not first:
+        # A suffix range gives the number of bytes at the end of the file
+        first, last = max(size - int(last), 0), size - 1
+    else:
+        first, last = int(first), min(int(last), size - 1) if last else size - 1
+
+    if first > last:
+        raise HTTPException(HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE, headers={'Content-Range': f'bytes */{size}'})
+
+    return first, last
+
+
+def get_file_range_chunks(file, first: int, last: int):
+    with file:
+        file.seek(first)
+        remaining = last - first + 1
+
+        while remaining and (chunk := file.read(min(FILE_CHUNK_SIZE, remaining))):
+            remaining -= len(chunk)
+            yield chunk
+
+
+def select_columns(statement: Select, columns: list[str] | None, key_columns: list[str] = ()) -> Select:
+    """
+    Narrows the select list of a statement to the requested columns, in the statement's column order, so that
+    only those are read and sent. The statement's columns are the columns that may be requested for its data
+    type, and a 422 is raised for any others. The key columns that identify a row are always included.
+    :param columns: Column names, which may also be comma separated; all columns are selected if there are none
+    :param key_columns: The names of the statement's key columns
+    """
+    if not columns:
+        return statement
+
+    requested_columns = {name.strip() for value in columns for name in value.split(',') if name.strip()}
+    available_columns = [column.key for column in statement.selected_columns]
+
+    if unknown_columns := requested_columns.difference(available_columns):
+        raise HTTPException(
+            HTTP_422_UNPROCESSABLE_ENTITY,
+            f'Unknown columns: {", ".join(sorted(unknown_columns))}. '
+            f'Available columns: {", ".join(available_columns)}'
+        )
+
+    selected_columns = requested_columns.union(key_columns)
+
+    return statement.with_only_columns(
+        *(column for column in statement.selected_columns if column.key in selected_columns),
+        maintain_column_froms=True
+    )
+
+
+def get_download_file_type(download_format: DownloadFormat,
+                           compression: Compression = Compression()) -> tuple[str, str]:
+    """Returns the media type and file extension of a download."""
+    if download_format == DownloadFormat.CSV:
+        return CSV_COMPRESSION_FILE_TYPES[compression.codec]
+
+    return DOWNLOAD_FILE_TYPES[download_format]
+
+
+def get_download_file_name(survey_id, data_variant, download_format: DownloadFormat,
+                           compression: Compression = Compression()) -> str:
+    _, file_extension = get_download_file_type(download_format, compression)
+    return f'survey_{survey_id}_{data_variant}.{file_extension}'
+
+
+def get_file_chunks(statement, survey_id, download_format: DownloadFormat, unique: bool = False,
+                    use_copy: bool = False, netcdf_layout: NetCDFLayout = None,
+                    on_rows: Callable[[int], None] = None, compression: Compression = Compression()):
+    """
+    Returns an iterator over the chunks of a file containing the rows of a select statement, or raises a 404 if
+    there are no rows. Parameters are as for get_download_data.
+    :param on_rows: Called with the number of rows in each batch as it is fetched
+    """
+    match download_format:
+        case DownloadFormat.PARQUET:
+            row_batches = get_non_empty(get_row_batches(statement, unique, on_rows))
+            return get_parquet_chunks(row_batches, get_arrow_schema(statement))
+        case DownloadFormat.ARROW:
+            row_batches = get_non_empty(get_row_batches(statement, unique, on_rows))
+            return get_arrow_stream_chunks(row_batches, get_arrow_schema(statement))
+        case DownloadFormat.NETCDF:
+            dimensions = get_netcdf_dimensions(statement, netcdf_layout)
+            if not dimensions[0]:
+                raise HTTPException(HTTP_404_NOT_FOUND)
+
+            return get_netcdf_chunks(
+                statement, netcdf_layout, dimensions, partial(get_row_batches, unique=unique, on_rows=on_rows)
+            )
+        case DownloadFormat.ODV:
+            odv_chunks = get_non_empty(get_odv_chunks(
+                statement, netcdf_layout, partial(get_row_batches, unique=unique, on_rows=on_rows)
+            ))
+            return get_zip_chunks(f'survey_{survey_id}.txt', odv_chunks)
+        case _:
+            if use_copy:
+                csv_chunks = iter(CopyCsvStream(statement, unique))
+            else:
+                csv_chunks = get_csv_chunks(statement, unique, on_rows)
+
+            csv_chunks = get_non_empty(csv_chunks)
+
+            match compression.codec:
+                case DownloadCompression.GZIP:
+                    return get_gzip_chunks(csv_chunks, compression.level)
+                case DownloadCompression.ZSTD:
+                    return get_zstd_chunks(csv_chunks, compression.level)
+                case _:
+                    return get_zip_chunks(f'survey_{survey_id}.csv', csv_chunks, *get_zip_compression(compression))
+
+
+def get_non_empty(chunks):
+    """
+    Returns an iterator over the given chunks, or raises a 404 if there are none. The first chunk is fetched to
+    find out, so the query runs before the response is started.
+    """
+    if (first_chunk := next(chunks, None)) is None:
+        raise HTTPException(HTTP_404_NOT_FOUND)
+
+    return chain([first_chunk], chunks)
+
+
+def get_row_batches(statement, unique: bool = False, on_rows: Callable[[int], None] = None,
+                    connection: Connection = None):
+    """
+    Executes a statement using a server-side cursor and yields the result in lists of DOWNLOAD_BATCH_SIZE rows.
+
+    The statement runs on its own connection rather than the request session, as the rows are consumed while the
+    response is being streamed, after the request session has been removed. A connection may be given instead,
+    if the statement depends on temporary tables created on it. Numeric columns are fetched as floats where that
+    is exact, as described for get_float_numeric_statement. Duplicate rows are removed by the database, with
+    SELECT DISTINCT, so that the rows are not held in memory while the result is streamed.
+    """
+    if unique:
+        statement = statement.distinct()
+
+    with nullcontext(connection) if connection else engine.connect() as connection:
+        result = connection.execution_options(yield_per=DOWNLOAD_BATCH_SIZE).execute(
+            get_float_numeric_statement(statement)
+        )
+
+        for partition in result.partitions():
+            if on_rows:
+                on_rows(len(partition))
+
+            yield partition
+
+
+def get_column_names(statement) -> list[str]:
+    return [column.key for column in statement.selected_columns]
+
+
+def get_csv_chunks(statement, unique: bool = False, on_rows: Callable[[int], None] = None,
+                   connection: Connection = None):
+    """
+    Yields the rows of a statement as utf-8 encoded csv chunks of DOWNLOAD_BATCH_SIZE rows. The first chunk
+    includes the header. Nothing is yielded if there are no rows.
+    """
+    columns = get_column_names(statement)
+    header = True
+
+    for rows in get_row_batches(statement, unique, on_rows, connection):
+        data_frame = pd.DataFrame(rows, columns=columns)
+        yield data_frame.to_csv(index=False, header=header).encode()
+        header = False
+
+
+class CopyCsvStream:
+    """
+    Produces the csv of a statement's rows with COPY (...) TO STDOUT WITH CSV HEADER, so that rows are encoded by
+    the database instead of being turned into Row objects and data frames. copy_expert blocks until the copy is
+    complete, so it runs on a background thread and writes into a bounded queue from which the chunks are yielded.
+
+    Iterating yields the csv in chunks of about COPY_CHUNK_SIZE bytes, the first including the header. As with
+    get_csv_chunks, nothing is yielded if there are no rows.
+    """
+    _done = object()
+
+    def __init__(self, statement, unique: bool = False):
+        if unique:
+            statement = statement.distinct()
+
+        self._statement = statement
+        self._queue = queue.Queue(maxsize=COPY_QUEUE_SIZE)
+        self._cancelled = threading.Event()
+        self._buffer = bytearray()
+
+    def __iter__(self):
+        thread = threading.Thread(target=self._copy, daemon=True)
+        thread.start()
+
+        try:
+            first_chunk = self._get()
+
+            # The buffer is only flushed early once it exceeds COPY_CHUNK_SIZE, so a first chunk holding nothing
+            # but the header means that the copy finished without any rows
+            if first_chunk is self._done or not first_chunk.partition(b'\n')[2]:
+                return
+
+            yield first_chunk
+
+            while (chunk := self._get()) is not self._done:
+                yield chunk
+        finally:
+            self._cancelled.set()
+
+    def write(self, data) -> int:
+        """Called by copy_expert with the output of the copy."""
+        self._buffer += data
+        if len(self._buffer) >= COPY_CHUNK_SIZE:
+            self._put(bytes(self._buffer))
+            self._buffer.clear()
+
+        return len(data)
+
+    def _copy(self):
+        connection = engine.raw_connection()
+        try:
+            with connection.cursor() as cursor:
+                # copy_expert does not take parameters, so they are bound by psycopg2 before the select is wrapped
+                compiled = self._statement.compile(
+                    dialect=engine.dialect,
+                    compile_kwargs={'render_postcompile': True}
+                )
+                select_sql = cursor.mogrify(str(compiled), compiled.params).decode()
+                cursor.copy_expert(f'COPY ({select_sql}) TO STDOUT WITH CSV HEADER', self)
+
+            if self._buffer:
+                self._put(bytes(self._buffer))
+
+            self._put(self._done)
+        except CopyCancelled:
+            pass
+        except Exception as e:
+            try:
+                self._put(e)
+            except CopyCancelled:
+                pass
+        finally:
+            connection.close()
+
+    def _put(self, item):
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+        raise CopyCancelled
+
+    def _get(self):
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+
+        return item
+
+
+class CopyCancelled(Exception):
+    """Raised in the copy thread when the response is no longer consuming its output."""
+
+
+def get_zip_compression(compression: Compression) -> tuple[int, int | None]:
+    """Returns the zipfile compression method and level of a zip archive compression."""
+    if compression.codec == DownloadCompression.STORE:
+        return zipfile.ZIP_STORED, None
+
+    return zipfile.ZIP_DEFLATED, compression.level
+
+
+def get_zip_chunks(file_name: str, file_chunks, compression: int = zipfile.ZIP_DEFLATED,
+                   compression_level: int = None):
+    """
+    Zips the chunks of a single file progressively, yielding the archive bytes as they are produced.
+    """
+    return get_zip_archive_chunks([(file_name, file_chunks)], compression, compression_level)
+
+
+def get_zip_archive_chunks(files, compression: int = zipfile.ZIP_DEFLATED, compression_level: int = None):
+    """
+    Zips files, given as pairs of file name and chunks, progressively, yielding the archive bytes as they are
+    produced. Files without any chunks are left out, and nothing is yielded if there are no files with chunks.
+    :param compression: The zipfile compression method of the entries
+    :param compression_level: The compression level, or None for the method's default
+    """
+    zip_buffer = StreamBuffer()
+    file_count = 0
+
+    with zipfile.ZipFile(zip_buffer, mode='w', compression=compression,
+                         compresslevel=compression_level) as zip_archive:
+        for file_name, file_chunks in files:
+            file_chunks = iter(file_chunks)
+            if (first_chunk := next(file_chunks, None)) is None:
+                continue
+
+            with zip_archive.open(file_name, mode='w', force_zip64=True) as zip_file:
+                for file_chunk in chain([first_chunk], file_chunks):
+                    zip_file.write(file_chunk)
+                    if data := zip_buffer.drain():
+                        yield data
+
+            file_count += 1
+
+    if file_count:
+        yield zip_buffer.drain()
+
+
+def get_gzip_chunks(file_chunks, compression_level: int):
+    """
+    Compresses the chunks of a file to a gzip stream progressively, yielding the compressed bytes as they are
+    produced. The modification time in the header is left out, so that the same file gives the same stream.
+    """
+    gzip_buffer = StreamBuffer()
+
+    with gzip.GzipFile(fileobj=gzip_buffer, mode='wb', compresslevel=compression_level, mtime=0) as gzip_file:
+        for file_chunk in file_chunks:
+            gzip_file.write(file_chunk)
+            if data := gzip_buffer.drain():
+                yield data
+
+    yield gzip_buffer.drain()
+
+
+def get_zstd_chunks(file_chunks, compression_level: int):
+    """
+    Compresses the chunks of a file to a zstandard frame progressively, yielding the compressed bytes as they are
+    produced.
+    """
+    zstd_buffer = StreamBuffer()
+    compressor = zstandard.ZstdCompressor(level=compression_level)
+
+    with compressor.stream_writer(zstd_buffer, closefd=False) as zstd_file:
+        for file_chunk in file_chunks:
+            zstd_file.write(file_chunk)
+            if data := zstd_buffer.drain():
+                yield data
+
+    yield zstd_buffer.drain()
+
+
+def get_bundle_data(get_statements: Callable[[Connection], dict[str, Select]], survey_id, data_variant,
+                    on_complete: Callable[[dict], None], unique: bool = False,
+                    compression: Compression = Compression()) -> StreamingResponse:
+    """
+    Returns a streaming response of a zip file containing a csv file for each of a set of statements. The
+    statements are run one after the other on one connection, which is passed to get_statements to create any
+    temporary tables that they share. Statements without rows are left out, and if none have rows a 404 is
+    raised.
+    :param get_statements: Called with the connection, returns the statements by name
+    :param compression: The compression of the archive, which must be deflate or store
+    """
+    if CSV_COMPRESSION_FILE_TYPES[compression.codec] != DOWNLOAD_FILE_TYPES[DownloadFormat.CSV]:
+        raise HTTPException(HTTP_422_UNPROCESSABLE_ENTITY, 'A bundle can only be compressed as a zip archive')
+
+    row_counter = RowCounter()
+    file_chunks = get_non_empty(get_bundle_zip_chunks(get_statements, survey_id, unique, compression, row_counter))
+    file_name = get_download_file_name(survey_id, data_variant, DownloadFormat.CSV)
+
+    response = StreamingResponse(get_audited_chunks(file_chunks, on_complete, row_counter),
+                                 media_type='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename={file_name}'
+
+    return response
+
+
+def get_bundle_zip_chunks(get_statements: Callable[[Connection], dict[str, Select]], survey_id,
+                          unique: bool = False, compression: Compression = Compression(),
+                          on_rows: Callable[[int], None] = None):
+    with engine.connect() as connection:
+        statements = get_statements(connection)
+
+        files = (
+            (f'survey_{survey_id}_{name}.csv', get_csv_chunks(statement, unique, on_rows, connection))
+            for name, statement in statements.items()
+        )
+
+        yield from get_zip_archive_chunks(files, *get_zip_compression(compression))
+
+
+def get_batch_data(statements: dict[str, Select], data_variant,
+                   on_complete: Callable[[dict], None]) -> StreamingResponse:
+    """
+    Returns a streaming response of a zip file containing a csv file for each of a set of surveys. The surveys'
+    statements are run concurrently on up to BATCH_DOWNLOAD_CONNECTIONS connections, and each csv file is added to
+    the archive as soon as it is complete. Surveys without rows are left out, and if none have rows a 404 is
+    raised.
+    :param statements: The statement of each survey, by survey id
+    """
+    file_chunks = get_non_empty(get_batch_zip_chunks(statements))
+    file_name = get_download_file_name('batch', data_variant, DownloadFormat.CSV)
+
+    response = StreamingResponse(get_audited_chunks(file_chunks, on_complete), media_type='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename={file_name}'
+
+    return response
+
+
+def get_batch_zip_chunks(statements: dict[str, Select]):
+    """
+    Yields the chunks of a zip file with a csv file per survey. Each survey's csv is written to a temporary file by
+    a worker, since the archive can only take one file at a time; the archive is streamed while the remaining
+    surveys are being queried.
+    """
+    executor = ThreadPoolExecutor(max_workers=BATCH_DOWNLOAD_CONNECTIONS, thread_name_prefix='batch-download')
+    futures = {executor.submit(write_csv_file, statement): survey_id for survey_id, statement in statements.items()}
+
+    try:
+        yield from get_zip_archive_chunks(
+            (f'survey_{futures[future]}.csv', get_csv_file_chunks(future.result()))
+            for future in as_completed(futures)
+        )
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def write_csv_file(statement) -> BinaryIO:
+    """Writes the rows of a statement to an anonymous temporary csv file, which is removed once it is closed."""
+    csv_file = tempfile.TemporaryFile()
+
+    try:
+        for chunk in get_csv_chunks(statement):
+            csv_file.write(chunk)
+    except BaseException:
+        csv_file.close()
+        raise
+
+    return csv_file
+
+
+def get_csv_file_chunks(csv_file):
+    with csv_file:
+        csv_file.seek(0)
+        while chunk := csv_file.read(FILE_CHUNK_SIZE):
+            yield chunk
+
+
+def create_temporary_table(connection: Connection, table_name: str, statement) -> Table:
+    """
+    Creates a temporary table from the rows of a statement, returning a table with the statement's columns that
+    can be selected from on the same connection. The table is dropped when the connection's transaction ends.
+    """
+    compiled = statement.compile(dialect=engine.dialect, compile_kwargs={'render_postcompile': True})
+    connection.exec_driver_sql(
+        f'CREATE TEMPORARY TABLE {table_name} ON COMMIT DROP AS {compiled}',
+        compiled.params
+    )
+    connection.exec_driver_sql(f'ANALYZE {table_name}')
+
+    return Table(
+        table_name,
+        MetaData(),
+        *(Column(column.key, column.type) for column in statement.selected_columns)
+    )
+
+
+def get_parquet_chunks(row_batches, schema: pa.Schema):
+    """
+    Writes batches of rows to a parquet file with the given schema, one row group per batch, yielding the file's
+    bytes as they are produced.
+    """
+    parquet_buffer = StreamBuffer()
+
+    with pq.ParquetWriter(parquet_buffer, schema) as parquet_writer:
+        for rows in row_batches:
+            parquet_writer.write_batch(get_record_batch(rows, schema))
+            if data := parquet_buffer.drain():
+                yield data
+
+    yield parquet_buffer.drain()
+
+
+def get_arrow_stream_chunks(row_batches, schema: pa.Schema):
+    """
+    Writes batches of rows to an arrow IPC stream with the given schema, one record batch per batch of rows,
+    yielding each record batch as soon as it has been written.
+    """
+    arrow_buffer = StreamBuffer()
+
+    with pa.ipc.new_stream(arrow_buffer, schema) as stream_writer:
+        for rows in row_batches:
+            stream_writer.write_batch(get_record_batch(rows, schema))
+            if data := arrow_buffer.drain():
+                yield data
+
+    yield arrow_buffer.drain()
+
+
+class RowCounter:
+    """Counts the rows of a file as it is produced; it is passed as the on_rows callback of the file's chunks."""
+
+    def __init__(self):
+        self.row_count = 0
+
+    def __call__(self, row_count: int):
+        self.row_count += row_count
+
+
+def get_audited_chunks(chunks, on_complete: Callable[[dict], None], row_counter: RowCounter = None):
+    """
+    Passes the chunks of a download through, accumulating their size and checksum, which are passed to
+    on_complete after the last chunk has been sent. If the rows of the file were counted by row_counter as it was
+    produced, the row count and the number of seconds taken to produce and send the file are passed too, from
+    which get_rows_per_second measures the rate of downloads.
+    """
+    checksum = hashlib.md5()
+    size = 0
+    started = time.monotonic()
+
+    for chunk in chunks:
+        checksum.update(chunk)
+        size += len(chunk)
+        yield chunk
+
+    file_info = {
+        'checksum': checksum.hexdigest(),
+        'size': size,
     }
 
+    if row_counter and row_counter.row_count:
+        file_info['row_count'] = row_counter.row_count
+        file_info['seconds'] = round(time.monotonic() - started, 3)
+
+    on_complete(file_info)
+
 
 def get_table_data(fetched_model, fields_to_ignore: list = []) -> dict:
     """
@@ -67,12 +859,20 @@ def get_table_data(fetched_model, fields_to_ignore: list = []) -> dict:
 
 
 def audit_download_request(auth: Authorized, file_info: dict, survey_type: str, **request_params):
-    DownloadAudit(
-        timestamp=datetime.now(timezone.utc),
-        client_id=auth.client_id,
-        user_id=auth.user_id,
-        survey_type=survey_type,
-        parameters=json.dumps(request_params, default=str, indent=2),
-        download_file_size=file_info.get('size'),
-        download_file_checksum=file_info.get('checksum')
-    ).save()
+    """
+    Records a completed download. This runs once the response has been streamed, after the request session has
+    been committed and removed, so the audit record is committed in a session of its own.
+    """
+    with Session.session_factory() as session:
+        session.add(DownloadAudit(
+            timestamp=datetime.now(timezone.utc),
+            client_id=auth.client_id,
+            user_id=auth.user_id,
+            survey_type=survey_type,
+            parameters=json.dumps(request_params, default=str, indent=2),
+            download_file_size=file_info.get('size'),
+            download_file_checksum=file_info.get('checksum'),
+            row_count=file_info.get('row_count'),
+            download_seconds=file_info.get('seconds'),
+        ))
+        session.commit()
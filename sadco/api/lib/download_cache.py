@@ -0,0 +1,326 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Iterator
+
+from sqlalchemy import String, bindparam, text
+from sqlalchemy.sql.util import find_tables
+
+from sadco.db import Session, engine
+
+logger = logging.getLogger(__name__)
+
+# Directory in which finished download files are kept
+DOWNLOAD_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'sadco', 'downloads')
+
+# Total size of the cached files, beyond which the least recently used are evicted
+DOWNLOAD_CACHE_SIZE = 20 * 1024 ** 3
+
+# Directory in which pre-rendered downloads are kept; these are replaced by each pre-rendering run, and are not
+# evicted to make room for other downloads
+PREGENERATED_DOWNLOAD_DIR = os.path.join(tempfile.gettempdir(), 'sadco', 'pregenerated')
+
+# Number of chunks of a materialised file that may be waiting to be sent before the thread producing it blocks
+MATERIALISE_QUEUE_SIZE = 16
+
+
+@dataclass
+class CachedFile:
+    path: str
+    file_info: dict
+
+
+def get_cache_key(statement, survey_id: str = None, **file_params) -> str:
+    """
+    Returns the key under which the file produced from a statement is cached. The key is a digest of the
+    statement's SQL and parameters, the parameters that determine how the file is encoded, and the version of
+    the data that the statement reads, so that a file is no longer found once its data has changed.
+    :param survey_id: The survey whose data the statement reads, as described for get_data_version
+    """
+    compiled = statement.compile(dialect=engine.dialect, compile_kwargs={'render_postcompile': True})
+
+    key = json.dumps(dict(
+        sql=str(compiled),
+        sql_params=compiled.params,
+        data_version=get_data_version(statement, survey_id),
+        **file_params
+    ), default=str, sort_keys=True)
+
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+@dataclass(frozen=True)
+class VersionedTables:
+    table_names: tuple[str, ...]
+    survey_table_names: tuple[str, ...]
+
+
+def get_data_version(statement, survey_id: str = None) -> int:
+    """
+    Returns the version of the data in the tables read by a statement, which is the sum of the tables' versions in
+    sadco.data_version. A table's version is bumped by a trigger whenever its data is changed, so the sum goes up
+    with any change committed to the tables. Versions are only kept for tables that store rows, which are found
+    by get_versioned_tables.
+    :param survey_id: The survey whose data the statement reads, if it only reads the data of one survey. The
+        tables that hold survey data are then versioned by the survey's version in sadco.survey_data_version,
+        so that the version only goes up with changes to the survey's own data.
+    """
+    versioned_tables = get_versioned_tables(
+        frozenset(table.fullname for table in find_tables(statement, include_joins=True))
+    )
+    table_names = versioned_tables.table_names
+
+    if survey_id is not None:
+        table_names = [name for name in table_names if name not in versioned_tables.survey_table_names]
+
+    return Session.execute(
+        text(
+            "SELECT coalesce((SELECT sum(version) FROM sadco.data_version WHERE table_name IN :table_names), 0)"
+            "    + coalesce((SELECT version FROM sadco.survey_data_version WHERE survey_id = :survey_id), 0)"
+        ).bindparams(bindparam('table_names', expanding=True, type_=String)),
+        {'table_names': list(table_names), 'survey_id': survey_id}
+    ).scalar_one()
+
+
+@lru_cache
+def get_versioned_tables(table_names: frozenset[str]) -> VersionedTables:
+    """
+    Returns the relations that store the rows of a set of tables, following a view to the tables that it reads,
+    and a partitioned table to its partitions, together with those of the relations that hold survey data,
+    which have a survey data version trigger. The relations only change with a migration of the schema, after
+    which the API is restarted, so they are looked up in the catalog once per process for each set of tables.
+    """
+    relations = Session.execute(
+        text(
+            "WITH RECURSIVE dependencies (relid, dependency_relid) AS ("
+            "    SELECT rewrite.ev_class, depend.refobjid FROM pg_rewrite rewrite"
+            "    JOIN pg_depend depend ON depend.classid = 'pg_rewrite'::regclass AND depend.objid = rewrite.oid"
+            "    AND depend.refclassid = 'pg_class'::regclass AND depend.refobjid <> rewrite.ev_class"
+            "    UNION ALL SELECT inhparent, inhrelid FROM pg_inherits"
+            "), relations (relid) AS ("
+            "    SELECT class.oid FROM pg_class class JOIN pg_namespace namespace ON namespace.oid = class.relnamespace"
+            "    WHERE namespace.nspname || '.' || class.relname IN :table_names"
+            "    UNION SELECT dependency_relid FROM relations JOIN dependencies USING (relid)"
+            ") "
+            "SELECT namespace.nspname || '.' || class.relname AS table_name, EXISTS ("
+            "    SELECT FROM pg_trigger WHERE tgrelid = class.oid AND tgname = 'survey_data_version_insert_trigger'"
+            ") AS survey_data FROM relations"
+            "    JOIN pg_class class ON class.oid = relations.relid"
+            "    JOIN pg_namespace namespace ON namespace.oid = class.relnamespace"
+        ).bindparams(bindparam('table_names', expanding=True)),
+        {'table_names': sorted(table_names)}
+    ).all()
+
+    return VersionedTables(
+        table_names=tuple(relation.table_name for relation in relations),
+        survey_table_names=tuple(relation.table_name for relation in relations if relation.survey_data),
+    )
+
+
+def get_cached_file(cache_key: str, pregenerated: bool = None) -> CachedFile | None:
+    """
+    Returns the pre-rendered or cached file for a key, marking it as recently used, or None if there is none.
+    :param pregenerated: Whether to only look for a pre-rendered file, or only for a cached file; both are looked
+        for if not given
+    """
+    cache_dirs = {True: [PREGENERATED_DOWNLOAD_DIR], False: [DOWNLOAD_CACHE_DIR]}.get(
+        pregenerated, [PREGENERATED_DOWNLOAD_DIR, DOWNLOAD_CACHE_DIR]
+    )
+
+    for file_path in [os.path.join(cache_dir, cache_key) for cache_dir in cache_dirs]:
+        try:
+            with open(f'{file_path}.json') as info_file:
+                file_info = json.load(info_file)
+
+            os.utime(file_path)
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+
+        return CachedFile(path=file_path, file_info=file_info)
+
+    return None
+
+
+def get_cached_chunks(cache_key: str, chunks, pregenerated: bool = False, file_info: dict = None):
+    """
+    Passes the chunks of a download through, writing them to a temporary file in the cache. Once the last chunk
+    has been sent, the file is moved into the cache under cache_key, and the least recently used files are evicted
+    to keep the cache within DOWNLOAD_CACHE_SIZE. If the download is not completed, the file is discarded.
+    :param pregenerated: Whether the file is a pre-rendered download, which is kept in PREGENERATED_DOWNLOAD_DIR
+        instead of the cache, and is not evicted
+    :param file_info: Details that are recorded with the file's size and checksum
+    """
+    cache_dir = PREGENERATED_DOWNLOAD_DIR if pregenerated else DOWNLOAD_CACHE_DIR
+    os.makedirs(cache_dir, exist_ok=True)
+    file_path = os.path.join(cache_dir, cache_key)
+    checksum = hashlib.md5()
+    size = 0
+
+    with tempfile.NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as cache_file:
+        temp_path = cache_file.name
+
+    try:
+        with open(temp_path, 'wb') as cache_file:
+            for chunk in chunks:
+                cache_file.write(chunk)
+                checksum.update(chunk)
+                size += len(chunk)
+                yield chunk
+
+        os.replace(temp_path, file_path)
+        write_file_info(file_path, (file_info or {}) | {
+            'checksum': checksum.hexdigest(),
+            'size': size,
+        })
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    if not pregenerated:
+        evict_cached_files()
+
+
+class MaterialisingStream:
+    """
+    Produces a file into the cache on a thread of its own, as get_cached_chunks does, yielding its chunks as they
+    are produced. If the download is abandoned before the file is complete, the thread carries on producing the
+    file into the cache without queuing its chunks, so that the download can then be resumed from the cache.
+    """
+    _done = object()
+
+    def __init__(self, cache_key: str, get_chunks: Callable[[], Iterator[bytes]]):
+        """
+        :param get_chunks: Returns the chunks of the file; it is called on the producing thread, so that the
+            statement of the download is run there
+        """
+        self._cache_key = cache_key
+        self._get_chunks = get_chunks
+        self._queue = queue.Queue(maxsize=MATERIALISE_QUEUE_SIZE)
+        self._abandoned = threading.Event()
+
+    def __iter__(self):
+        threading.Thread(target=self._materialise, name='download-materialise', daemon=True).start()
+
+        try:
+            while (chunk := self._get()) is not self._done:
+                yield chunk
+        finally:
+            self._abandoned.set()
+
+    def _materialise(self):
+        try:
+            for chunk in get_cached_chunks(self._cache_key, self._get_chunks()):
+                self._put(chunk)
+
+            self._put(self._done)
+        except Exception as e:
+            if self._abandoned.is_set():
+                logger.exception(f'Download file {self._cache_key} could not be materialised')
+
+            self._put(e)
+
+    def _put(self, item):
+        while not self._abandoned.is_set():
+            try:
+                self._queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self):
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+
+        return item
+
+
+def create_cached_file(cache_key: str, chunks, pregenerated: bool = False,
+                       file_info: dict = None) -> CachedFile | None:
+    """
+    Writes the chunks of a download to the cache without sending them, returning the cached file. None is returned
+    if the file is too large to be kept. Parameters are as for get_cached_chunks.
+    """
+    for _ in get_cached_chunks(cache_key, chunks, pregenerated, file_info):
+        pass
+
+    return get_cached_file(cache_key, pregenerated)
+
+
+def write_file_info(file_path: str, file_info: dict):
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(file_path), suffix='.tmp', delete=False) as info_file:
+        json.dump(file_info, info_file)
+
+    os.replace(info_file.name, f'{file_path}.json')
+
+
+def evict_cached_files():
+    """
+    Removes the least recently used cached files until their total size is within DOWNLOAD_CACHE_SIZE.
+    """
+    cached_files = []
+    for entry in os.scandir(DOWNLOAD_CACHE_DIR):
+        if entry.is_file() and '.' not in entry.name:
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            cached_files.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in cached_files)
+
+    for _, size, file_path in sorted(cached_files):
+        if total_size <= DOWNLOAD_CACHE_SIZE:
+            break
+
+        for path in (f'{file_path}.json', file_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        total_size -= size
+
+
+def remove_pregenerated_files(survey_type: str, used_since: float) -> int:
+    """
+    Removes the pre-rendered downloads of a survey type that have not been used since a given time, returning the
+    number that were removed.
+    :param used_since: A time, as given by time.time()
+    """
+    if not os.path.isdir(PREGENERATED_DOWNLOAD_DIR):
+        return 0
+
+    removed_count = 0
+
+    for entry in os.scandir(PREGENERATED_DOWNLOAD_DIR):
+        if not entry.name.endswith('.json'):
+            continue
+
+        file_path = entry.path.removesuffix('.json')
+
+        try:
+            with open(entry.path) as info_file:
+                if json.load(info_file).get('survey_type') != survey_type:
+                    continue
+
+            if os.stat(file_path).st_mtime >= used_since:
+                continue
+        except (FileNotFoundError, json.JSONDecodeError):
+            continue
+
+        for path in (entry.path, file_path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+        removed_count += 1
+
+    return removed_count
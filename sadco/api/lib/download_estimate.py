@@ -0,0 +1,87 @@
+from sqlalchemy import select, types
+from sqlalchemy.sql import Select
+
+from sadco.api.models import DownloadEstimateModel
+from sadco.db import Session
+from sadco.db.models import DownloadAudit
+
+# Number of recent downloads from which the rate at which rows are produced is measured
+THROUGHPUT_HISTORY_DOWNLOADS = 20
+
+# Rate at which rows are assumed to be produced before any downloads have been timed
+DEFAULT_ROWS_PER_SECOND = 20000
+
+# Widths of csv values of types whose width is not declared
+VALUE_WIDTHS = {
+    types.DateTime: 19,
+    types.Date: 10,
+    types.Time: 8,
+    types.Integer: 11,
+    types.Float: 17,
+    types.Boolean: 5,
+}
+
+# Width of csv values of any other type
+DEFAULT_VALUE_WIDTH = 16
+
+
+def get_download_estimate(*parts: tuple[int, Select]) -> DownloadEstimateModel:
+    """
+    Estimates the size of a download, and the time taken to produce it, before any of its data is queried.
+    :param parts: The row count and statement of each file in the download
+    """
+    row_count = sum(count for count, _ in parts)
+
+    return DownloadEstimateModel(
+        row_count=row_count,
+        uncompressed_size=sum(count * get_row_width(statement) for count, statement in parts),
+        generation_seconds=round(row_count / get_rows_per_second(), 1),
+    )
+
+
+def get_row_width(statement: Select) -> int:
+    """
+    Returns the width of a csv row of the statement, from the declared types of its columns. Numeric and string
+    columns are taken at their declared precision and length, so the width is an upper bound for most rows.
+    """
+    return sum(get_value_width(column.type) + 1 for column in statement.selected_columns)
+
+
+def get_value_width(column_type: types.TypeEngine) -> int:
+    if isinstance(column_type, types.Numeric) and not isinstance(column_type, types.Float):
+        if column_type.precision is not None:
+            # The digits, with a sign and a decimal point
+            return column_type.precision + 2
+
+    elif isinstance(column_type, types.String):
+        if column_type.length is not None:
+            return column_type.length
+
+    else:
+        for type_class, width in VALUE_WIDTHS.items():
+            if isinstance(column_type, type_class):
+                return width
+
+    return DEFAULT_VALUE_WIDTH
+
+
+def get_rows_per_second() -> float:
+    """
+    Returns the rate at which recent downloads produced their rows, from the row counts and durations recorded in
+    their audits. Only downloads whose files were produced for them are timed; files sent from the download cache
+    or from download jobs, and batch downloads, whose surveys are queried concurrently, are not.
+    """
+    downloads = Session.execute(
+        select(DownloadAudit.row_count, DownloadAudit.download_seconds)
+        .where(DownloadAudit.row_count > 0, DownloadAudit.download_seconds > 0)
+        .order_by(DownloadAudit.timestamp.desc())
+        .limit(THROUGHPUT_HISTORY_DOWNLOADS)
+    ).all()
+
+    rows = sum(download.row_count for download in downloads)
+    seconds = sum(float(download.download_seconds) for download in downloads)
+
+    if not rows or seconds <= 0:
+        return DEFAULT_ROWS_PER_SECOND
+
+    return rows / seconds
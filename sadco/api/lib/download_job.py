@@ -0,0 +1,248 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from uuid import uuid4
+
+from fastapi import HTTPException
+from sqlalchemy import func, select, update
+from starlette.status import HTTP_404_NOT_FOUND
+
+from sadco.api.lib.auth import Authorized
+from sadco.api.lib.download import DownloadFormat, check_download_format, get_download_file_name, get_file_chunks
+from sadco.api.lib.netcdf import NetCDFLayout
+from sadco.db import Session
+from sadco.db.models import DownloadJob
+
+logger = logging.getLogger(__name__)
+
+# Directory in which the files produced by download jobs are kept until they expire
+DOWNLOAD_JOB_DIR = os.path.join(tempfile.gettempdir(), 'sadco', 'jobs')
+
+# Number of download jobs that are processed at the same time
+DOWNLOAD_JOB_WORKERS = 2
+
+# Time for which the file of a completed job is kept
+DOWNLOAD_JOB_RETENTION = timedelta(days=7)
+
+# Interval at which this process's jobs are marked as alive, and jobs that are no longer alive or have expired are
+# dealt with
+DOWNLOAD_JOB_MAINTENANCE_INTERVAL = timedelta(minutes=1)
+
+# Time after which a pending or running job that has not been marked as alive is taken to have been lost, with the
+# process that was running it
+DOWNLOAD_JOB_HEARTBEAT_TIMEOUT = timedelta(minutes=5)
+
+# Identifies the jobs queued by this process, which only this process can run
+DOWNLOAD_JOB_WORKER_ID = str(uuid4())
+
+download_job_executor = ThreadPoolExecutor(max_workers=DOWNLOAD_JOB_WORKERS, thread_name_prefix='download-job')
+
+download_job_maintenance_stopped = threading.Event()
+
+
+class DownloadJobStatus(str, Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    COMPLETE = 'complete'
+    FAILED = 'failed'
+    EXPIRED = 'expired'
+
+
+def submit_download_job(statement, survey_id, data_variant, auth: Authorized, survey_type: str,
+                        request_params: dict, download_format: DownloadFormat = DownloadFormat.CSV,
+                        unique: bool = False, netcdf_layout: NetCDFLayout = None, row_count: int = None) -> str:
+    """
+    Records a download job and queues it for the worker pool, returning the job id. The job produces the same
+    file as get_download_data would, and its status and progress are recorded in the download_job table.
+    :param request_params: The parameters of the request, which are recorded with the job and its downloads
+    :param row_count: The number of rows in the result, if already known; otherwise it is the number of rows
+        processed, once the job is complete
+    """
+    check_download_format(download_format, netcdf_layout)
+
+    job_id = str(uuid4())
+    now = datetime.now(timezone.utc)
+
+    with Session.session_factory() as session:
+        session.add(DownloadJob(
+            id=job_id,
+            client_id=auth.client_id,
+            user_id=auth.user_id,
+            survey_type=survey_type,
+            parameters=json.dumps(request_params, default=str, indent=2),
+            download_format=download_format.value,
+            file_name=get_download_file_name(survey_id, data_variant, download_format),
+            status=DownloadJobStatus.PENDING.value,
+            row_count=row_count,
+            rows_processed=0,
+            created=now,
+            worker_id=DOWNLOAD_JOB_WORKER_ID,
+            heartbeat=now,
+        ))
+        session.commit()
+
+    download_job_executor.submit(
+        run_download_job, job_id, statement, survey_id, download_format, unique, netcdf_layout
+    )
+
+    return job_id
+
+
+def run_download_job(job_id: str, statement, survey_id, download_format: DownloadFormat, unique: bool,
+                     netcdf_layout: NetCDFLayout):
+    """
+    Produces the file of a download job, recording the number of rows processed after each batch. This runs on
+    the worker pool, so the job is updated in a session of its own.
+    """
+    with Session.session_factory() as session:
+        job = session.get(DownloadJob, job_id)
+        job.status = DownloadJobStatus.RUNNING.value
+        job.started = datetime.now(timezone.utc)
+        session.commit()
+
+        def on_rows(row_count: int):
+            job.rows_processed += row_count
+            session.commit()
+
+        try:
+            file_chunks = get_file_chunks(
+                statement, survey_id, download_format, unique, netcdf_layout=netcdf_layout, on_rows=on_rows
+            )
+            file_info = write_download_job_file(job_id, file_chunks)
+
+            job.status = DownloadJobStatus.COMPLETE.value
+            if job.row_count is None:
+                job.row_count = job.rows_processed
+            job.download_file_size = file_info['size']
+            job.download_file_checksum = file_info['checksum']
+        except HTTPException as e:
+            job.status = DownloadJobStatus.FAILED.value
+            job.error = 'No data was found' if e.status_code == HTTP_404_NOT_FOUND else e.detail
+        except Exception:
+            logger.exception(f'Download job {job_id} failed')
+            session.rollback()
+            job.status = DownloadJobStatus.FAILED.value
+            job.error = 'The file could not be produced'
+
+        job.completed = datetime.now(timezone.utc)
+        session.commit()
+
+
+def write_download_job_file(job_id: str, file_chunks) -> dict:
+    """
+    Writes the chunks of a job's file to the job directory, returning the size and checksum of the file.
+    """
+    os.makedirs(DOWNLOAD_JOB_DIR, exist_ok=True)
+    checksum = hashlib.md5()
+    size = 0
+
+    with tempfile.NamedTemporaryFile(dir=DOWNLOAD_JOB_DIR, suffix='.tmp', delete=False) as job_file:
+        try:
+            for chunk in file_chunks:
+                job_file.write(chunk)
+                checksum.update(chunk)
+                size += len(chunk)
+        except BaseException:
+            job_file.close()
+            os.remove(job_file.name)
+            raise
+
+    os.replace(job_file.name, get_download_job_file_path(job_id))
+
+    return {
+        'checksum': checksum.hexdigest(),
+        'size': size,
+    }
+
+
+def get_download_job_file_path(job_id: str) -> str:
+    return os.path.join(DOWNLOAD_JOB_DIR, job_id)
+
+
+def start_download_job_maintenance():
+    """
+    Starts a thread that maintains the download jobs every DOWNLOAD_JOB_MAINTENANCE_INTERVAL, beginning with any
+    jobs that were lost while the API was down.
+    """
+    download_job_maintenance_stopped.clear()
+    threading.Thread(target=run_download_job_maintenance, name='download-job-maintenance', daemon=True).start()
+
+
+def stop_download_job_maintenance():
+    download_job_maintenance_stopped.set()
+
+
+def run_download_job_maintenance():
+    while True:
+        try:
+            maintain_download_jobs()
+        except Exception:
+            logger.exception('Download job maintenance failed')
+
+        if download_job_maintenance_stopped.wait(DOWNLOAD_JOB_MAINTENANCE_INTERVAL.total_seconds()):
+            break
+
+
+def maintain_download_jobs():
+    """
+    Marks the pending and running jobs of this process as alive, fails those of any process that has stopped
+    marking its jobs as alive, and expires old job files. Jobs are run on an in-process pool, so the jobs of a
+    process that is restarted or has crashed are lost; they are failed, to be submitted again, once their
+    heartbeat is older than DOWNLOAD_JOB_HEARTBEAT_TIMEOUT.
+    """
+    now = datetime.now(timezone.utc)
+    active_statuses = [DownloadJobStatus.PENDING.value, DownloadJobStatus.RUNNING.value]
+
+    with Session.session_factory() as session:
+        session.execute(
+            update(DownloadJob)
+            .where(DownloadJob.worker_id == DOWNLOAD_JOB_WORKER_ID, DownloadJob.status.in_(active_statuses))
+            .values(heartbeat=now)
+        )
+        lost_job_ids = session.execute(
+            update(DownloadJob)
+            .where(
+                DownloadJob.status.in_(active_statuses),
+                func.coalesce(DownloadJob.heartbeat, DownloadJob.created) < now - DOWNLOAD_JOB_HEARTBEAT_TIMEOUT
+            )
+            .values(status=DownloadJobStatus.FAILED.value, completed=now,
+                    error='The job was interrupted; please submit it again')
+            .returning(DownloadJob.id)
+        ).scalars().all()
+        session.commit()
+
+    for job_id in lost_job_ids:
+        logger.warning(f'Download job {job_id} was lost')
+
+    expire_download_jobs()
+
+
+def expire_download_jobs():
+    """
+    Removes the files of jobs that completed more than DOWNLOAD_JOB_RETENTION ago, and marks the jobs as expired.
+    """
+    expiry = datetime.now(timezone.utc) - DOWNLOAD_JOB_RETENTION
+
+    with Session.session_factory() as session:
+        expired_jobs = session.execute(
+            select(DownloadJob).where(
+                DownloadJob.status == DownloadJobStatus.COMPLETE.value,
+                DownloadJob.completed < expiry
+            )
+        ).scalars().all()
+
+        for job in expired_jobs:
+            try:
+                os.remove(get_download_job_file_path(job.id))
+            except FileNotFoundError:
+                pass
+
+            job.status = DownloadJobStatus.EXPIRED.value
+
+        session.commit()
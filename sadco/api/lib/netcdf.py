@@ -0,0 +1,200 @@
+import os
+from dataclasses import dataclass
+from datetime import date, datetime, timezone
+from tempfile import NamedTemporaryFile
+
+import netCDF4
+import numpy as np
+from sqlalchemy import func, select, types
+
+from sadco.db import engine
+
+# Units of the time variables; dates and timestamps are written as seconds since the epoch
+TIME_UNITS = 'seconds since 1970-01-01 00:00:00'
+
+# Minimum number of rows that are buffered before a block of instances is written
+NETCDF_BLOCK_SIZE = 10000
+
+# Size of the chunks in which the finished file is sent to the client
+NETCDF_CHUNK_SIZE = 64 * 1024
+
+# CF attributes of columns with a standard meaning. Latitudes are stored as degrees south in SADCO, so they are
+# negated to give degrees north.
+CF_COLUMN_ATTRIBUTES = {
+    'latitude': dict(standard_name='latitude', units='degrees_north'),
+    'longitude': dict(standard_name='longitude', units='degrees_east'),
+    'date': dict(standard_name='time', units=TIME_UNITS),
+    'datetime': dict(standard_name='time', units=TIME_UNITS),
+    'spldattim': dict(long_name='sampling time', units=TIME_UNITS),
+    'spldep': dict(standard_name='depth', units='m', positive='down'),
+    'sampling_depth': dict(standard_name='depth', units='m', positive='down'),
+}
+
+
+@dataclass
+class NetCDFLayout:
+    """
+    Describes how the rows of a download are laid out as a CF discrete sampling geometry, using the incomplete
+    multidimensional array representation: each instance (a station or a mooring depth) occupies one index of
+    the instance dimension, and its observations are ordered along the observation dimension, padded with
+    missing values up to the largest number of observations of any instance.
+    """
+    feature_type: str
+    instance_dimension: str
+    observation_dimension: str
+    instance_key: str
+    instance_columns: list[str]
+    observation_order: str
+
+
+def get_netcdf_dimensions(statement, layout: NetCDFLayout) -> tuple[int, int]:
+    """
+    Returns the number of instances and the largest number of observations of an instance in the result of a
+    statement, which fix the sizes of the dimensions before any data is written.
+    """
+    rows = statement.subquery()
+    instance_counts = (
+        select(func.count().label('observation_count'))
+        .select_from(rows)
+        .group_by(rows.c[layout.instance_key])
+        .subquery()
+    )
+
+    with engine.connect() as connection:
+        return connection.execute(
+            select(
+                func.count(),
+                func.coalesce(func.max(instance_counts.c.observation_count), 0)
+            )
+        ).one()
+
+
+def get_netcdf_chunks(statement, layout: NetCDFLayout, dimensions: tuple[int, int], get_row_batches):
+    """
+    Writes the rows of a statement to a compressed netCDF4 file laid out as described by layout, and yields the
+    file in chunks once it is complete. netCDF4 files cannot be written to a stream, so the file is built on disk,
+    a block of instances at a time, and removed once it has been sent.
+    :param statement: The select statement whose rows make up the file
+    :param layout: The layout of the instances and observations
+    :param dimensions: The number of instances and the maximum number of observations per instance
+    :param get_row_batches: Called with the ordered statement, returns an iterator over lists of rows
+    """
+    instance_count, observation_count = dimensions
+    columns = list(statement.selected_columns)
+    column_keys = [column.key for column in columns]
+    key_index = column_keys.index(layout.instance_key)
+    coordinates = ' '.join(key for key in CF_COLUMN_ATTRIBUTES if key in column_keys)
+
+    ordered_statement = statement.order_by(
+        statement.selected_columns[layout.instance_key],
+        statement.selected_columns[layout.observation_order],
+    )
+
+    with NamedTemporaryFile(suffix='.nc', delete=False) as netcdf_file:
+        file_path = netcdf_file.name
+
+    try:
+        with netCDF4.Dataset(file_path, mode='w', format='NETCDF4') as dataset:
+            dataset.Conventions = 'CF-1.8'
+            dataset.featureType = layout.feature_type
+            dataset.createDimension(layout.instance_dimension, instance_count)
+            dataset.createDimension(layout.observation_dimension, observation_count)
+
+            variables = [create_netcdf_variable(dataset, column, layout, coordinates) for column in columns]
+
+            # Instances are buffered until a block of at least NETCDF_BLOCK_SIZE rows is complete
+            instances = []
+            instance_offset = 0
+            block_row_count = 0
+
+            for rows in get_row_batches(ordered_statement):
+                for row in rows:
+                    if not instances or instances[-1][0][key_index] != row[key_index]:
+                        if block_row_count >= NETCDF_BLOCK_SIZE:
+                            write_netcdf_block(variables, instances, instance_offset, observation_count)
+                            instance_offset += len(instances)
+                            instances = []
+                            block_row_count = 0
+
+                        instances.append([])
+
+                    instances[-1].append(row)
+                    block_row_count += 1
+
+            if instances:
+                write_netcdf_block(variables, instances, instance_offset, observation_count)
+
+        with open(file_path, 'rb') as netcdf_file:
+            while chunk := netcdf_file.read(NETCDF_CHUNK_SIZE):
+                yield chunk
+    finally:
+        os.remove(file_path)
+
+
+def create_netcdf_variable(dataset: netCDF4.Dataset, column, layout: NetCDFLayout, coordinates: str):
+    """
+    Creates the variable for a selected column, on the instance dimension if its value is constant per instance
+    and on both dimensions otherwise. Strings are written as variable-length strings, and everything else as
+    compressed doubles with NaN as the missing value.
+    """
+    if column.key in layout.instance_columns or column.key == layout.instance_key:
+        dimensions = (layout.instance_dimension,)
+    else:
+        dimensions = (layout.instance_dimension, layout.observation_dimension)
+
+    if isinstance(column.type, types.String):
+        variable = dataset.createVariable(column.key, str, dimensions)
+    else:
+        variable = dataset.createVariable(column.key, 'f8', dimensions, zlib=True, complevel=4,
+                                          fill_value=np.nan)
+
+    variable.long_name = column.key
+    variable.setncatts(CF_COLUMN_ATTRIBUTES.get(column.key, {}))
+
+    if len(dimensions) == 2 and column.key not in CF_COLUMN_ATTRIBUTES and coordinates:
+        variable.coordinates = coordinates
+
+    return variable
+
+
+def write_netcdf_block(variables: list, instances: list[list], instance_offset: int, observation_count: int):
+    """
+    Writes a block of consecutive instances, each a list of its rows in observation order, to the variables.
+    """
+    for index, variable in enumerate(variables):
+        if len(variable.dimensions) == 1:
+            values = [get_netcdf_value(variable, rows[0][index]) for rows in instances]
+            variable[instance_offset:instance_offset + len(instances)] = np.array(
+                values, dtype=object if variable.dtype == str else 'f8'
+            )
+        else:
+            if variable.dtype == str:
+                block = np.full((len(instances), observation_count), '', dtype=object)
+            else:
+                block = np.full((len(instances), observation_count), np.nan)
+
+            for instance_index, rows in enumerate(instances):
+                block[instance_index, :len(rows)] = [get_netcdf_value(variable, row[index]) for row in rows]
+
+            variable[instance_offset:instance_offset + len(instances), :] = block
+
+
+def get_netcdf_value(variable, value):
+    if variable.dtype == str:
+        return str(value) if value is not None else ''
+
+    if value is None:
+        return np.nan
+
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp()
+
+    if variable.name == 'latitude':
+        return -float(value)
+
+    return float(value)
@@ -0,0 +1,41 @@
+from sqlalchemy import Double, cast, select, types
+from sqlalchemy.sql import Select
+
+# Numeric columns with up to this many digits are fetched as floats, which hold any value of that many significant
+# digits exactly
+FLOAT_NUMERIC_PRECISION = 15
+
+
+def is_float_numeric(column_type: types.TypeEngine) -> bool:
+    return (
+        isinstance(column_type, types.Numeric)
+        and not isinstance(column_type, types.Float)
+        and column_type.precision is not None
+        and column_type.precision <= FLOAT_NUMERIC_PRECISION
+    )
+
+
+def get_float_numeric_statement(statement):
+    """
+    Returns a statement selecting the same columns as the given statement, with its numeric columns of up to
+    FLOAT_NUMERIC_PRECISION digits cast to double precision in the database. psycopg2 returns numeric values as
+    Decimal objects, which pandas and pyarrow can only handle one at a time as Python objects, whereas floats are
+    parsed by the driver and become float64 arrays that are converted and formatted vectorised. File schemas are
+    built from the original statement, so the columns' declared precision and scale are kept in typed formats.
+    """
+    if not any(is_float_numeric(column.type) for column in statement.selected_columns):
+        return statement
+
+    if isinstance(statement, Select):
+        return statement.with_only_columns(*(get_float_column(column) for column in statement.selected_columns))
+
+    rows = statement.subquery()
+
+    return select(*(get_float_column(column) for column in rows.c))
+
+
+def get_float_column(column):
+    if is_float_numeric(column.type):
+        return cast(column, Double).label(column.key)
+
+    return column
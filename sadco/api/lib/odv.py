@@ -0,0 +1,127 @@
+from datetime import date, datetime
+
+from sqlalchemy import types
+
+from sadco.api.lib.netcdf import NetCDFLayout
+
+# Feature type of the layouts whose data can be exported as ODV stations
+ODV_FEATURE_TYPE = 'profile'
+
+# ODV labels of the columns that hold ODV's own station metadata and primary variable, in the order in which they
+# are written. Latitudes are stored as degrees south in SADCO, so they are negated to give degrees north.
+ODV_COLUMN_LABELS = {
+    'survey_id': 'Cruise',
+    'station_id': 'Station',
+    'date': 'yyyy-mm-ddThh:mm:ss.sss',
+    'longitude': 'Longitude [degrees_east]',
+    'latitude': 'Latitude [degrees_north]',
+    'spldep': 'Depth [m]',
+}
+
+# Columns that an ODV file cannot do without, which are included whichever columns are selected
+ODV_KEY_COLUMNS = list(ODV_COLUMN_LABELS)
+
+# Station type written to the Type column; B denotes bottle data
+ODV_STATION_TYPE = 'B'
+
+# Length of text metadata whose column length is not declared
+ODV_TEXT_LENGTH = 64
+
+# Tabs and line breaks in text would split the file's columns and rows, so they are replaced with spaces
+ODV_TEXT_TRANSLATION = str.maketrans('\t\r\n', '   ')
+
+
+def get_odv_chunks(statement, layout: NetCDFLayout, get_row_batches):
+    """
+    Yields the rows of a statement as utf-8 encoded chunks of an ODV generic spreadsheet file, a station at a time
+    and each station's samples in depth order. The station's metadata is written on its first row only, as ODV
+    carries it over to the station's following rows. Nothing is yielded if there are no rows.
+    :param statement: The select statement whose rows make up the file
+    :param layout: The layout of the stations and their samples
+    :param get_row_batches: Called with the ordered statement, returns an iterator over lists of rows
+    """
+    columns = list(statement.selected_columns)
+    column_keys = [column.key for column in columns]
+    key_index = column_keys.index(layout.instance_key)
+
+    # The station's columns come first, those with ODV labels in ODV's order, followed by the primary variable
+    odv_keys = list(ODV_COLUMN_LABELS)
+    station_keys = {*layout.instance_columns, layout.instance_key}
+    metadata_indexes = sorted(
+        (index for index, key in enumerate(column_keys) if key in station_keys),
+        key=lambda index: odv_keys.index(column_keys[index]) if column_keys[index] in odv_keys else len(odv_keys)
+    )
+    data_indexes = [column_keys.index(layout.observation_order)]
+    data_indexes += [index for index in range(len(columns)) if index not in metadata_indexes + data_indexes]
+
+    # The Type column is written after Cruise and Station
+    type_position = sum(1 for index in metadata_indexes if column_keys[index] in ('survey_id', 'station_id'))
+    labels = [get_odv_label(columns[index], layout) for index in metadata_indexes + data_indexes]
+    labels.insert(type_position, 'Type')
+    empty_metadata = [''] * (len(metadata_indexes) + 1)
+
+    ordered_statement = statement.order_by(
+        statement.selected_columns[layout.instance_key],
+        statement.selected_columns[layout.observation_order],
+    )
+
+    header = True
+    station_key = None
+
+    for rows in get_row_batches(ordered_statement):
+        lines = []
+
+        if header:
+            lines += ['//<Creator>SADCO</Creator>', '//<DataType>Profiles</DataType>', '\t'.join(labels)]
+            header = False
+
+        for row in rows:
+            if row[key_index] != station_key:
+                station_key = row[key_index]
+                metadata = [get_odv_value(row[index], column_keys[index]) for index in metadata_indexes]
+                metadata.insert(type_position, ODV_STATION_TYPE)
+            else:
+                metadata = empty_metadata
+
+            lines.append('\t'.join(metadata + [get_odv_value(row[index], column_keys[index])
+                                               for index in data_indexes]))
+
+        yield ('\n'.join(lines) + '\n').encode()
+
+
+def get_odv_label(column, layout: NetCDFLayout) -> str:
+    """
+    Returns the ODV label of a column: ODV's own label for its station metadata and primary variable, a metadata
+    variable label for the station's other columns, and the column name for the samples' columns.
+    """
+    if column.key in ODV_COLUMN_LABELS:
+        return ODV_COLUMN_LABELS[column.key]
+
+    if column.key not in layout.instance_columns:
+        return column.key
+
+    if isinstance(column.type, (types.Numeric, types.Integer)):
+        return f'{column.key}:METAVAR:DOUBLE'
+
+    length = getattr(column.type, 'length', None) or ODV_TEXT_LENGTH
+
+    return f'{column.key}:METAVAR:TEXT:{length + 1}'
+
+
+def get_odv_value(value, key: str) -> str:
+    if value is None:
+        return ''
+
+    if key == 'latitude':
+        return str(-value)
+
+    if isinstance(value, datetime):
+        return value.isoformat(timespec='milliseconds')
+
+    if isinstance(value, date):
+        return f'{value.isoformat()}T00:00:00.000'
+
+    if isinstance(value, str):
+        return value.translate(ODV_TEXT_TRANSLATION)
+
+    return str(value)
@@ -0,0 +1,131 @@
+from datetime import date
+from itertools import product
+
+# Number of bits of each of a VOS record's latitude, longitude and day that are interleaved in its z-order key,
+# which is computed by the database function sadco.vos_zorder_key
+ZORDER_BITS = 21
+
+# Day from which the days of the z-order key are counted
+ZORDER_EPOCH = date(1800, 1, 1)
+
+# Ranges of the latitude (in degrees south, as stored) and longitude that the z-order key's cells divide up
+ZORDER_LATITUDE_RANGE = (-90, 90)
+ZORDER_LONGITUDE_RANGE = (-180, 180)
+
+# Number of partly overlapping octants beyond which the key space is no longer divided to find the key ranges of a
+# search, which bounds the work of finding them
+ZORDER_MAX_OCTANTS = 1024
+
+# Magic numbers that spread the bits of a value two bits apart, as they are in the z-order key
+ZORDER_SPREAD_STEPS = [
+    (32, 0x1f00000000ffff),
+    (16, 0x1f0000ff0000ff),
+    (8, 0x100f00f00f00f00f),
+    (4, 0x10c30c30c30c30c3),
+    (2, 0x1249249249249249),
+]
+
+
+def get_zorder_cell(value: float, value_range: tuple[float, float]) -> int:
+    """Returns the cell along one dimension of the z-order key in which a value lies, as sadco.vos_zorder_key does."""
+    lower, upper = value_range
+    cell = int((value - lower) / (upper - lower) * (1 << ZORDER_BITS) // 1)
+
+    return min(max(cell, 0), (1 << ZORDER_BITS) - 1)
+
+
+def get_zorder_day(day: date) -> int:
+    return min(max((day - ZORDER_EPOCH).days, 0), (1 << ZORDER_BITS) - 1)
+
+
+def get_zorder_key(latitude_cell: int, longitude_cell: int, day_cell: int) -> int:
+    """Returns the z-order key of a cell, interleaving the bits of its latitude, longitude and day cells."""
+    return spread_bits(latitude_cell) << 2 | spread_bits(longitude_cell) << 1 | spread_bits(day_cell)
+
+
+def spread_bits(value: int) -> int:
+    value &= (1 << ZORDER_BITS) - 1
+
+    for shift, mask in ZORDER_SPREAD_STEPS:
+        value = (value | value << shift) & mask
+
+    return value
+
+
+def get_zorder_ranges(
+        lower_cell: tuple[int, int, int],
+        upper_cell: tuple[int, int, int],
+        max_ranges: int,
+) -> list[tuple[int, int]]:
+    """
+    Returns the ranges of z-order keys, first and last inclusive, that cover the cells between two corner cells.
+    The key space is divided into octants, a level at a time, and the octants that lie wholly within the cells each
+    give a range of keys, while those that partly overlap them are divided further, down to single cells or until
+    there would be more than ZORDER_MAX_OCTANTS of them; those that are left are given as ranges as they are. The
+    ranges that adjoin are merged, and then those separated by the smallest gaps, until there are no more than
+    max_ranges, so the ranges also cover some cells outside the corners, which the query's own filters exclude.
+    :param lower_cell: The latitude, longitude and day cells of the lower corner
+    :param upper_cell: The latitude, longitude and day cells of the upper corner
+    :param max_ranges: The number of ranges that are returned at most
+    """
+    ranges = []
+    octants = [(0, 0, 0)]
+
+    for level in range(ZORDER_BITS + 1):
+        shift = ZORDER_BITS - level
+        overlapping = []
+
+        for octant in octants:
+            first = [cell << shift for cell in octant]
+            last = [(cell + 1 << shift) - 1 for cell in octant]
+
+            if any(last[i] < lower_cell[i] or first[i] > upper_cell[i] for i in range(3)):
+                continue
+
+            if all(lower_cell[i] <= first[i] and last[i] <= upper_cell[i] for i in range(3)):
+                ranges.append(get_octant_range(octant, shift))
+            else:
+                overlapping.append(octant)
+
+        if not overlapping:
+            break
+
+        if 8 * len(overlapping) > ZORDER_MAX_OCTANTS:
+            ranges += [get_octant_range(octant, shift) for octant in overlapping]
+            break
+
+        octants = [
+            tuple(cell << 1 | half for cell, half in zip(octant, halves))
+            for octant in overlapping
+            for halves in product((0, 1), repeat=3)
+        ]
+
+    merged_ranges = []
+
+    for first, last in sorted(ranges):
+        if merged_ranges and first == merged_ranges[-1][1] + 1:
+            merged_ranges[-1] = (merged_ranges[-1][0], last)
+        else:
+            merged_ranges.append((first, last))
+
+    if len(merged_ranges) <= max_ranges:
+        return merged_ranges
+
+    # The ranges are joined across the smallest gaps between them, which take in the fewest keys outside the cells
+    gaps = sorted(range(1, len(merged_ranges)), key=lambda index: merged_ranges[index][0] - merged_ranges[index - 1][1])
+    joined = set(gaps[:len(merged_ranges) - max_ranges])
+    joined_ranges = []
+
+    for index, (first, last) in enumerate(merged_ranges):
+        if index in joined:
+            joined_ranges[-1] = (joined_ranges[-1][0], last)
+        else:
+            joined_ranges.append((first, last))
+
+    return joined_ranges
+
+
+def get_octant_range(octant: tuple[int, int, int], shift: int) -> tuple[int, int]:
+    first = get_zorder_key(*octant) << 3 * shift
+
+    return first, first + (1 << 3 * shift) - 1
@@ -1,4 +1,6 @@
 from .download_audit import DownloadAuditModel
+from .download_estimate import DownloadEstimateModel
+from .download_job import DownloadJobModel
 from .survey import (SurveyModel, SurveyListItemModel, StationModel, WaterModel, WaterCurrentsModel,
                      WaterChemistryModel, WaterPollutionModel, WaterNutrientsModel, DataTypesModel,
                      SedimentChemistryModel, HydroSurveyModel, SedimentPollutionModel, SedimentModel,
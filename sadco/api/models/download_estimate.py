@@ -0,0 +1,7 @@
+from pydantic import BaseModel
+
+
+class DownloadEstimateModel(BaseModel):
+    row_count: int
+    uncompressed_size: int
+    generation_seconds: float
@@ -0,0 +1,19 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class DownloadJobModel(BaseModel):
+    id: str
+    status: str
+    survey_type: str
+    parameters: dict
+    download_format: str
+    row_count: Optional[int]
+    rows_processed: int
+    created: datetime
+    started: Optional[datetime]
+    completed: Optional[datetime]
+    download_file_size: Optional[int]
+    error: Optional[str]
@@ -1,5 +1,10 @@
+from typing import Optional
+
 from pydantic import BaseModel
 
 
 class VosSurveySearchResult(BaseModel):
     total: int
+    approximate: bool = False
+    total_lower: Optional[int] = None
+    total_upper: Optional[int] = None
@@ -0,0 +1,179 @@
+"""
+Renders the standard downloads of every survey in the inventory into a directory of pre-rendered downloads, from
+which the download routes send them without querying the data. Pre-rendered downloads are kept apart from the
+download cache, so that they are not evicted to make room for other downloads. Downloads are keyed by the version
+of their survey's data, and those that are already rendered for the current version are left as they are, so a run
+only renders the downloads of surveys whose data has changed since the last run; those that are no longer current
+are then removed. Any download that is not pre-rendered is still produced on demand when it is requested.
+
+Usage: python -m sadco.api.pregenerate_downloads [--workers N] [--survey-type TYPE ...]
+"""
+import argparse
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from sadco.api.lib.download import (DEFAULT_COMPRESSION, DownloadFormat, get_compression, get_download_cache_key,
+                                    get_download_file_name, get_file_chunks)
+from sadco.api.lib.download_cache import create_cached_file, get_cached_file, remove_pregenerated_files
+from sadco.api.routers.survey_download import (HYDRO_DATA_TYPE_RECORD_COUNTS, SurveyDownloadFilters,
+                                               get_currents_statement, get_hydro_data_type_statement,
+                                               get_hydro_sources, get_waves_statement, get_weather_statement)
+from sadco.const import SurveyType as ConstSurveyType
+from sadco.db import Session, engine
+from sadco.db.models import Inventory, InvStats, SurveyType
+
+logger = logging.getLogger(__name__)
+
+# Number of processes in which downloads are rendered at the same time
+PREGENERATION_WORKERS = 4
+
+# Survey types whose downloads are rendered; UTR surveys are downloaded as currents, from the same cached file
+PREGENERATION_SURVEY_TYPES = [
+    ConstSurveyType.HYDRO.value,
+    ConstSurveyType.CURRENTS.value,
+    ConstSurveyType.WEATHER.value,
+    ConstSurveyType.WAVES.value,
+]
+
+
+def get_standard_downloads(survey_types: list[str] = PREGENERATION_SURVEY_TYPES) -> list[tuple[str, str, str]]:
+    """
+    Returns the survey type, survey id and data type of the standard downloads of the surveys in the inventory:
+    a csv file of each hydro data type that the inventory statistics record data for, and a csv file of the data
+    of each currents, weather and waves survey, which has no data type.
+    """
+    rows = Session.execute(
+        select(Inventory.survey_id, SurveyType.name, InvStats)
+        .join(SurveyType, Inventory.survey_type_code == SurveyType.code)
+        .outerjoin(InvStats, InvStats.survey_id == Inventory.survey_id)
+        .order_by(Inventory.survey_id)
+    ).all()
+
+    downloads = []
+
+    for survey_id, survey_type_name, inv_stats in rows:
+        survey_id = survey_id.replace('/', '-')
+        survey_type = (survey_type_name or '').lower()
+
+        if survey_type == ConstSurveyType.UTR.value:
+            survey_type = ConstSurveyType.CURRENTS.value
+
+        if survey_type not in survey_types:
+            continue
+
+        if survey_type == ConstSurveyType.HYDRO.value:
+            if inv_stats is not None:
+                downloads += [
+                    (survey_type, survey_id, data_type.value)
+                    for data_type, count_column in HYDRO_DATA_TYPE_RECORD_COUNTS.items()
+                    if getattr(inv_stats, count_column.key)
+                ]
+        else:
+            downloads.append((survey_type, survey_id, None))
+
+    return downloads
+
+
+def pregenerate_download(survey_type: str, survey_id: str, data_type: str | None) -> bool:
+    """
+    Renders the standard download of a survey into the pre-rendered downloads, under the key that the download
+    route looks it up by, unless it is already rendered. Returns whether the download was rendered; a survey
+    without any data for the download is skipped.
+    """
+    # The filters and compression of a request that gives neither
+    filters = SurveyDownloadFilters()
+    compression = get_compression(DEFAULT_COMPRESSION, None)
+    unique = False
+
+    match survey_type:
+        case ConstSurveyType.HYDRO.value:
+            stmt = get_hydro_data_type_statement(data_type, get_hydro_sources(survey_id, filters), filters)
+        case ConstSurveyType.CURRENTS.value:
+            stmt = get_currents_statement(survey_id, filters)
+            unique = True
+        case ConstSurveyType.WEATHER.value:
+            stmt = get_weather_statement(survey_id, filters)
+        case ConstSurveyType.WAVES.value:
+            stmt = get_waves_statement(survey_id, filters)
+        case _:
+            raise ValueError(f'Unsupported survey type {survey_type}')
+
+    try:
+        file_name = get_download_file_name(survey_id, data_type, DownloadFormat.CSV)
+        cache_key = get_download_cache_key(stmt, file_name, DownloadFormat.CSV, unique, compression=compression,
+                                           survey_id=survey_id.replace('-', '/'))
+
+        # Looking the download up marks it as used, so that it is kept as current by the run
+        if get_cached_file(cache_key, pregenerated=True):
+            return False
+
+        try:
+            file_chunks = get_file_chunks(stmt, survey_id, DownloadFormat.CSV, unique, compression=compression)
+        except HTTPException:
+            return False
+
+        create_cached_file(cache_key, file_chunks, pregenerated=True, file_info={'survey_type': survey_type})
+
+        return True
+    finally:
+        Session.remove()
+
+
+def pregenerate_downloads(survey_types: list[str] = PREGENERATION_SURVEY_TYPES,
+                          workers: int = PREGENERATION_WORKERS) -> int:
+    """
+    Renders the standard downloads of the surveys of the given types in a pool of processes, returning the number
+    of downloads that were rendered. A download that fails is logged, and the others are carried on with; the
+    downloads that are no longer current are only removed if none failed.
+    """
+    # File times are kept at a coarser resolution than the clock's
+    started = time.time() - 1
+
+    try:
+        downloads = get_standard_downloads(survey_types)
+    finally:
+        Session.remove()
+
+    # Pooled connections must not be shared with the worker processes, which open their own
+    engine.dispose()
+    rendered_count = 0
+    failed = False
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(pregenerate_download, *download): download for download in downloads}
+
+        for future in as_completed(futures):
+            try:
+                rendered_count += future.result()
+            except Exception:
+                logger.exception('Failed to render the download of %s survey %s %s', *futures[future])
+                failed = True
+
+    logger.info('Rendered %d of %d downloads', rendered_count, len(downloads))
+
+    # The downloads that were not used by the run are those that are no longer current, unless some failed
+    if not failed:
+        removed_count = sum(remove_pregenerated_files(survey_type, started) for survey_type in survey_types)
+        logger.info('Removed %d downloads that are no longer current', removed_count)
+
+    return rendered_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the standard downloads of every survey.')
+    parser.add_argument('--workers', type=int, default=PREGENERATION_WORKERS,
+                        help='number of processes in which downloads are rendered')
+    parser.add_argument('--survey-type', dest='survey_types', action='append', choices=PREGENERATION_SURVEY_TYPES,
+                        help='a survey type whose downloads are rendered; all types if not given')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    pregenerate_downloads(args.survey_types or PREGENERATION_SURVEY_TYPES, args.workers)
+
+
+if __name__ == '__main__':
+    main()
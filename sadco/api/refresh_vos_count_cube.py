@@ -0,0 +1,31 @@
+"""
+Rebuilds the VOS count cube, from which VOS search totals are counted, from the VOS tables. The cube is built once
+with this, and the API then brings it up to date as the VOS tables are loaded; search totals are counted in the
+tables until the cube has been built, and while the days that have changed are waiting to be counted again.
+
+Usage: python -m sadco.api.refresh_vos_count_cube
+"""
+import argparse
+import logging
+
+from sadco.api.routers.vos_survey import refresh_vos_count_cube
+from sadco.db import Session
+
+logger = logging.getLogger(__name__)
+
+
+def main():
+    argparse.ArgumentParser(description='Rebuild the VOS count cube from the VOS tables.').parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        refresh_vos_count_cube()
+    finally:
+        Session.remove()
+
+    logger.info('Refreshed the VOS count cube')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import json
+from dataclasses import asdict
+from datetime import date
+from functools import partial
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import FileResponse
+from sqlalchemy import select
+from starlette.status import HTTP_202_ACCEPTED, HTTP_404_NOT_FOUND, HTTP_409_CONFLICT, HTTP_410_GONE
+
+from sadco.api.lib.auth import Authorize, Authorized
+from sadco.api.lib.download import (DOWNLOAD_FILE_TYPES, DownloadFormat, audit_download_request, get_file_response,
+                                    select_columns)
+from sadco.api.lib.download_job import DownloadJobStatus, get_download_job_file_path, submit_download_job
+from sadco.api.models import DownloadJobModel
+from sadco.api.routers.survey_download import (SurveyDownloadFilters, check_hydro_data_type,
+                                               check_hydro_depth_filters, get_hydro_data_type_statement,
+                                               get_hydro_key_columns, get_hydro_netcdf_layout, get_hydro_sources,
+                                               get_survey_download_filters)
+from sadco.api.routers.vos_survey import get_record_count, get_vos_union_statement
+from sadco.const import SADCOScope, SurveyType
+from sadco.db import Session
+from sadco.db.models import DownloadJob
+
+router = APIRouter()
+
+
+@router.post(
+    f'/{SurveyType.HYDRO.value}/{{survey_id}}',
+    response_model=DownloadJobModel,
+    status_code=HTTP_202_ACCEPTED
+)
+async def submit_hydro_download_job(
+        survey_id: str,
+        data_type: str = Query(None, title='Data Type'),
+        download_format: DownloadFormat = Query(DownloadFormat.CSV, alias='format', title='File format'),
+        columns: list[str] = Query(None, title='Columns to include'),
+        filters: SurveyDownloadFilters = Depends(get_survey_download_filters),
+        auth: Authorized = Depends(Authorize(SADCOScope.HYDRO_DOWNLOAD))
+):
+    check_hydro_data_type(data_type)
+    check_hydro_depth_filters(data_type, filters)
+
+    stmt = get_hydro_data_type_statement(data_type, get_hydro_sources(survey_id, filters), filters)
+    stmt = select_columns(stmt, columns, get_hydro_key_columns(download_format))
+
+    request_params = dict(survey_id=survey_id, data_type=data_type, download_format=download_format,
+                          columns=columns, **asdict(filters))
+
+    job_id = submit_download_job(
+        stmt, survey_id, data_type, auth, SurveyType.HYDRO.value, request_params, download_format,
+        netcdf_layout=get_hydro_netcdf_layout(stmt)
+    )
+
+    return get_download_job_model(Session.get(DownloadJob, job_id))
+
+
+@router.post(
+    f'/{SurveyType.VOS.value}',
+    response_model=DownloadJobModel,
+    status_code=HTTP_202_ACCEPTED
+)
+async def submit_vos_download_job(
+        north_bound: float = Query(None, title='North bound latitude', ge=-90, le=90),
+        south_bound: float = Query(None, title='South bound latitude', ge=-90, le=90),
+        east_bound: float = Query(None, title='East bound longitude', ge=-180, le=180),
+        west_bound: float = Query(None, title='West bound longitude', ge=-180, le=180),
+        start_date: date = Query(None, title='Date range start'),
+        end_date: date = Query(None, title='Date range end'),
+        exclusive_region: bool = Query(False, title='Exclude partial spatial matches'),
+        exclusive_interval: bool = Query(False, title='Exclude partial temporal matches'),
+        download_format: DownloadFormat = Query(DownloadFormat.CSV, alias='format', title='File format'),
+        columns: list[str] = Query(None, title='Columns to include'),
+        auth: Authorized = Depends(Authorize(SADCOScope.VOS_DOWNLOAD))
+):
+    vos_filters = dict(
+        north_bound=north_bound,
+        south_bound=south_bound,
+        east_bound=east_bound,
+        west_bound=west_bound,
+        start_date=start_date,
+        end_date=end_date,
+        exclusive_region=exclusive_region,
+        exclusive_interval=exclusive_interval,
+    )
+
+    job_id = submit_download_job(
+        get_vos_union_statement(**vos_filters, columns=columns), 'VOS', 'VOS', auth, SurveyType.VOS.value,
+        dict(**vos_filters, download_format=download_format, columns=columns), download_format,
+        row_count=get_record_count(**vos_filters)
+    )
+
+    return get_download_job_model(Session.get(DownloadJob, job_id))
+
+
+@router.get(
+    '/{job_id}',
+    response_model=DownloadJobModel
+)
+async def get_download_job(
+        job_id: str,
+        auth: Authorized = Depends(Authorize(SADCOScope.DOWNLOAD_READ))
+):
+    return get_download_job_model(get_own_download_job(job_id, auth))
+
+
+@router.api_route(
+    '/{job_id}/file',
+    methods=['GET', 'HEAD'],
+    response_class=FileResponse
+)
+async def download_job_file(
+        request: Request,
+        job_id: str,
+        auth: Authorized = Depends(Authorize(SADCOScope.DOWNLOAD_READ))
+):
+    job = get_own_download_job(job_id, auth)
+
+    if job.status == DownloadJobStatus.EXPIRED:
+        raise HTTPException(HTTP_410_GONE, 'The file has expired')
+
+    if job.status != DownloadJobStatus.COMPLETE:
+        raise HTTPException(HTTP_409_CONFLICT, f'The job is {job.status}')
+
+    media_type, _ = DOWNLOAD_FILE_TYPES[DownloadFormat(job.download_format)]
+    file_info = {
+        'size': job.download_file_size,
+        'checksum': job.download_file_checksum,
+    }
+    audit = partial(audit_download_request, auth, survey_type=job.survey_type, job_id=job.id,
+                    **json.loads(job.parameters))
+
+    return get_file_response(get_download_job_file_path(job.id), file_info, media_type, job.file_name, audit,
+                             request)
+
+
+def get_own_download_job(job_id: str, auth: Authorized) -> DownloadJob:
+    """Returns a job submitted by the requesting client and user, or raises a 404 if there is none."""
+    job = Session.execute(
+        select(DownloadJob).where(
+            DownloadJob.id == job_id,
+            DownloadJob.client_id == auth.client_id,
+            DownloadJob.user_id == auth.user_id
+        )
+    ).scalar_one_or_none()
+
+    if not job:
+        raise HTTPException(HTTP_404_NOT_FOUND)
+
+    return job
+
+
+def get_download_job_model(job: DownloadJob) -> DownloadJobModel:
+    return DownloadJobModel(
+        id=job.id,
+        status=job.status,
+        survey_type=job.survey_type,
+        parameters=json.loads(job.parameters if job.parameters else '{}'),
+        download_format=job.download_format,
+        row_count=job.row_count,
+        rows_processed=job.rows_processed,
+        created=job.created,
+        started=job.started,
+        completed=job.completed,
+        download_file_size=job.download_file_size,
+        error=job.error,
+    )
@@ -1,58 +1,209 @@
-from fastapi import APIRouter, HTTPException, Query, Depends
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from functools import partial
+
+from fastapi import APIRouter, HTTPException, Query, Depends, Request
 from fastapi.responses import StreamingResponse
-from sqlalchemy import select, func
-from starlette.status import HTTP_404_NOT_FOUND
+from sqlalchemy import Date, select, func
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import FromClause, Select
+from starlette.status import HTTP_404_NOT_FOUND, HTTP_405_METHOD_NOT_ALLOWED, HTTP_422_UNPROCESSABLE_ENTITY
 
 from sadco.api.lib.auth import Authorize, Authorized
-from sadco.api.lib.download import get_csv_data, audit_download_request
+from sadco.api.lib.download import (get_download_data, get_bundle_data, get_batch_data, audit_download_request,
+                                    create_temporary_table, select_columns, get_compression, Compression,
+                                    DownloadFormat)
+from sadco.api.lib.download_estimate import get_download_estimate
+from sadco.api.lib.netcdf import NetCDFLayout
+from sadco.api.lib.odv import ODV_KEY_COLUMNS
+from sadco.api.models import DownloadEstimateModel
 from sadco.const import SADCOScope, DataType, SurveyType as ConstSurveyType
 from sadco.db import Session
 from sadco.db.models import (Watphy, Survey, Station, Sedphy, Weather, Currents, CurMooring, CurDepth, CurData,
                              Inventory, WetStation, WetPeriod, WavStation, WetData, WavData, CurWatphy, EDMInstrument2,
-                             Watnut, Watchem1, Watchl, Watpol1, Watpol2, Watchem2, Sedpol1, Sedpol2, Sedchem1, Sedchem2)
+                             Watnut, Watchem1, Watchl, Watpol1, Watpol2, Watchem2, Sedpol1, Sedpol2, Sedchem1, Sedchem2,
+                             InvStats, WetPeriodCounts, WavPeriod)
 
 router = APIRouter()
 
+# The data type that downloads a hydro survey's data types together, as one csv file per data type
+HYDRO_BUNDLE_DATA_TYPE = 'all'
 
-@router.get(
+# Columns that identify a station or sample, which are included whichever columns are selected
+HYDRO_KEY_COLUMNS = ['station_id', 'subdes', 'spldattim', 'spldep']
+
+# Maximum number of surveys in a batch download
+HYDRO_BATCH_LIMIT = 100
+
+# The data types that are observed at the surface, which cannot be filtered by depth
+HYDRO_SURFACE_DATA_TYPES = [DataType.WEATHER]
+
+# Description of the depth filters, which do not apply to hydro weather
+DEPTH_FILTER_DESCRIPTION = ('Hydro weather is observed at the surface, so a download of it cannot be filtered by '
+                            'depth, and the weather in a download of all hydro data types is not filtered by depth')
+
+# The inventory statistics that count the rows of each data type; every water and sediment data type has a row
+# per sample, apart from nutrients, which has a row per sample with nutrients
+HYDRO_DATA_TYPE_RECORD_COUNTS = {
+    DataType.WATER: InvStats.watphy_cnt,
+    DataType.WATERNUTRIENTS: InvStats.watnut_cnt,
+    DataType.WATERCHEMISTRY: InvStats.watphy_cnt,
+    DataType.WATERPOLLUTION: InvStats.watphy_cnt,
+    DataType.WATERNUTRIENTSANDCHEMISTRY: InvStats.watphy_cnt,
+    DataType.CURRENTS: InvStats.watcurrents_cnt,
+    DataType.WEATHER: InvStats.weather_cnt,
+    DataType.SEDIMENT: InvStats.sedphy_cnt,
+    DataType.SEDIMENTCHEMISTRY: InvStats.sedphy_cnt,
+    DataType.SEDIMENTPOLLUTION: InvStats.sedphy_cnt,
+}
+
+
+@dataclass
+class SurveyDownloadFilters:
+    """The time window and depth range to which a survey download is limited. Bounds that are not set are open."""
+    start: datetime = None
+    end: datetime = None
+    min_depth: float = None
+    max_depth: float = None
+
+
+def get_survey_download_filters(
+        start: datetime = Query(None, title='Time window start'),
+        end: datetime = Query(None, title='Time window end'),
+        min_depth: float = Query(None, title='Minimum sampling depth', description=DEPTH_FILTER_DESCRIPTION, ge=0),
+        max_depth: float = Query(None, title='Maximum sampling depth', description=DEPTH_FILTER_DESCRIPTION, ge=0),
+) -> SurveyDownloadFilters:
+    if start is not None and end is not None and start > end:
+        raise HTTPException(HTTP_422_UNPROCESSABLE_ENTITY, 'The time window ends before it starts')
+
+    if min_depth is not None and max_depth is not None and min_depth > max_depth:
+        raise HTTPException(HTTP_422_UNPROCESSABLE_ENTITY, 'The minimum depth is greater than the maximum depth')
+
+    return SurveyDownloadFilters(start=start, end=end, min_depth=min_depth, max_depth=max_depth)
+
+
+def get_time_window_filters(
+        start: datetime = Query(None, title='Time window start'),
+        end: datetime = Query(None, title='Time window end'),
+) -> SurveyDownloadFilters:
+    return get_survey_download_filters(start, end, None, None)
+
+
+def filter_statement(stmt: Select, filters: SurveyDownloadFilters, time_column, depth_column=None) -> Select:
+    """
+    Limits a statement to the rows whose time and depth fall within the filters, so that only those rows are read
+    from the database.
+    """
+    if filters.start is not None:
+        stmt = stmt.where(time_column >= filters.start)
+
+    if filters.end is not None:
+        stmt = stmt.where(time_column <= filters.end)
+
+    if depth_column is not None:
+        if filters.min_depth is not None:
+            stmt = stmt.where(depth_column >= filters.min_depth)
+
+        if filters.max_depth is not None:
+            stmt = stmt.where(depth_column <= filters.max_depth)
+
+    return stmt
+
+
+@router.api_route(
     f"/{ConstSurveyType.UTR.value}/{{survey_id}}",
+    methods=['GET', 'HEAD'],
     response_class=StreamingResponse
 )
 async def download_utr_survey_data(
+        request: Request,
         survey_id: str,
         data_type: str = Query(None, title='Data Type'),
+        download_format: DownloadFormat = Query(DownloadFormat.CSV, alias='format', title='File format'),
+        compression: Compression = Depends(get_compression),
+        filters: SurveyDownloadFilters = Depends(get_survey_download_filters),
         auth: Authorized = Depends(Authorize(SADCOScope.UTR_DOWNLOAD))
 ):
-    items = get_currents_items(survey_id)
+    stmt = get_currents_statement(survey_id, filters)
 
-    zipped_csv_data: dict = get_csv_data(items, survey_id, data_type)
+    audit = partial(audit_download_request, auth, survey_type=ConstSurveyType.UTR.value, survey_id=survey_id,
+                    data_type=data_type, download_format=download_format, compression=compression.codec,
+                    compression_level=compression.level, **asdict(filters))
 
-    audit_download_request(auth, zipped_csv_data.get('file_info'), ConstSurveyType.UTR.value, survey_id=survey_id,
-                           data_type=data_type)
-
-    return zipped_csv_data.get('zipped_response')
+    return get_download_data(stmt, survey_id, data_type, audit, download_format, unique=True, request=request,
+                             compression=compression, by_survey=True)
 
 
 @router.get(
+    f"/{ConstSurveyType.UTR.value}/{{survey_id}}/estimate",
+    response_model=DownloadEstimateModel,
+    dependencies=[Depends(Authorize(SADCOScope.UTR_DOWNLOAD))],
+)
+async def estimate_utr_survey_data(
+        survey_id: str,
+        filters: SurveyDownloadFilters = Depends(get_survey_download_filters),
+):
+    return get_download_estimate(
+        (get_currents_record_count(survey_id, filters), get_currents_statement(survey_id, filters))
+    )
+
+
+@router.api_route(
     f"/{ConstSurveyType.CURRENTS.value}/{{survey_id}}",
+    methods=['GET', 'HEAD'],
     response_class=StreamingResponse
 )
 async def download_currents_survey_data(
+        request: Request,
         survey_id: str,
         data_type: str = Query(None, title='Data Type'),
+        download_format: DownloadFormat = Query(DownloadFormat.CSV, alias='format', title='File format'),
+        compression: Compression = Depends(get_compression),
+        filters: SurveyDownloadFilters = Depends(get_survey_download_filters),
         auth: Authorized = Depends(Authorize(SADCOScope.CURRENTS_DOWNLOAD))
 ):
-    items = get_currents_items(survey_id)
+    stmt = get_currents_statement(survey_id, filters)
+
+    if download_format == DownloadFormat.NETCDF:
+        stmt = stmt.add_columns(CurDepth.code.label('depth_code'), CurMooring.latitude, CurMooring.longitude)
+
+    audit = partial(audit_download_request, auth, survey_type=ConstSurveyType.CURRENTS.value, survey_id=survey_id,
+                    data_type=data_type, download_format=download_format, compression=compression.codec,
+                    compression_level=compression.level, **asdict(filters))
 
-    zipped_csv_data: dict = get_csv_data(items, survey_id, data_type)
+    return get_download_data(stmt, survey_id, data_type, audit, download_format, unique=True,
+                             netcdf_layout=get_currents_netcdf_layout(), request=request,
+                             compression=compression, by_survey=True)
+
+
+@router.get(
+    f"/{ConstSurveyType.CURRENTS.value}/{{survey_id}}/estimate",
+    response_model=DownloadEstimateModel,
+    dependencies=[Depends(Authorize(SADCOScope.CURRENTS_DOWNLOAD))],
+)
+async def estimate_currents_survey_data(
+        survey_id: str,
+        filters: SurveyDownloadFilters = Depends(get_survey_download_filters),
+):
+    return get_download_estimate(
+        (get_currents_record_count(survey_id, filters), get_currents_statement(survey_id, filters))
+    )
 
-    audit_download_request(auth, zipped_csv_data.get('file_info'), ConstSurveyType.CURRENTS.value, survey_id=survey_id,
-                           data_type=data_type)
 
-    return zipped_csv_data.get('zipped_response')
+def get_currents_netcdf_layout() -> NetCDFLayout:
+    """A time series per mooring depth, with the depth's deployment details and the mooring's position."""
+    return NetCDFLayout(
+        feature_type='timeSeries',
+        instance_dimension='depth',
+        observation_dimension='time',
+        instance_key='depth_code',
+        instance_columns=['sampling_depth', 'instrument', 'time_interval', 'passkey', 'parameters', 'latitude',
+                          'longitude'],
+        observation_order='datetime',
+    )
 
 
-def get_currents_items(survey_id: str) -> list:
+def get_currents_statement(survey_id: str, filters: SurveyDownloadFilters) -> Select:
     stmt = (
         select(
             CurDepth.spldep.label("sampling_depth"),
@@ -81,32 +232,100 @@ def get_currents_items(survey_id: str) -> list:
         .where(CurMooring.survey_id == survey_id.replace("-", "/"))
     )
 
-    if not (results := Session.execute(stmt).unique()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
+    return filter_statement(stmt, filters, CurData.datetime, CurDepth.spldep)
+
+
+def get_currents_record_count(survey_id: str, filters: SurveyDownloadFilters) -> int:
+    """
+    Returns the number of records at the mooring depths of a survey that fall within the filters. A depth's records
+    are all counted if its deployment overlaps the time window.
+    """
+    stmt = (
+        select(func.coalesce(func.sum(CurDepth.number_of_records), 0))
+        .select_from(CurDepth)
+        .join(CurMooring, CurDepth.mooring_code == CurMooring.code)
+        .where(CurMooring.survey_id == survey_id.replace("-", "/"))
+    )
 
-    return results
+    if filters.start is not None:
+        stmt = stmt.where(CurDepth.date_time_end >= filters.start)
 
+    if filters.end is not None:
+        stmt = stmt.where(CurDepth.date_time_start <= filters.end)
 
-@router.get(
+    if filters.min_depth is not None:
+        stmt = stmt.where(CurDepth.spldep >= filters.min_depth)
+
+    if filters.max_depth is not None:
+        stmt = stmt.where(CurDepth.spldep <= filters.max_depth)
+
+    return int(Session.execute(stmt).scalar_one())
+
+
+def get_period_record_count(periods: list, filters: SurveyDownloadFilters) -> int:
+    """
+    Returns the sum of the monthly record counts of the given periods, over the months that overlap the time window
+    of the filters.
+    """
+    start = (filters.start.year, filters.start.month) if filters.start is not None else None
+    end = (filters.end.year, filters.end.month) if filters.end is not None else None
+    total = 0
+
+    for period in periods:
+        for month in range(1, 13):
+            year_month = (int(period.yearp), month)
+
+            if (start is None or year_month >= start) and (end is None or year_month <= end):
+                total += getattr(period, f'm{month:02}') or 0
+
+    return int(total)
+
+
+@router.api_route(
     f"/{ConstSurveyType.WEATHER.value}/{{survey_id}}",
+    methods=['GET', 'HEAD'],
     response_class=StreamingResponse
 )
 async def download_weather_survey_data(
+        request: Request,
         survey_id: str,
         data_type: str = Query(None, title='Data Type'),
+        download_format: DownloadFormat = Query(DownloadFormat.CSV, alias='format', title='File format'),
+        compression: Compression = Depends(get_compression),
+        filters: SurveyDownloadFilters = Depends(get_time_window_filters),
         auth: Authorized = Depends(Authorize(SADCOScope.WEATHER_DOWNLOAD))
 ):
-    items = get_weather_items(survey_id)
+    stmt = get_weather_statement(survey_id, filters)
 
-    zipped_csv_data: dict = get_csv_data(items, survey_id, data_type)
+    audit = partial(audit_download_request, auth, survey_type=ConstSurveyType.WEATHER.value, survey_id=survey_id,
+                    data_type=data_type, download_format=download_format, compression=compression.codec,
+                    compression_level=compression.level, start=filters.start, end=filters.end)
 
-    audit_download_request(auth, zipped_csv_data.get('file_info'), ConstSurveyType.WEATHER.value, survey_id=survey_id,
-                           data_type=data_type)
+    return get_download_data(stmt, survey_id, data_type, audit, download_format, request=request,
+                             compression=compression, by_survey=True)
 
-    return zipped_csv_data.get('zipped_response')
+
+@router.get(
+    f"/{ConstSurveyType.WEATHER.value}/{{survey_id}}/estimate",
+    response_model=DownloadEstimateModel,
+    dependencies=[Depends(Authorize(SADCOScope.WEATHER_DOWNLOAD))],
+)
+async def estimate_weather_survey_data(
+        survey_id: str,
+        filters: SurveyDownloadFilters = Depends(get_time_window_filters),
+):
+    periods = Session.execute(
+        select(WetPeriodCounts)
+        .join(WetPeriodCounts.wet_station)
+        .where(WetStation.survey_id == survey_id.replace("-", "/"))
+    ).scalars().all()
+
+    return get_download_estimate(
+        (get_period_record_count(periods, filters), get_weather_statement(survey_id, filters))
+    )
 
 
-def get_weather_items(survey_id: str) -> list:
+def get_weather_statement(survey_id: str, filters: SurveyDownloadFilters) -> Select:
     stmt = (
         select(
             WetStation.name.label("station_name"),
@@ -141,33 +360,54 @@ def get_weather_items(survey_id: str) -> list:
         .where(Inventory.survey_id == survey_id.replace("-", "/"))
     )
 
-    results = Session.execute(stmt).all()
-    if not results:
-        raise HTTPException(HTTP_404_NOT_FOUND)
-
-    return results
+    return filter_statement(stmt, filters, WetData.date_time)
 
 
-@router.get(
+@router.api_route(
     f"/{ConstSurveyType.WAVES.value}/{{survey_id}}",
+    methods=['GET', 'HEAD'],
     response_class=StreamingResponse
 )
 async def download_waves_survey_data(
+        request: Request,
         survey_id: str,
         data_type: str = Query(None, title='Data Type'),
+        download_format: DownloadFormat = Query(DownloadFormat.CSV, alias='format', title='File format'),
+        compression: Compression = Depends(get_compression),
+        filters: SurveyDownloadFilters = Depends(get_time_window_filters),
         auth: Authorized = Depends(Authorize(SADCOScope.WAVES_DOWNLOAD))
 ):
-    items = get_waves_items(survey_id)
+    stmt = get_waves_statement(survey_id, filters)
 
-    zipped_csv_data: dict = get_csv_data(items, survey_id, data_type)
+    audit = partial(audit_download_request, auth, survey_type=ConstSurveyType.WAVES.value, survey_id=survey_id,
+                    data_type=data_type, download_format=download_format, compression=compression.codec,
+                    compression_level=compression.level, start=filters.start, end=filters.end)
 
-    audit_download_request(auth, zipped_csv_data.get('file_info'), ConstSurveyType.WAVES.value, survey_id=survey_id,
-                           data_type=data_type)
+    return get_download_data(stmt, survey_id, data_type, audit, download_format, request=request,
+                             compression=compression, by_survey=True)
 
-    return zipped_csv_data.get('zipped_response')
+
+@router.get(
+    f"/{ConstSurveyType.WAVES.value}/{{survey_id}}/estimate",
+    response_model=DownloadEstimateModel,
+    dependencies=[Depends(Authorize(SADCOScope.WAVES_DOWNLOAD))],
+)
+async def estimate_waves_survey_data(
+        survey_id: str,
+        filters: SurveyDownloadFilters = Depends(get_time_window_filters),
+):
+    periods = Session.execute(
+        select(WavPeriod)
+        .join(WavPeriod.wav_station)
+        .where(WavStation.survey_id == survey_id.replace("-", "/"))
+    ).scalars().all()
+
+    return get_download_estimate(
+        (get_period_record_count(periods, filters), get_waves_statement(survey_id, filters))
+    )
 
 
-def get_waves_items(survey_id: str) -> list:
+def get_waves_statement(survey_id: str, filters: SurveyDownloadFilters) -> Select:
     stmt = (
         select(
             WavStation.latitude,
@@ -204,76 +444,343 @@ def get_waves_items(survey_id: str) -> list:
         .where(Inventory.survey_id == survey_id.replace("-", "/"))
     )
 
-    if not (results := Session.execute(stmt).all()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
-
-    return results
+    return filter_statement(stmt, filters, WavData.date_time)
 
 
 @router.get(
+    f"/{ConstSurveyType.HYDRO.value}/estimate",
+    response_model=DownloadEstimateModel,
+    dependencies=[Depends(Authorize(SADCOScope.HYDRO_DOWNLOAD))],
+)
+async def estimate_hydro_surveys_data(
+        survey_id: list[str] = Query(..., title='Survey IDs'),
+        data_type: str = Query(..., title='Data Type'),
+        columns: list[str] = Query(None, title='Columns to include'),
+        filters: SurveyDownloadFilters = Depends(get_survey_download_filters),
+):
+    # This route is declared before the survey download route, whose path would otherwise match it
+    survey_ids = get_hydro_batch_survey_ids(survey_id, data_type)
+    check_hydro_depth_filters(data_type, filters)
+
+    return get_download_estimate(get_hydro_estimate_part(survey_ids, data_type, columns, filters))
+
+
+@router.api_route(
     f"/{ConstSurveyType.HYDRO.value}/{{survey_id}}",
+    methods=['GET', 'HEAD'],
     response_class=StreamingResponse
 )
 async def download_hydro_survey_data(
+        request: Request,
         survey_id: str,
         data_type: str = Query(None, title='Data Type'),
+        download_format: DownloadFormat = Query(DownloadFormat.CSV, alias='format', title='File format'),
+        compression: Compression = Depends(get_compression),
+        fast_csv: bool = Query(False, title='Encode the csv in the database'),
+        columns: list[str] = Query(None, title='Columns to include'),
+        filters: SurveyDownloadFilters = Depends(get_survey_download_filters),
         auth: Authorized = Depends(Authorize(SADCOScope.HYDRO_DOWNLOAD))
 ):
-    items = get_hydro_data_type_items(data_type, survey_id)
+    audit = partial(audit_download_request, auth, survey_type=ConstSurveyType.HYDRO.value, survey_id=survey_id,
+                    data_type=data_type, fast_csv=fast_csv, download_format=download_format,
+                    compression=compression.codec, compression_level=compression.level, columns=columns,
+                    **asdict(filters))
+
+    if data_type == HYDRO_BUNDLE_DATA_TYPE:
+        if request.method == 'HEAD':
+            raise HTTPException(HTTP_405_METHOD_NOT_ALLOWED, headers={'Allow': 'GET'})
+
+        if download_format != DownloadFormat.CSV or fast_csv or columns:
+            raise HTTPException(
+                HTTP_422_UNPROCESSABLE_ENTITY, 'All data types can only be downloaded as csv, with all columns'
+            )
+
+        return get_bundle_data(
+            partial(get_hydro_bundle_statements, survey_id=survey_id, filters=filters), survey_id, data_type, audit,
+            compression=compression
+        )
+
+    check_hydro_data_type(data_type, HYDRO_BUNDLE_DATA_TYPE)
+    check_hydro_depth_filters(data_type, filters)
+
+    stmt = get_hydro_data_type_statement(data_type, get_hydro_sources(survey_id, filters), filters)
+    stmt = select_columns(stmt, columns, get_hydro_key_columns(download_format))
+
+    return get_download_data(stmt, survey_id, data_type, audit, download_format, use_copy=fast_csv,
+                             netcdf_layout=get_hydro_netcdf_layout(stmt), request=request,
+                             compression=compression, by_survey=True)
+
+
+@router.get(
+    f"/{ConstSurveyType.HYDRO.value}/{{survey_id}}/estimate",
+    response_model=DownloadEstimateModel,
+    dependencies=[Depends(Authorize(SADCOScope.HYDRO_DOWNLOAD))],
+)
+async def estimate_hydro_survey_data(
+        survey_id: str,
+        data_type: str = Query(None, title='Data Type'),
+        columns: list[str] = Query(None, title='Columns to include'),
+        filters: SurveyDownloadFilters = Depends(get_survey_download_filters),
+):
+    if data_type == HYDRO_BUNDLE_DATA_TYPE:
+        return get_download_estimate(*(
+            get_hydro_estimate_part([survey_id], bundle_data_type, None, filters) for bundle_data_type in DataType
+        ))
+
+    if data_type not in HYDRO_DATA_TYPE_RECORD_COUNTS:
+        raise HTTPException(HTTP_404_NOT_FOUND)
+
+    check_hydro_depth_filters(data_type, filters)
 
-    zipped_csv_data: dict = get_csv_data(items, survey_id, data_type)
+    return get_download_estimate(get_hydro_estimate_part([survey_id], data_type, columns, filters))
 
-    audit_download_request(auth, zipped_csv_data.get('file_info'),
-                           ConstSurveyType.HYDRO.value,
-                           survey_id=survey_id, data_type=data_type)
 
-    return zipped_csv_data.get('zipped_response')
+@router.get(
+    f"/{ConstSurveyType.HYDRO.value}",
+    response_class=StreamingResponse
+)
+async def download_hydro_surveys_data(
+        survey_id: list[str] = Query(..., title='Survey IDs'),
+        data_type: str = Query(..., title='Data Type'),
+        columns: list[str] = Query(None, title='Columns to include'),
+        filters: SurveyDownloadFilters = Depends(get_survey_download_filters),
+        auth: Authorized = Depends(Authorize(SADCOScope.HYDRO_DOWNLOAD))
+):
+    survey_ids = get_hydro_batch_survey_ids(survey_id, data_type)
+    check_hydro_depth_filters(data_type, filters)
+
+    statements = {
+        batch_survey_id: select_columns(
+            get_hydro_data_type_statement(data_type, get_hydro_sources(batch_survey_id, filters), filters),
+            columns,
+            HYDRO_KEY_COLUMNS
+        )
+        for batch_survey_id in survey_ids
+    }
 
+    audit = partial(audit_download_request, auth, survey_type=ConstSurveyType.HYDRO.value, survey_ids=survey_ids,
+                    data_type=data_type, columns=columns, **asdict(filters))
 
-def get_hydro_data_type_items(data_type: str, survey_id: str) -> list:
+    return get_batch_data(statements, data_type, audit)
+
+
+def get_hydro_key_columns(download_format: DownloadFormat) -> list[str]:
+    """Returns the key columns of a hydro download; an ODV file also needs its stations' positions and dates."""
+    if download_format == DownloadFormat.ODV:
+        return HYDRO_KEY_COLUMNS + ODV_KEY_COLUMNS
+
+    return HYDRO_KEY_COLUMNS
+
+
+def get_hydro_batch_survey_ids(survey_ids: list[str], data_type: str) -> list[str]:
+    """Returns the distinct survey ids of a batch download, or raises a 422 if the batch cannot be downloaded."""
+    survey_ids = list(dict.fromkeys(survey_ids))
+
+    if len(survey_ids) > HYDRO_BATCH_LIMIT:
+        raise HTTPException(
+            HTTP_422_UNPROCESSABLE_ENTITY, f'At most {HYDRO_BATCH_LIMIT} surveys can be downloaded together'
+        )
+
+    check_hydro_data_type(data_type)
+
+    return survey_ids
+
+
+def check_hydro_data_type(data_type: str | None, *other_data_types: str):
+    """Raises a 422 if data_type is not one of the hydro data types, or of the other data types of a route."""
+    data_types = [member.value for member in DataType] + list(other_data_types)
+
+    if data_type not in data_types:
+        raise HTTPException(
+            HTTP_422_UNPROCESSABLE_ENTITY, f'A data type must be given, one of: {", ".join(data_types)}'
+        )
+
+
+def check_hydro_depth_filters(data_type: str, filters: SurveyDownloadFilters):
+    """Raises a 422 if a data type that is observed at the surface is filtered by depth."""
+    if data_type in HYDRO_SURFACE_DATA_TYPES and (filters.min_depth is not None or filters.max_depth is not None):
+        raise HTTPException(HTTP_422_UNPROCESSABLE_ENTITY, f'The {data_type} data type cannot be filtered by depth')
+
+
+def get_hydro_estimate_part(survey_ids: list[str], data_type: str, columns: list[str],
+                            filters: SurveyDownloadFilters) -> tuple[int, Select]:
+    """
+    Returns the row count and statement from which a download of a data type of the given surveys is estimated.
+    The inventory statistics count the rows of whole surveys, so the count is an upper bound when filters are given.
+    """
+    count = Session.execute(
+        select(func.coalesce(func.sum(HYDRO_DATA_TYPE_RECORD_COUNTS[data_type]), 0))
+        .where(InvStats.survey_id.in_([survey_id.replace("-", "/") for survey_id in survey_ids]))
+    ).scalar_one()
+
+    stmt = get_hydro_data_type_statement(data_type, get_hydro_sources(survey_ids[0], filters), filters)
+
+    return int(count), select_columns(stmt, columns, HYDRO_KEY_COLUMNS)
+
+
+def get_hydro_netcdf_layout(stmt: Select) -> NetCDFLayout | None:
+    """
+    A profile per station, with the station's details and position. Only data types that are sampled at depth
+    have a layout.
+    """
+    if 'spldep' not in stmt.selected_columns:
+        return None
+
+    return NetCDFLayout(
+        feature_type='profile',
+        instance_dimension='station',
+        observation_dimension='depth',
+        instance_key='station_id',
+        instance_columns=[field.key for field in get_hydro_fields()],
+        observation_order='spldep',
+    )
+
+
+@dataclass
+class HydroSources:
+    """
+    The joins of a hydro survey's stations, and of its stations and samples, from which the data type statements
+    select. The station and sample fields are in these, so the data type statements only add the sample's child
+    tables.
+
+    The child tables are keyed by sample_code, and the weather and currents by station, so each statement returns
+    one row per sample (or per station or currents record) without any duplicates to remove.
+    """
+    stations: FromClause
+    water_samples: FromClause
+    sediment_samples: FromClause
+
+
+def get_hydro_data_type_statement(data_type: str, sources: HydroSources, filters: SurveyDownloadFilters) -> Select:
+    """
+    Returns the statement of a data type. The samples in sources are already filtered; the weather and currents
+    recorded at the stations are filtered here. Weather is observed at the surface, so only its time is filtered,
+    by the date of the station; the routes reject depth filters for weather alone (see check_hydro_depth_filters).
+    """
     match data_type:
         case DataType.WATER:
-            return get_water_items(survey_id)
+            return get_water_statement(sources.water_samples)
         case DataType.WATERNUTRIENTSANDCHEMISTRY:
-            return get_water_nutrients_and_chemistry_items(survey_id)
+            return get_water_nutrients_and_chemistry_statement(sources.water_samples)
         case DataType.WATERPOLLUTION:
-            return get_water_pollution_items(survey_id)
+            return get_water_pollution_statement(sources.water_samples)
         case DataType.WATERCHEMISTRY:
-            return get_water_chemistry_items(survey_id)
+            return get_water_chemistry_statement(sources.water_samples)
         case DataType.WATERNUTRIENTS:
-            return get_water_nutrients_items(survey_id)
+            return get_water_nutrients_statement(sources.water_samples)
         case DataType.SEDIMENT:
-            return get_sediment_items(survey_id)
+            return get_sediment_statement(sources.sediment_samples)
         case DataType.SEDIMENTPOLLUTION:
-            return get_sediment_pollution_items(survey_id)
+            return get_sediment_pollution_statement(sources.sediment_samples)
         case DataType.SEDIMENTCHEMISTRY:
-            return get_sediment_chemistry_items(survey_id)
+            return get_sediment_chemistry_statement(sources.sediment_samples)
         case DataType.WEATHER:
-            return get_hydro_weather_items(survey_id)
+            return filter_statement(get_hydro_weather_statement(sources.stations), filters, sources.stations.c.date)
         case DataType.CURRENTS:
-            return get_hydro_currents_items(survey_id)
+            return filter_statement(
+                get_hydro_currents_statement(sources.stations), filters, Currents.spldattim, Currents.spldep
+            )
+
+
+def get_hydro_bundle_statements(connection: Connection, survey_id: str,
+                                filters: SurveyDownloadFilters) -> dict[str, Select]:
+    """Returns the statement of every data type, selecting from source tables created on the connection."""
+    sources = create_hydro_source_tables(connection, survey_id, filters)
+    statements = {
+        data_type.value: get_hydro_data_type_statement(data_type, sources, filters) for data_type in DataType
+    }
+
+    return {data_type: stmt for data_type, stmt in statements.items() if stmt is not None}
+
+
+def get_hydro_sources(survey_id: str, filters: SurveyDownloadFilters) -> HydroSources:
+    """Returns the sources of a survey as subqueries, which are inlined into each data type statement."""
+    stations = get_stations_statement(survey_id).subquery('stations')
+
+    return HydroSources(
+        stations=stations,
+        water_samples=get_water_samples_statement(stations, filters).subquery('water_samples'),
+        sediment_samples=get_sediment_samples_statement(stations, filters).subquery('sediment_samples'),
+    )
+
+
+def create_hydro_source_tables(connection: Connection, survey_id: str, filters: SurveyDownloadFilters) -> HydroSources:
+    """
+    Returns the sources of a survey as temporary tables, so that the joins are computed once for all of the
+    data type statements that are run on the connection.
+    """
+    stations = create_temporary_table(connection, 'hydro_stations', get_stations_statement(survey_id))
+
+    return HydroSources(
+        stations=stations,
+        water_samples=create_temporary_table(
+            connection, 'hydro_water_samples', get_water_samples_statement(stations, filters)
+        ),
+        sediment_samples=create_temporary_table(
+            connection, 'hydro_sediment_samples', get_sediment_samples_statement(stations, filters)
+        ),
+    )
 
 
-def get_water_items(survey_id: str) -> list:
+def get_stations_statement(survey_id: str) -> Select:
     stmt = (
         select(
-            *get_hydro_water_fields()
+            *get_hydro_fields()
         )
         .join(Survey, Station.survey_id == Survey.survey_id)
-        .join(Watphy, Watphy.station_id == Station.station_id)
         .where(Survey.survey_id == survey_id.replace('-', '/'))
     )
 
-    if not (results := Session.execute(stmt).all()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
+    return stmt
+
+
+def get_water_samples_statement(stations: FromClause, filters: SurveyDownloadFilters) -> Select:
+    stmt = (
+        select(
+            *stations.c,
+            *get_water_sample_fields(),
+            Watphy.code.label('sample_code')
+        )
+        .select_from(stations)
+        .join(Watphy, Watphy.station_id == stations.c.station_id)
+    )
 
-    return results
+    return filter_statement(stmt, filters, Watphy.spldattim, Watphy.spldep)
 
 
-def get_water_nutrients_and_chemistry_items(survey_id: str) -> list:
+def get_sediment_samples_statement(stations: FromClause, filters: SurveyDownloadFilters) -> Select:
     stmt = (
         select(
-            *get_hydro_water_fields(),
+            *stations.c,
+            *get_sediment_sample_fields(),
+            Sedphy.code.label('sample_code')
+        )
+        .select_from(stations)
+        .join(Sedphy, Sedphy.station_id == stations.c.station_id)
+    )
+
+    return filter_statement(stmt, filters, Sedphy.spldattim, Sedphy.spldep)
+
+
+def get_sample_fields(samples: FromClause) -> list:
+    return [column for column in samples.c if column.key != 'sample_code']
+
+
+def get_water_statement(water_samples: FromClause) -> Select:
+    stmt = (
+        select(
+            *get_sample_fields(water_samples)
+        )
+        .select_from(water_samples)
+    )
+
+    return stmt
+
+
+def get_water_nutrients_and_chemistry_statement(water_samples: FromClause) -> Select:
+    stmt = (
+        select(
+            *get_sample_fields(water_samples),
             Watnut.no2,
             Watnut.no3,
             Watnut.po4,
@@ -282,24 +789,19 @@ def get_water_nutrients_and_chemistry_items(survey_id: str) -> list:
             Watchem1.ph,
             Watchl.chla
         )
-        .join(Survey, Station.survey_id == Survey.survey_id)
-        .join(Watphy, Watphy.station_id == Station.station_id)
-        .outerjoin(Watchl, Watphy.code == Watchl.watphy_code)
-        .outerjoin(Watnut, Watphy.code == Watnut.watphy_code)
-        .outerjoin(Watchem1, Watphy.code == Watchem1.watphy_code)
-        .where(Survey.survey_id == survey_id.replace('-', '/'))
+        .select_from(water_samples)
+        .outerjoin(Watchl, water_samples.c.sample_code == Watchl.watphy_code)
+        .outerjoin(Watnut, water_samples.c.sample_code == Watnut.watphy_code)
+        .outerjoin(Watchem1, water_samples.c.sample_code == Watchem1.watphy_code)
     )
 
-    if not (results := Session.execute(stmt).unique().all()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
-
-    return results
+    return stmt
 
 
-def get_water_pollution_items(survey_id: str) -> list:
+def get_water_pollution_statement(water_samples: FromClause) -> Select:
     stmt = (
         select(
-            *get_hydro_water_fields(),
+            *get_sample_fields(water_samples),
             Watpol1.arsenic,
             Watpol1.cadmium,
             Watpol1.chromium,
@@ -320,23 +822,18 @@ def get_water_pollution_items(survey_id: str) -> list:
             Watpol2.titanium,
             Watpol2.vanadium
         )
-        .join(Survey, Station.survey_id == Survey.survey_id)
-        .join(Watphy, Watphy.station_id == Station.station_id)
-        .outerjoin(Watpol1, Watphy.code == Watpol1.watphy_code)
-        .outerjoin(Watpol2, Watphy.code == Watpol2.watphy_code)
-        .where(Survey.survey_id == survey_id.replace('-', '/'))
+        .select_from(water_samples)
+        .outerjoin(Watpol1, water_samples.c.sample_code == Watpol1.watphy_code)
+        .outerjoin(Watpol2, water_samples.c.sample_code == Watpol2.watphy_code)
     )
 
-    if not (results := Session.execute(stmt).unique().all()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
-
-    return results
+    return stmt
 
 
-def get_water_chemistry_items(survey_id: str) -> list:
+def get_water_chemistry_statement(water_samples: FromClause) -> Select:
     stmt = (
         select(
-            *get_hydro_water_fields(),
+            *get_sample_fields(water_samples),
             Watchem1.dic,
             Watchem1.doc,
             Watchem1.fluoride,
@@ -359,23 +856,18 @@ def get_water_chemistry_items(survey_id: str) -> list:
             Watchem2.so4,
             Watchem2.sussol
         )
-        .join(Survey, Station.survey_id == Survey.survey_id)
-        .join(Watphy, Watphy.station_id == Station.station_id)
-        .outerjoin(Watchem1, Watphy.code == Watchem1.watphy_code)
-        .outerjoin(Watchem2, Watphy.code == Watchem2.watphy_code)
-        .where(Survey.survey_id == survey_id.replace('-', '/'))
+        .select_from(water_samples)
+        .outerjoin(Watchem1, water_samples.c.sample_code == Watchem1.watphy_code)
+        .outerjoin(Watchem2, water_samples.c.sample_code == Watchem2.watphy_code)
     )
 
-    if not (results := Session.execute(stmt).unique()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
-
-    return results
+    return stmt
 
 
-def get_water_nutrients_items(survey_id: str) -> list:
+def get_water_nutrients_statement(water_samples: FromClause) -> Select:
     stmt = (
         select(
-            *get_hydro_water_fields(),
+            *get_sample_fields(water_samples),
             Watnut.no2,
             Watnut.no3,
             Watnut.p,
@@ -384,38 +876,28 @@ def get_water_nutrients_items(survey_id: str) -> list:
             Watnut.sio3,
             Watnut.sio4,
         )
-        .join(Survey, Station.survey_id == Survey.survey_id)
-        .join(Watphy, Watphy.station_id == Station.station_id)
-        .join(Watnut, Watphy.code == Watnut.watphy_code)
-        .where(Survey.survey_id == survey_id.replace('-', '/'))
+        .select_from(water_samples)
+        .join(Watnut, water_samples.c.sample_code == Watnut.watphy_code)
     )
 
-    if not (results := Session.execute(stmt).unique().all()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
-
-    return results
+    return stmt
 
 
-def get_sediment_items(survey_id: str) -> list:
+def get_sediment_statement(sediment_samples: FromClause) -> Select:
     stmt = (
         select(
-            *get_hydro_sediment_fields(),
+            *get_sample_fields(sediment_samples),
         )
-        .join(Survey, Station.survey_id == Survey.survey_id)
-        .join(Sedphy, Sedphy.station_id == Station.station_id)
-        .where(Survey.survey_id == survey_id.replace('-', '/'))
+        .select_from(sediment_samples)
     )
 
-    if not (results := Session.execute(stmt).unique().all()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
-
-    return results
+    return stmt
 
 
-def get_sediment_pollution_items(survey_id: str) -> list:
+def get_sediment_pollution_statement(sediment_samples: FromClause) -> Select:
     stmt = (
         select(
-            *get_hydro_sediment_fields(),
+            *get_sample_fields(sediment_samples),
             Sedpol1.arsenic,
             Sedpol1.cadmium,
             Sedpol1.chromium,
@@ -436,23 +918,18 @@ def get_sediment_pollution_items(survey_id: str) -> list:
             Sedpol2.titanium,
             Sedpol2.vanadium
         )
-        .join(Survey, Station.survey_id == Survey.survey_id)
-        .join(Sedphy, Sedphy.station_id == Station.station_id)
-        .outerjoin(Sedpol1, Sedpol1.sedphy_code == Sedphy.code)
-        .outerjoin(Sedpol2, Sedpol2.sedphy_code == Sedphy.code)
-        .where(Survey.survey_id == survey_id.replace('-', '/'))
+        .select_from(sediment_samples)
+        .outerjoin(Sedpol1, Sedpol1.sedphy_code == sediment_samples.c.sample_code)
+        .outerjoin(Sedpol2, Sedpol2.sedphy_code == sediment_samples.c.sample_code)
     )
 
-    if not (results := Session.execute(stmt).unique().all()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
-
-    return results
+    return stmt
 
 
-def get_sediment_chemistry_items(survey_id: str) -> list:
+def get_sediment_chemistry_statement(sediment_samples: FromClause) -> Select:
     stmt = (
         select(
-            *get_hydro_sediment_fields(),
+            *get_sample_fields(sediment_samples),
             Sedchem1.fluoride,
             Sedchem1.kjn,
             Sedchem1.oxa,
@@ -465,23 +942,18 @@ def get_sediment_chemistry_items(survey_id: str) -> list:
             Sedchem2.strontium,
             Sedchem2.so3
         )
-        .join(Survey, Station.survey_id == Survey.survey_id)
-        .join(Sedphy, Sedphy.station_id == Station.station_id)
-        .outerjoin(Sedchem1, Sedchem1.sedphy_code == Sedphy.code)
-        .outerjoin(Sedchem2, Sedchem2.sedphy_code == Sedphy.code)
-        .where(Survey.survey_id == survey_id.replace('-', '/'))
+        .select_from(sediment_samples)
+        .outerjoin(Sedchem1, Sedchem1.sedphy_code == sediment_samples.c.sample_code)
+        .outerjoin(Sedchem2, Sedchem2.sedphy_code == sediment_samples.c.sample_code)
     )
 
-    if not (results := Session.execute(stmt).unique().all()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
-
-    return results
+    return stmt
 
 
-def get_hydro_weather_items(survey_id: str) -> list:
+def get_hydro_weather_statement(stations: FromClause) -> Select:
     stmt = (
         select(
-            *get_hydro_fields(),
+            *stations.c,
             Weather.nav_equip_type,
             Weather.atmosph_pres,
             Weather.surface_tmp,
@@ -499,21 +971,17 @@ def get_hydro_weather_items(survey_id: str) -> list:
             Weather.swell_period,
             Weather.dupflag
         )
-        .join(Survey, Station.survey_id == Survey.survey_id)
-        .join(Weather, Weather.station_id == Station.station_id)
-        .where(Survey.survey_id == survey_id.replace('-', '/'))
+        .select_from(stations)
+        .join(Weather, Weather.station_id == stations.c.station_id)
     )
 
-    if not (results := Session.execute(stmt).unique().all()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
-
-    return results
+    return stmt
 
 
-def get_hydro_currents_items(survey_id: str) -> list:
+def get_hydro_currents_statement(stations: FromClause) -> Select:
     stmt = (
         select(
-            *get_hydro_fields(),
+            *stations.c,
             Currents.subdes,
             Currents.spldattim,
             Currents.spldep,
@@ -521,20 +989,15 @@ def get_hydro_currents_items(survey_id: str) -> list:
             Currents.current_speed,
             Currents.perc_good
         )
-        .join(Survey, Station.survey_id == Survey.survey_id)
-        .join(Currents, Currents.station_id == Station.station_id)
-        .where(Survey.survey_id == survey_id.replace('-', '/'))
+        .select_from(stations)
+        .join(Currents, Currents.station_id == stations.c.station_id)
     )
 
-    if not (results := Session.execute(stmt).unique().all()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
-
-    return results
+    return stmt
 
 
-def get_hydro_water_fields() -> list:
+def get_water_sample_fields() -> list:
     return [
-        *get_hydro_fields(),
         Watphy.subdes,
         Watphy.spldattim,
         Watphy.spldep,
@@ -550,9 +1013,8 @@ def get_hydro_water_fields() -> list:
     ]
 
 
-def get_hydro_sediment_fields() -> list:
+def get_sediment_sample_fields() -> list:
     return [
-        *get_hydro_fields(),
         Sedphy.subdes,
         Sedphy.spldattim,
         Sedphy.spldep,
@@ -577,7 +1039,7 @@ def get_hydro_fields() -> list:
         Station.survey_id,
         Station.latitude,
         Station.longitude,
-        func.date(Station.date_start).label('date'),
+        func.date(Station.date_start, type_=Date).label('date'),
         Station.stnnam.label('station_name'),
         Station.station_id,
         Survey.planam.label('platform_name'),
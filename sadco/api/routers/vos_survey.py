@@ -1,21 +1,67 @@
-from datetime import date
+import logging
+import math
+import threading
+from datetime import date, datetime, timedelta, timezone
+from functools import partial
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from fastapi.responses import StreamingResponse
-from sqlalchemy import select, func, union
-from starlette.status import HTTP_404_NOT_FOUND, HTTP_413_REQUEST_ENTITY_TOO_LARGE
+from sqlalchemy import (Date, DateTime, Integer, and_, case, cast, delete, exists, func, insert, literal,
+                        literal_column, or_, select, tablesample, true, tuple_, union_all)
+from sqlalchemy.orm import aliased
+from starlette.status import HTTP_413_REQUEST_ENTITY_TOO_LARGE
 
 from sadco.api.lib.auth import Authorize, Authorized
-from sadco.api.lib.download import get_csv_data, audit_download_request
-from sadco.api.models import VosSurveySearchResult
+from sadco.api.lib.download import (get_download_data, audit_download_request, select_columns, get_compression,
+                                    Compression, DownloadFormat)
+from sadco.api.lib.download_estimate import get_download_estimate
+from sadco.api.lib.zorder import (ZORDER_BITS, ZORDER_LATITUDE_RANGE, ZORDER_LONGITUDE_RANGE, get_zorder_cell,
+                                  get_zorder_day, get_zorder_ranges)
+from sadco.api.models import DownloadEstimateModel, VosSurveySearchResult
 from sadco.const import SADCOScope, SurveyType
 from sadco.db import Session
-from sadco.db.models import VosMain, VosArch, VosArch2, VosMain2, VosMain68
+from sadco.db.models import (VosMain, VosArch, VosArch2, VosMain2, VosMain68, VosPartitioned, VosCountCube,
+                              VosCountCubeChange, VosCountCubeRefresh)
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# The VOS tables, in order of precedence for a record that is held in more than one of them
+VOS_MODELS = [VosMain, VosMain2, VosMain68, VosArch, VosArch2]
+
+# Value of dupflag that marks a record as a duplicate
+VOS_DUPLICATE_FLAG = 'Y'
+
 VOS_DOWNLOAD_LIMIT = 4000000
 
+# Downloads of more rows than this are produced in full before they are sent, so that they can be resumed
+VOS_MATERIALISE_LIMIT = 500000
+
+# Columns that identify an observation, as the VOS tables' primary key does, which are included whichever columns
+# are selected
+VOS_KEY_COLUMNS = ['latitude', 'longitude', 'date_time', 'callsign']
+
+# Percentage of the VOS tables' pages that are sampled to estimate a search total
+VOS_SAMPLE_PERCENT = 1
+
+# Seed of the sampling of pages, so that the same pages are sampled for each search
+VOS_SAMPLE_SEED = 0
+
+# Number of standard errors on either side of an estimated total, giving a 95% confidence interval
+VOS_SAMPLE_CONFIDENCE_Z = 1.96
+
+# Number of z-order key ranges that a search is narrowed down to at most
+VOS_ZORDER_MAX_RANGES = 64
+
+# Interval at which the count cube is brought up to date with the days whose VOS records have changed
+VOS_COUNT_CUBE_UPDATE_INTERVAL = timedelta(minutes=1)
+
+# Key of the advisory lock that is held while the count cube is being brought up to date
+VOS_COUNT_CUBE_LOCK = 0x5ad0c0
+
+vos_count_cube_update_stopped = threading.Event()
+
 
 @router.get(
     '/vos_surveys/search',
@@ -31,28 +77,41 @@ async def list_surveys(
         end_date: date = Query(None, title='Date range end'),
         exclusive_region: bool = Query(False, title='Exclude partial spatial matches'),
         exclusive_interval: bool = Query(False, title='Exclude partial temporal matches'),
+        approximate: bool = Query(False, title='Estimate the total from a sample of the records'),
 ):
-    total = get_record_count(
-        north_bound,
-        south_bound,
-        east_bound,
-        west_bound,
-        start_date,
-        end_date,
-        exclusive_region,
-        exclusive_interval
+    vos_filters = dict(
+        north_bound=north_bound,
+        south_bound=south_bound,
+        east_bound=east_bound,
+        west_bound=west_bound,
+        start_date=start_date,
+        end_date=end_date,
+        exclusive_region=exclusive_region,
+        exclusive_interval=exclusive_interval,
     )
 
+    if approximate:
+        total, total_lower, total_upper = get_approximate_record_count(**vos_filters)
+
+        return VosSurveySearchResult(
+            total=total,
+            approximate=True,
+            total_lower=total_lower,
+            total_upper=total_upper
+        )
+
     return VosSurveySearchResult(
-        total=total
+        total=get_record_count(**vos_filters)
     )
 
 
-@router.get(
+@router.api_route(
     "/download",
+    methods=['GET', 'HEAD'],
     response_class=StreamingResponse
 )
 async def download_vos_survey_data(
+        request: Request,
         north_bound: float = Query(None, title='North bound latitude', ge=-90, le=90),
         south_bound: float = Query(None, title='South bound latitude', ge=-90, le=90),
         east_bound: float = Query(None, title='East bound longitude', ge=-180, le=180),
@@ -61,6 +120,9 @@ async def download_vos_survey_data(
         end_date: date = Query(None, title='Date range end'),
         exclusive_region: bool = Query(False, title='Exclude partial spatial matches'),
         exclusive_interval: bool = Query(False, title='Exclude partial temporal matches'),
+        download_format: DownloadFormat = Query(DownloadFormat.CSV, alias='format', title='File format'),
+        compression: Compression = Depends(get_compression),
+        columns: list[str] = Query(None, title='Columns to include'),
         auth: Authorized = Depends(Authorize(SADCOScope.VOS_DOWNLOAD))
 ):
     total = get_record_count(
@@ -75,7 +137,10 @@ async def download_vos_survey_data(
     )
 
     if total > VOS_DOWNLOAD_LIMIT:
-        raise HTTPException(HTTP_413_REQUEST_ENTITY_TOO_LARGE, "Download size too large")
+        raise HTTPException(
+            HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            "Download size too large; submit a download job at /download_jobs/vos instead"
+        )
 
     stmt_vos_union = get_vos_union_statement(
         north_bound,
@@ -85,17 +150,49 @@ async def download_vos_survey_data(
         start_date,
         end_date,
         exclusive_region,
-        exclusive_interval
+        exclusive_interval,
+        columns=columns
+    )
+
+    audit = partial(
+        audit_download_request,
+        auth,
+        survey_type=SurveyType.VOS.value,
+        north_bound=north_bound,
+        south_bound=south_bound,
+        east_bound=east_bound,
+        west_bound=west_bound,
+        start_date=start_date,
+        end_date=end_date,
+        exclusive_region=exclusive_region,
+        exclusive_interval=exclusive_interval,
+        download_format=download_format,
+        compression=compression.codec,
+        compression_level=compression.level,
+        columns=columns
     )
 
-    items = get_vos_items(stmt_vos_union)
+    return get_download_data(stmt_vos_union, 'VOS', 'VOS', audit, download_format, request=request,
+                             materialise=total > VOS_MATERIALISE_LIMIT, compression=compression)
 
-    zipped_csv_data: dict = get_csv_data(items, 'VOS', 'VOS')
 
-    audit_download_request(
-        auth,
-        zipped_csv_data.get('file_info'),
-        SurveyType.VOS.value,
+@router.get(
+    '/download/estimate',
+    response_model=DownloadEstimateModel,
+    dependencies=[Depends(Authorize(SADCOScope.VOS_DOWNLOAD))],
+)
+async def estimate_vos_survey_data(
+        north_bound: float = Query(None, title='North bound latitude', ge=-90, le=90),
+        south_bound: float = Query(None, title='South bound latitude', ge=-90, le=90),
+        east_bound: float = Query(None, title='East bound longitude', ge=-180, le=180),
+        west_bound: float = Query(None, title='West bound longitude', ge=-180, le=180),
+        start_date: date = Query(None, title='Date range start'),
+        end_date: date = Query(None, title='Date range end'),
+        exclusive_region: bool = Query(False, title='Exclude partial spatial matches'),
+        exclusive_interval: bool = Query(False, title='Exclude partial temporal matches'),
+        columns: list[str] = Query(None, title='Columns to include'),
+):
+    vos_filters = dict(
         north_bound=north_bound,
         south_bound=south_bound,
         east_bound=east_bound,
@@ -103,10 +200,12 @@ async def download_vos_survey_data(
         start_date=start_date,
         end_date=end_date,
         exclusive_region=exclusive_region,
-        exclusive_interval=exclusive_interval
+        exclusive_interval=exclusive_interval,
     )
 
-    return zipped_csv_data.get('zipped_response')
+    return get_download_estimate(
+        (int(get_record_count(**vos_filters)), get_vos_union_statement(**vos_filters, columns=columns))
+    )
 
 
 def get_record_count(
@@ -119,7 +218,72 @@ def get_record_count(
         exclusive_region,
         exclusive_interval,
 ):
-    stmt_vos_union = get_vos_union_statement(
+    """
+    Returns the number of records in the VOS tables that match the filters. While the count cube is up to date with
+    the VOS tables, the records in the cells that lie wholly within the region are counted from the cube, and only
+    the records in the partly covered cells along the edges of the region are counted in the tables. The cube
+    counts records per day, so the date range is always answered from it exactly.
+    """
+    latitude_cells = get_interior_cells(south_bound, north_bound)
+    longitude_cells = get_interior_cells(west_bound, east_bound)
+
+    if not has_interior_cells(latitude_cells, longitude_cells) or not is_vos_count_cube_current():
+        return get_scanned_record_count(
+            north_bound,
+            south_bound,
+            east_bound,
+            west_bound,
+            start_date,
+            end_date,
+            exclusive_region,
+            exclusive_interval
+        )
+
+    record_count = VosCountCube.record_count
+    if end_date is not None:
+        # Records on the last day are only included at its start, as they must not be later than end_date
+        record_count = case((VosCountCube.day == end_date, VosCountCube.midnight_count), else_=record_count)
+
+    stmt = filter_cells(
+        select(func.coalesce(func.sum(record_count), 0)),
+        latitude_cells,
+        longitude_cells
+    )
+
+    if start_date:
+        stmt = stmt.where(VosCountCube.day >= start_date)
+
+    if end_date:
+        stmt = stmt.where(VosCountCube.day <= end_date)
+
+    edge_statements = [
+        get_filtered_statement(
+            get_statement(vos_model, is_count_only=True),
+            vos_model,
+            north_bound,
+            south_bound,
+            east_bound,
+            west_bound,
+            start_date,
+            end_date,
+            exclusive_region,
+            exclusive_interval
+        ).where(or_(*edge_conditions))
+        for vos_model in get_vos_models()
+        if (edge_conditions := get_edge_conditions(vos_model, latitude_cells, longitude_cells))
+    ]
+
+    edge_count = 0
+    if edge_statements:
+        edge_counts = union_all(*edge_statements).subquery()
+        edge_count = Session.execute(
+            select(func.coalesce(func.sum(edge_counts.c.vos_record_count), 0))
+        ).scalar_one()
+
+    return int(Session.execute(stmt).scalar_one()) + int(edge_count)
+
+
+def get_approximate_record_count(
         north_bound,
         south_bound,
         east_bound,
@@ -128,19 +292,274 @@ def get_record_count(
         end_date,
         exclusive_region,
         exclusive_interval,
-        is_count_only=True
+) -> tuple[int, int, int]:
+    """
+    Estimates the number of records in the VOS tables that match the filters from a sample of the tables' pages,
+    returning the estimate and the bounds of its confidence interval. Each page is sampled with a probability of
+    VOS_SAMPLE_PERCENT, so the estimate is the number of matching records in the sampled pages scaled up by that
+    probability, and its variance is estimated from the numbers of matching records on each of the sampled pages.
+    The same pages are sampled for every search, so a search gives the same estimate until the tables change.
+    Only the sampled pages are read; once the partitioned VOS table has been migrated to, its partitions are sampled.
+    """
+    sample_fraction = VOS_SAMPLE_PERCENT / 100
+    record_count = 0
+    squared_page_count = 0
+
+    for vos_model in get_vos_models():
+        sample_name = f'{vos_model.__tablename__}_sample'
+        sample = tablesample(vos_model, VOS_SAMPLE_PERCENT, name=sample_name, seed=literal(VOS_SAMPLE_SEED))
+        records = aliased(vos_model, sample)
+
+        # The page of a record is the first part of its physical location, within the partition that holds it
+        partition = literal_column(f'{sample_name}.tableoid')
+        page = literal_column(f'({sample_name}.ctid::text::point)[0]')
+        pages = get_filtered_statement(
+            select(func.count().label('page_record_count')).select_from(records).where(
+                get_unique_condition(vos_model, records)
+            ).group_by(partition, page),
+            records,
+            north_bound,
+            south_bound,
+            east_bound,
+            west_bound,
+            start_date,
+            end_date,
+            exclusive_region,
+            exclusive_interval
+        ).subquery()
+
+        sample_count, sample_squared_count = Session.execute(
+            select(
+                func.coalesce(func.sum(pages.c.page_record_count), 0),
+                func.coalesce(func.sum(pages.c.page_record_count * pages.c.page_record_count), 0),
+            )
+        ).one()
+
+        record_count += int(sample_count)
+        squared_page_count += int(sample_squared_count)
+
+    estimate = record_count / sample_fraction
+    margin = VOS_SAMPLE_CONFIDENCE_Z * math.sqrt((1 - sample_fraction) * squared_page_count) / sample_fraction
+
+    if not record_count and sample_fraction < 1:
+        # With no matches in the sample, the upper bound is given by the rule of three
+        margin = 3 / sample_fraction
+
+    return round(estimate), max(math.floor(estimate - margin), 0), math.ceil(estimate + margin)
+
+
+def get_interior_cells(lower_bound: float | None, upper_bound: float | None) -> tuple[int | None, int | None]:
+    """
+    Returns the first of the one degree cells that lie wholly within the bounds, and the cell after the last, or
+    None for a side that is not bounded.
+    """
+    return (
+        math.ceil(lower_bound) if lower_bound is not None else None,
+        math.floor(upper_bound) if upper_bound is not None else None,
     )
 
+
+def has_interior_cells(*cell_ranges: tuple[int | None, int | None]) -> bool:
+    return all(first is None or end is None or first < end for first, end in cell_ranges)
+
+
+def filter_cells(stmt, latitude_cells: tuple[int | None, int | None], longitude_cells: tuple[int | None, int | None]):
+    for cell_column, (first, end) in ((VosCountCube.latitude_cell, latitude_cells),
+                                      (VosCountCube.longitude_cell, longitude_cells)):
+        if first is not None:
+            stmt = stmt.where(cell_column >= first)
+
+        if end is not None:
+            stmt = stmt.where(cell_column < end)
+
+    return stmt
+
+
+def get_edge_conditions(vos_model, latitude_cells: tuple[int | None, int | None],
+                        longitude_cells: tuple[int | None, int | None]) -> list:
+    """
+    Returns conditions on a VOS table that select the records outside the interior cells, as disjoint strips along
+    each side of the region, which are found using the table's latitude and longitude index. Latitudes are stored
+    as degrees south, so the latitude cells are negated.
+    """
+    first_latitude, end_latitude = latitude_cells
+    first_longitude, end_longitude = longitude_cells
+    conditions = []
+    interior_latitude = []
+
+    if first_latitude is not None:
+        conditions.append(vos_model.latitude > -first_latitude)
+        interior_latitude.append(vos_model.latitude <= -first_latitude)
+
+    if end_latitude is not None:
+        conditions.append(vos_model.latitude <= -end_latitude)
+        interior_latitude.append(vos_model.latitude > -end_latitude)
+
+    if first_longitude is not None:
+        conditions.append(and_(*interior_latitude, vos_model.longitude < first_longitude))
+
+    if end_longitude is not None:
+        conditions.append(and_(*interior_latitude, vos_model.longitude >= end_longitude))
+
+    return conditions
+
+
+def is_vos_count_cube_current() -> bool:
+    """
+    Returns whether the count cube has been built and counts the records of every day as they are now, which it
+    does once the days that have changed since it was brought up to date have been counted again.
+    """
     return Session.execute(
-        select(func.sum(stmt_vos_union.c.vos_record_count))
+        select(and_(exists(VosCountCubeRefresh.refreshed), ~exists(VosCountCubeChange.day)))
     ).scalar_one()
 
 
-def get_vos_items(statement) -> list:
-    if not (results := Session.execute(statement).all()):
-        raise HTTPException(HTTP_404_NOT_FOUND)
+def refresh_vos_count_cube():
+    """Rebuilds the count cube from the VOS tables."""
+    Session.execute(select(func.pg_advisory_xact_lock(VOS_COUNT_CUBE_LOCK)))
+    changes = Session.execute(select(VosCountCubeChange.day, VosCountCubeChange.version)).all()
+
+    Session.execute(delete(VosCountCube))
+    Session.execute(
+        insert(VosCountCube).from_select(
+            ['latitude_cell', 'longitude_cell', 'day', 'record_count', 'midnight_count'], get_count_cube_cells()
+        )
+    )
+    finish_vos_count_cube_refresh(changes)
+
+
+def update_vos_count_cube():
+    """
+    Brings the count cube up to date with the VOS tables by counting again the records of the days that have
+    changed since, as recorded by the triggers on the VOS tables. The cube is not used while any day is waiting to
+    be counted again, so this is run every VOS_COUNT_CUBE_UPDATE_INTERVAL once the cube has been built.
+    """
+    locked = Session.execute(select(func.pg_try_advisory_xact_lock(VOS_COUNT_CUBE_LOCK))).scalar_one()
+    changes = Session.execute(select(VosCountCubeChange.day, VosCountCubeChange.version)).all()
+
+    if not locked or not changes or not Session.execute(select(exists(VosCountCubeRefresh.refreshed))).scalar_one():
+        Session.rollback()
+        return
+
+    days = [day for day, _ in changes]
+
+    Session.execute(delete(VosCountCube).where(VosCountCube.day.in_(days)))
+    Session.execute(
+        insert(VosCountCube).from_select(
+            ['latitude_cell', 'longitude_cell', 'day', 'record_count', 'midnight_count'],
+            get_count_cube_cells(get_day_ranges(days))
+        )
+    )
+    finish_vos_count_cube_refresh(changes)
+
+
+def finish_vos_count_cube_refresh(changes: list[tuple[date, int]]):
+    """
+    Forgets the changed days that have been counted, unless they have changed again since they were read, and
+    records when the cube was brought up to date.
+    """
+    if changes:
+        Session.execute(
+            delete(VosCountCubeChange).where(tuple_(VosCountCubeChange.day, VosCountCubeChange.version).in_(changes))
+        )
+
+    Session.execute(delete(VosCountCubeRefresh))
+    Session.add(VosCountCubeRefresh(refreshed=datetime.now(timezone.utc)))
+    Session.commit()
+
+
+def get_count_cube_cells(day_ranges: list[tuple[date, date]] = None):
+    """
+    Returns a statement that counts the records in the VOS tables per cell and day, for the days in day_ranges,
+    first inclusive and end exclusive, if given.
+    """
+    records = union_all(*(
+        select((-vos_model.latitude).label('latitude'), vos_model.longitude, vos_model.date_time)
+        .where(get_unique_condition(vos_model))
+        .where(
+            or_(*(and_(vos_model.date_time >= first, vos_model.date_time < end) for first, end in day_ranges))
+            if day_ranges is not None else true()
+        )
+        for vos_model in get_vos_models()
+    )).subquery()
+
+    latitude_cell = cast(func.floor(records.c.latitude), Integer)
+    longitude_cell = cast(func.floor(records.c.longitude), Integer)
+    day = cast(records.c.date_time, Date)
+
+    return (
+        select(
+            latitude_cell,
+            longitude_cell,
+            day,
+            func.count(),
+            func.count().filter(records.c.date_time == cast(day, DateTime)),
+        )
+        .group_by(latitude_cell, longitude_cell, day)
+    )
+
+
+def get_day_ranges(days: list[date]) -> list[tuple[date, date]]:
+    """Returns the runs of consecutive days, as their first day and the day after their last."""
+    day_ranges = []
+
+    for day in sorted(days):
+        if day_ranges and day_ranges[-1][1] == day:
+            day_ranges[-1] = (day_ranges[-1][0], day + timedelta(days=1))
+        else:
+            day_ranges.append((day, day + timedelta(days=1)))
+
+    return day_ranges
+
+
+def start_vos_count_cube_update():
+    """Starts a thread that brings the count cube up to date every VOS_COUNT_CUBE_UPDATE_INTERVAL."""
+    vos_count_cube_update_stopped.clear()
+    threading.Thread(target=run_vos_count_cube_update, name='vos-count-cube-update', daemon=True).start()
+
+
+def stop_vos_count_cube_update():
+    vos_count_cube_update_stopped.set()
+
+
+def run_vos_count_cube_update():
+    while True:
+        try:
+            update_vos_count_cube()
+        except Exception:
+            logger.exception('VOS count cube update failed')
+        finally:
+            Session.remove()
+
+        if vos_count_cube_update_stopped.wait(VOS_COUNT_CUBE_UPDATE_INTERVAL.total_seconds()):
+            break
+
+
+def get_scanned_record_count(
+        north_bound,
+        south_bound,
+        east_bound,
+        west_bound,
+        start_date,
+        end_date,
+        exclusive_region,
+        exclusive_interval,
+):
+    stmt_vos_union = get_vos_union_statement(
+        north_bound,
+        south_bound,
+        east_bound,
+        west_bound,
+        start_date,
+        end_date,
+        exclusive_region,
+        exclusive_interval,
+        is_count_only=True
+    )
 
-    return results
+    return Session.execute(
+        select(func.sum(stmt_vos_union.c.vos_record_count))
+    ).scalar_one()
 
 
 def get_vos_union_statement(
@@ -152,19 +571,25 @@ def get_vos_union_statement(
         end_date: date,
         exclusive_region: bool,
         exclusive_interval: bool,
-        is_count_only: bool = False
+        is_count_only: bool = False,
+        columns: list[str] = None
 ):
     """
-    Build a statement that either counts or return the data for all the VOS tables based on the filters
+    Build a statement that either counts or return the data for all the VOS tables based on the filters. Each
+    record is taken from only one of the tables, so the tables' statements are combined with UNION ALL and the
+    rows are streamed without being sorted to remove duplicates.
     @param is_count_only: boolean parameter to control weather to return a statement that just counts the records or
     returns the actual data
+    @param columns: the data columns to return, along with the key columns; all columns if not given
     """
-    vos_models = [VosMain, VosMain2, VosMain68, VosArch, VosArch2]
     vos_statements = []
 
-    for vos_model in vos_models:
+    for vos_model in get_vos_models():
         stmt = get_statement(vos_model, is_count_only=is_count_only)
 
+        if not is_count_only:
+            stmt = select_columns(stmt, columns, VOS_KEY_COLUMNS)
+
         stmt = get_filtered_statement(
             stmt,
             vos_model,
@@ -180,7 +605,7 @@ def get_vos_union_statement(
 
         vos_statements.append(stmt)
 
-    return union(*vos_statements)
+    return union_all(*vos_statements)
 
 
 def get_statement(vos_model, is_count_only: bool = False):
@@ -190,10 +615,11 @@ def get_statement(vos_model, is_count_only: bool = False):
             .select_from(
                 vos_model
             )
+            .where(get_unique_condition(vos_model))
         )
     else:
         return select(
-            -vos_model.latitude,
+            (-vos_model.latitude).label('latitude'),
             vos_model.longitude,
             vos_model.date_time,
             vos_model.callsign,
@@ -210,7 +636,87 @@ def get_statement(vos_model, is_count_only: bool = False):
             vos_model.wave_period,
             vos_model.wind_direction,
             vos_model.wind_speed
+        ).where(get_unique_condition(vos_model))
+
+
+def get_vos_models() -> list:
+    """
+    Returns the tables that VOS records are queried from: the partitioned VOS table once it has been migrated to,
+    in which the VOS tables are views, or otherwise the VOS tables.
+    """
+    if Session.execute(select(func.to_regclass(VosPartitioned.__table__.fullname))).scalar_one() is not None:
+        return [VosPartitioned]
+
+    return VOS_MODELS
+
+
+def get_unique_condition(vos_model, records=None):
+    """
+    Returns a condition on a VOS table that excludes the records superseded by a copy with the same primary key in
+    another VOS table. A copy that is not flagged as a duplicate supersedes one that is, and otherwise the copy in
+    the table that comes first in VOS_MODELS is kept. Each copy is looked up by the other table's primary key.
+    @param records: an alias of the table whose records the condition applies to; the table itself if not given
+    """
+    records = records if records is not None else vos_model
+
+    if vos_model is VosPartitioned:
+        return get_source_unique_condition(records)
+
+    is_duplicate = func.coalesce(records.dupflag, '') == VOS_DUPLICATE_FLAG
+    position = VOS_MODELS.index(vos_model)
+    conditions = []
+
+    for other_position, other_model in enumerate(VOS_MODELS):
+        if other_model is vos_model:
+            continue
+
+        other_is_duplicate = func.coalesce(other_model.dupflag, '') == VOS_DUPLICATE_FLAG
+
+        if other_position < position:
+            supersedes = or_(~other_is_duplicate, is_duplicate)
+        else:
+            supersedes = and_(~other_is_duplicate, is_duplicate)
+
+        conditions.append(
+            ~select(other_model.latitude)
+            .where(
+                other_model.latitude == records.latitude,
+                other_model.longitude == records.longitude,
+                other_model.date_time == records.date_time,
+                other_model.callsign == records.callsign,
+                supersedes,
+            )
+            .exists()
+        )
+
+    return and_(*conditions)
+
+
+def get_source_unique_condition(records):
+    """
+    Returns a condition on the partitioned VOS table that excludes the records superseded by a copy with the same
+    key from another source, as get_unique_condition does for the VOS tables; the sources are ranked in the order
+    of their tables in VOS_MODELS.
+    """
+    copies = aliased(VosPartitioned)
+    source_positions = {vos_model.__tablename__: position for position, vos_model in enumerate(VOS_MODELS)}
+    is_duplicate = func.coalesce(records.dupflag, '') == VOS_DUPLICATE_FLAG
+    copy_is_duplicate = func.coalesce(copies.dupflag, '') == VOS_DUPLICATE_FLAG
+
+    return ~select(copies.latitude).where(
+        copies.latitude == records.latitude,
+        copies.longitude == records.longitude,
+        copies.date_time == records.date_time,
+        copies.callsign == records.callsign,
+        copies.source != records.source,
+        or_(
+            and_(~copy_is_duplicate, is_duplicate),
+            and_(
+                copy_is_duplicate == is_duplicate,
+                case(source_positions, value=copies.source) < case(source_positions, value=records.source)
+            ),
         )
+    ).exists()
 
 
 def get_filtered_statement(
@@ -229,12 +735,13 @@ def get_filtered_statement(
     Apply the filters and return the filtered statement
     """
     if exclusive_region:
-        # We need to use the negation of North and South because they come from the DB as south
+        # We need to use the negation of North and South because they come from the DB as south. The bounds are
+        # negated rather than the latitudes, so that the latitude index can be used.
         if north_bound is not None:
-            stmt = stmt.where(-vos_model.latitude <= north_bound)
+            stmt = stmt.where(vos_model.latitude >= -north_bound)
 
         if south_bound is not None:
-            stmt = stmt.where(-vos_model.latitude >= south_bound)
+            stmt = stmt.where(vos_model.latitude <= -south_bound)
 
         if east_bound is not None:
             stmt = stmt.where(vos_model.longitude <= east_bound)
@@ -244,10 +751,10 @@ def get_filtered_statement(
 
     else:
         if north_bound is not None:
-            stmt = stmt.where(-vos_model.latitude <= north_bound)
+            stmt = stmt.where(vos_model.latitude >= -north_bound)
 
         if south_bound is not None:
-            stmt = stmt.where(-vos_model.latitude >= south_bound)
+            stmt = stmt.where(vos_model.latitude <= -south_bound)
 
         if east_bound is not None:
             stmt = stmt.where(vos_model.longitude <= east_bound)
@@ -269,4 +776,50 @@ def get_filtered_statement(
         if end_date:
             stmt = stmt.where(vos_model.date_time <= end_date)
 
+    zorder_ranges = get_vos_zorder_ranges(north_bound, south_bound, east_bound, west_bound, start_date, end_date)
+
+    if zorder_ranges is not None:
+        stmt = stmt.where(or_(*(vos_model.zorder_key.between(first, last) for first, last in zorder_ranges)))
+
     return stmt
+
+
+def get_vos_zorder_ranges(
+        north_bound: float,
+        south_bound: float,
+        east_bound: float,
+        west_bound: float,
+        start_date: date,
+        end_date: date,
+) -> list[tuple[int, int]] | None:
+    """
+    Returns the ranges of z-order keys that cover the records within the bounds, which are found using the key's
+    index, or None if the ranges would not narrow down the search. The latitude and longitude cells are widened by
+    a cell on each side, so that the ranges cover the bounds however they are rounded.
+    """
+    last_cell = (1 << ZORDER_BITS) - 1
+
+    # Latitudes are stored as degrees south
+    lower_cell = (
+        get_zorder_cell(-north_bound if north_bound is not None else ZORDER_LATITUDE_RANGE[0], ZORDER_LATITUDE_RANGE),
+        get_zorder_cell(west_bound if west_bound is not None else ZORDER_LONGITUDE_RANGE[0], ZORDER_LONGITUDE_RANGE),
+        get_zorder_day(start_date) if start_date else 0,
+    )
+    upper_cell = (
+        get_zorder_cell(-south_bound if south_bound is not None else ZORDER_LATITUDE_RANGE[1], ZORDER_LATITUDE_RANGE),
+        get_zorder_cell(east_bound if east_bound is not None else ZORDER_LONGITUDE_RANGE[1], ZORDER_LONGITUDE_RANGE),
+        get_zorder_day(end_date) if end_date else last_cell,
+    )
+    lower_cell = (max(lower_cell[0] - 1, 0), max(lower_cell[1] - 1, 0), lower_cell[2])
+    upper_cell = (min(upper_cell[0] + 1, last_cell), min(upper_cell[1] + 1, last_cell), upper_cell[2])
+
+    # Bounds that cross over select no records, which the filters on the bounds themselves already ensure
+    if any(lower > upper for lower, upper in zip(lower_cell, upper_cell)):
+        return None
+
+    zorder_ranges = get_zorder_ranges(lower_cell, upper_cell, VOS_ZORDER_MAX_RANGES)
+
+    if zorder_ranges == [(0, (1 << 3 * ZORDER_BITS) - 1)]:
+        return None
+
+    return zorder_ranges
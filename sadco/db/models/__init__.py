@@ -31,6 +31,9 @@ from .wet_data import WetData
 from .wav_station import WavStation
 from .wav_data import WavData
 from .wav_period import WavPeriod
-from .vos import VosMain, VosMain2, VosMain68, VosArch, VosArch2
+from .vos import VosMain, VosMain2, VosMain68, VosArch, VosArch2, VosPartitioned
+from .vos_count_cube import VosCountCube, VosCountCubeChange, VosCountCubeRefresh
 from .country import Country
 from .download_audit import DownloadAudit
+from .download_job import DownloadJob
+from .data_version import DataVersion, SurveyDataVersion
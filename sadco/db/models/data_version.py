@@ -0,0 +1,28 @@
+import os
+
+from sqlalchemy import DDL, BigInteger, Column, String, event
+
+from sadco.db import Base
+
+# The triggers that maintain the data versions are added to every table, so they are created after all the tables
+with open(os.path.join(os.path.dirname(__file__), '..', '..', 'sql', 'data_version.sql')) as sql_file:
+    DATA_VERSION_TRIGGERS = DDL(sql_file.read())
+
+
+class DataVersion(Base):
+    """The number of statements that have changed the data in a table, which is maintained by a trigger."""
+    __tablename__ = 'data_version'
+
+    table_name = Column(String, nullable=False, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
+class SurveyDataVersion(Base):
+    """The number of statements that have changed a survey's data, which is maintained by triggers."""
+    __tablename__ = 'survey_data_version'
+
+    survey_id = Column(String, nullable=False, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
+event.listen(Base.metadata, 'after_create', DATA_VERSION_TRIGGERS)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, Numeric, Integer, String
+from sqlalchemy import BigInteger, Column, DateTime, Numeric, Integer, String
 
 from sadco.db import Base
 
@@ -13,4 +13,5 @@ class DownloadAudit(Base):
     parameters = Column(String)
     download_file_size = Column(Numeric)
     download_file_checksum = Column(String)
-    
\ No newline at end of file
+    row_count = Column(BigInteger)
+    download_seconds = Column(Numeric)
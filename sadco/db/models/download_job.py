@@ -0,0 +1,26 @@
+from sqlalchemy import Column, DateTime, Numeric, BigInteger, String
+
+from sadco.db import Base
+
+
+class DownloadJob(Base):
+    __tablename__ = 'download_job'
+
+    id = Column(String, primary_key=True)
+    client_id = Column(String, nullable=False)
+    user_id = Column(String)
+    survey_type = Column(String)
+    parameters = Column(String)
+    download_format = Column(String, nullable=False)
+    file_name = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    error = Column(String)
+    row_count = Column(BigInteger)
+    rows_processed = Column(BigInteger, nullable=False, default=0)
+    created = Column(DateTime(timezone=False), nullable=False)
+    started = Column(DateTime(timezone=False))
+    completed = Column(DateTime(timezone=False))
+    worker_id = Column(String)
+    heartbeat = Column(DateTime(timezone=False))
+    download_file_size = Column(Numeric)
+    download_file_checksum = Column(String)
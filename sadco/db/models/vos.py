@@ -1,9 +1,18 @@
-from sqlalchemy import Column, Numeric, String, Integer, DateTime
+import os
+
+from sqlalchemy import DDL, BigInteger, Column, Computed, Numeric, String, Integer, DateTime, event
 
 from sadco.db import Base
 
+# Functions that compute the z-order key of a VOS record, which are created before the VOS tables that use them
+with open(os.path.join(os.path.dirname(__file__), '..', '..', 'sql', 'vos_zorder_key.sql')) as sql_file:
+    VOS_ZORDER_KEY_FUNCTIONS = DDL(sql_file.read())
+
 
 class Vos:
+    # The z-order key is computed by the database, and is not fetched back when records are inserted
+    __mapper_args__ = {'eager_defaults': False}
+
     latitude = Column(Numeric(7, 5), primary_key=True, nullable=False)
     longitude = Column(Numeric(8, 5), primary_key=True, nullable=False)
     date_time = Column(DateTime, primary_key=True, nullable=False)
@@ -39,6 +48,7 @@ class Vos:
     wind_direction = Column(Integer)
     wind_speed = Column(Numeric(3, 1))
     wind_speed_type = Column(String(1))
+    zorder_key = Column(BigInteger, Computed('sadco.vos_zorder_key(latitude, longitude, date_time)'))
 
 
 class VosMain(Base, Vos):
@@ -61,4 +71,18 @@ class VosArch2(Base, Vos):
     __tablename__ = 'vos_arch2'
 
 
+class VosPartitioned(Base, Vos):
+    """
+    The VOS tables consolidated into a single table, partitioned by year, by sadco/sql/vos_partitioned.sql, with each
+    record tagged with the table that it came from.
+    """
+    __tablename__ = 'vos'
+
+    source = Column(String(10), primary_key=True, nullable=False)
+
+
+# The partitioned table takes the place of the VOS tables once it has been migrated to, so it is not created with them
+Base.metadata.remove(VosPartitioned.__table__)
 
+for vos_model in (VosMain, VosMain2, VosMain68, VosArch, VosArch2):
+    event.listen(vos_model.__table__, 'before_create', VOS_ZORDER_KEY_FUNCTIONS)
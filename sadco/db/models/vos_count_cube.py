@@ -0,0 +1,44 @@
+import os
+
+from sqlalchemy import DDL, Column, BigInteger, Date, DateTime, Integer, event
+
+from sadco.db import Base
+
+# The triggers that record the changed days are added to the VOS tables, so they are created after all the tables
+with open(os.path.join(os.path.dirname(__file__), '..', '..', 'sql', 'vos_count_cube_change.sql')) as sql_file:
+    VOS_COUNT_CUBE_CHANGE_TRIGGERS = DDL(sql_file.read())
+
+
+class VosCountCube(Base):
+    """
+    The number of records in the VOS tables per day, in each cell of a one degree grid. Cells are numbered by the
+    degrees north and east of their south-west corner.
+    """
+    __tablename__ = 'vos_count_cube'
+
+    latitude_cell = Column(Integer, nullable=False, primary_key=True)
+    longitude_cell = Column(Integer, nullable=False, primary_key=True)
+    day = Column(Date, nullable=False, primary_key=True)
+    record_count = Column(BigInteger, nullable=False)
+    midnight_count = Column(BigInteger, nullable=False)
+
+
+class VosCountCubeRefresh(Base):
+    """When the count cube was last brought up to date; the cube has not been built if there is no refresh."""
+    __tablename__ = 'vos_count_cube_refresh'
+
+    refreshed = Column(DateTime(timezone=False), nullable=False, primary_key=True)
+
+
+class VosCountCubeChange(Base):
+    """
+    A day whose VOS records have changed since the count cube was brought up to date, with the id of the
+    transaction that last changed them, which is recorded by triggers.
+    """
+    __tablename__ = 'vos_count_cube_change'
+
+    day = Column(Date, nullable=False, primary_key=True)
+    version = Column(BigInteger, nullable=False)
+
+
+event.listen(Base.metadata, 'after_create', VOS_COUNT_CUBE_CHANGE_TRIGGERS)
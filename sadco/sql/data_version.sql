@@ -0,0 +1,162 @@
+-- Counts the statements that change the data in each table of the sadco schema, as the version of the table's data
+-- from which download files are cached. The version is bumped by a trigger in the transaction of the change, so it
+-- is current as soon as the change is committed, and only ever goes up.
+--
+-- The data of a survey is likewise versioned by the statements that change its rows in the tables that hold survey
+-- data, so that the files of a survey are only produced again once its own data has changed. The survey of each
+-- changed row is found from the statement's transition table, changed_rows.
+--
+-- This is run once all the tables have been created; it may be run again to add the triggers to tables created since.
+
+CREATE TABLE IF NOT EXISTS sadco.data_version (
+    table_name VARCHAR NOT NULL,
+    version BIGINT NOT NULL,
+    PRIMARY KEY (table_name)
+);
+
+CREATE OR REPLACE FUNCTION sadco.bump_data_version() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO sadco.data_version (table_name, version) VALUES (TG_TABLE_SCHEMA || '.' || TG_TABLE_NAME, 1)
+    ON CONFLICT (table_name) DO UPDATE SET version = sadco.data_version.version + 1;
+    RETURN NULL;
+END $$;
+
+DO $$
+DECLARE
+    table_name TEXT;
+BEGIN
+    FOR table_name IN
+        SELECT tablename FROM pg_tables
+        WHERE schemaname = 'sadco' AND tablename NOT IN (
+            'data_version', 'survey_data_version', 'download_audit', 'download_job', 'vos_count_cube',
+            'vos_count_cube_refresh', 'vos_count_cube_change'
+        )
+    LOOP
+        EXECUTE 'DROP TRIGGER IF EXISTS data_version_trigger ON sadco.' || quote_ident(table_name);
+        EXECUTE 'CREATE TRIGGER data_version_trigger AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sadco.'
+            || quote_ident(table_name) || ' FOR EACH STATEMENT EXECUTE FUNCTION sadco.bump_data_version()';
+    END LOOP;
+END $$;
+
+CREATE TABLE IF NOT EXISTS sadco.survey_data_version (
+    survey_id VARCHAR NOT NULL,
+    version BIGINT NOT NULL,
+    PRIMARY KEY (survey_id)
+);
+
+-- TG_ARGV[0] selects the survey_id of each row in changed_rows; a truncated table may have held any survey's rows
+CREATE OR REPLACE FUNCTION sadco.bump_survey_data_version() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        INSERT INTO sadco.survey_data_version (survey_id, version) SELECT survey_id, 1 FROM sadco.inventory
+        ON CONFLICT (survey_id) DO UPDATE SET version = sadco.survey_data_version.version + 1;
+    ELSE
+        EXECUTE 'INSERT INTO sadco.survey_data_version (survey_id, version) '
+            || 'SELECT DISTINCT survey_id, 1 FROM (' || TG_ARGV[0] || ') surveys WHERE survey_id IS NOT NULL '
+            || 'ON CONFLICT (survey_id) DO UPDATE SET version = sadco.survey_data_version.version + 1';
+    END IF;
+    RETURN NULL;
+END $$;
+
+DO $$
+DECLARE
+    table_name TEXT;
+    survey_query TEXT;
+    events TEXT[];
+BEGIN
+    FOR table_name, survey_query IN VALUES
+        ('inventory', 'SELECT survey_id FROM changed_rows'),
+        ('inv_stats', 'SELECT survey_id FROM changed_rows'),
+        ('survey', 'SELECT survey_id FROM changed_rows'),
+        ('station', 'SELECT survey_id FROM changed_rows'),
+        ('watphy', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.station ON station.station_id = changed_rows.station_id'),
+        ('sedphy', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.station ON station.station_id = changed_rows.station_id'),
+        ('currents', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.station ON station.station_id = changed_rows.station_id'),
+        ('weather', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.station ON station.station_id = changed_rows.station_id'),
+        ('watnut', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.watphy ON watphy.code = changed_rows.watphy_code '
+            'JOIN sadco.station ON station.station_id = watphy.station_id'),
+        ('watchem1', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.watphy ON watphy.code = changed_rows.watphy_code '
+            'JOIN sadco.station ON station.station_id = watphy.station_id'),
+        ('watchem2', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.watphy ON watphy.code = changed_rows.watphy_code '
+            'JOIN sadco.station ON station.station_id = watphy.station_id'),
+        ('watpol1', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.watphy ON watphy.code = changed_rows.watphy_code '
+            'JOIN sadco.station ON station.station_id = watphy.station_id'),
+        ('watpol2', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.watphy ON watphy.code = changed_rows.watphy_code '
+            'JOIN sadco.station ON station.station_id = watphy.station_id'),
+        ('watchl', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.watphy ON watphy.code = changed_rows.watphy_code '
+            'JOIN sadco.station ON station.station_id = watphy.station_id'),
+        ('watcurrents', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.watphy ON watphy.code = changed_rows.watphy_code '
+            'JOIN sadco.station ON station.station_id = watphy.station_id'),
+        ('watqc', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.watphy ON watphy.code = changed_rows.watphy_code '
+            'JOIN sadco.station ON station.station_id = watphy.station_id'),
+        ('sedchem1', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.sedphy ON sedphy.code = changed_rows.sedphy_code '
+            'JOIN sadco.station ON station.station_id = sedphy.station_id'),
+        ('sedchem2', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.sedphy ON sedphy.code = changed_rows.sedphy_code '
+            'JOIN sadco.station ON station.station_id = sedphy.station_id'),
+        ('sedpol1', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.sedphy ON sedphy.code = changed_rows.sedphy_code '
+            'JOIN sadco.station ON station.station_id = sedphy.station_id'),
+        ('sedpol2', 'SELECT station.survey_id FROM changed_rows '
+            'JOIN sadco.sedphy ON sedphy.code = changed_rows.sedphy_code '
+            'JOIN sadco.station ON station.station_id = sedphy.station_id'),
+        ('cur_mooring', 'SELECT survey_id FROM changed_rows'),
+        ('cur_depth', 'SELECT cur_mooring.survey_id FROM changed_rows '
+            'JOIN sadco.cur_mooring ON cur_mooring.code = changed_rows.mooring_code'),
+        ('cur_data', 'SELECT cur_mooring.survey_id FROM changed_rows '
+            'JOIN sadco.cur_depth ON cur_depth.code = changed_rows.depth_code '
+            'JOIN sadco.cur_mooring ON cur_mooring.code = cur_depth.mooring_code'),
+        ('cur_watphy', 'SELECT cur_mooring.survey_id FROM changed_rows '
+            'JOIN sadco.cur_depth ON cur_depth.code = changed_rows.depth_code '
+            'JOIN sadco.cur_mooring ON cur_mooring.code = cur_depth.mooring_code'),
+        ('wet_station', 'SELECT survey_id FROM changed_rows'),
+        ('wet_period', 'SELECT wet_station.survey_id FROM changed_rows '
+            'JOIN sadco.wet_station ON wet_station.station_id = changed_rows.station_id'),
+        ('wet_period_counts', 'SELECT wet_station.survey_id FROM changed_rows '
+            'JOIN sadco.wet_station ON wet_station.station_id = changed_rows.station_id'),
+        ('wet_data', 'SELECT wet_station.survey_id FROM changed_rows '
+            'JOIN sadco.wet_station ON wet_station.station_id = changed_rows.station_id'),
+        ('wav_station', 'SELECT survey_id FROM changed_rows'),
+        ('wav_period', 'SELECT wav_station.survey_id FROM changed_rows '
+            'JOIN sadco.wav_station ON wav_station.station_id = changed_rows.station_id'),
+        ('wav_data', 'SELECT wav_station.survey_id FROM changed_rows '
+            'JOIN sadco.wav_station ON wav_station.station_id = changed_rows.station_id')
+    LOOP
+        IF to_regclass('sadco.' || quote_ident(table_name)) IS NULL THEN
+            CONTINUE;
+        END IF;
+
+        -- Transition tables can only be declared for a trigger of a single event, and a row that is updated is
+        -- counted in the versions of its survey both before and after the update
+        FOREACH events SLICE 1 IN ARRAY ARRAY[
+            ['insert', 'INSERT', 'NEW'], ['delete', 'DELETE', 'OLD'], ['update_old', 'UPDATE', 'OLD'],
+            ['update_new', 'UPDATE', 'NEW']
+        ] LOOP
+            EXECUTE 'DROP TRIGGER IF EXISTS survey_data_version_' || events[1] || '_trigger ON sadco.'
+                || quote_ident(table_name);
+            EXECUTE 'CREATE TRIGGER survey_data_version_' || events[1] || '_trigger AFTER ' || events[2]
+                || ' ON sadco.' || quote_ident(table_name) || ' REFERENCING ' || events[3]
+                || ' TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION sadco.bump_survey_data_version('
+                || quote_literal(survey_query) || ')';
+        END LOOP;
+
+        EXECUTE 'DROP TRIGGER IF EXISTS survey_data_version_truncate_trigger ON sadco.' || quote_ident(table_name);
+        EXECUTE 'CREATE TRIGGER survey_data_version_truncate_trigger AFTER TRUNCATE ON sadco.'
+            || quote_ident(table_name) || ' FOR EACH STATEMENT EXECUTE FUNCTION sadco.bump_survey_data_version()';
+    END LOOP;
+END $$;
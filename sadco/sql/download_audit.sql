@@ -6,5 +6,7 @@ CREATE TABLE sadco.download_audit (
     parameters VARCHAR,
     download_file_size NUMERIC,
     download_file_checksum VARCHAR,
+    row_count BIGINT,
+    download_seconds NUMERIC,
     PRIMARY KEY (timestamp, client_id)
 );
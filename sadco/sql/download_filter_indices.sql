@@ -0,0 +1,4 @@
+CREATE INDEX cur_data_depth_code_datetime_idx ON sadco.cur_data (depth_code, datetime);
+CREATE INDEX wav_data_station_id_date_time_idx ON sadco.wav_data (station_id, date_time);
+CREATE INDEX watphy_station_id_spldep_idx ON sadco.watphy (station_id, spldep);
+CREATE INDEX sedphy_station_id_spldep_idx ON sadco.sedphy (station_id, spldep);
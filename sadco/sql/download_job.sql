@@ -0,0 +1,25 @@
+CREATE TABLE sadco.download_job (
+    id VARCHAR NOT NULL,
+    client_id VARCHAR NOT NULL,
+    user_id VARCHAR,
+    survey_type VARCHAR,
+    parameters VARCHAR,
+    download_format VARCHAR NOT NULL,
+    file_name VARCHAR NOT NULL,
+    status VARCHAR NOT NULL,
+    error VARCHAR,
+    row_count BIGINT,
+    rows_processed BIGINT NOT NULL DEFAULT 0,
+    created TIMESTAMP NOT NULL,
+    started TIMESTAMP,
+    completed TIMESTAMP,
+    worker_id VARCHAR,
+    heartbeat TIMESTAMP,
+    download_file_size NUMERIC,
+    download_file_checksum VARCHAR,
+    PRIMARY KEY (id)
+);
+
+CREATE INDEX download_job_client_user_idx ON sadco.download_job (client_id, user_id);
+
+CREATE INDEX download_job_status_idx ON sadco.download_job (status);
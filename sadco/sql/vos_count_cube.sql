@@ -0,0 +1,13 @@
+CREATE TABLE sadco.vos_count_cube (
+    latitude_cell INTEGER NOT NULL,
+    longitude_cell INTEGER NOT NULL,
+    day DATE NOT NULL,
+    record_count BIGINT NOT NULL,
+    midnight_count BIGINT NOT NULL,
+    PRIMARY KEY (latitude_cell, longitude_cell, day)
+);
+
+CREATE TABLE sadco.vos_count_cube_refresh (
+    refreshed TIMESTAMP NOT NULL,
+    PRIMARY KEY (refreshed)
+);
@@ -0,0 +1,60 @@
+-- Records the days of the VOS records that each statement changes, from which the VOS count cube is brought up to
+-- date by counting the records of those days again. The days are recorded by triggers in the transaction of the
+-- change, with the id of the transaction, so that a day that changes again while it is being counted stays recorded.
+-- A truncated table may have held records of any day, so the cube is then marked as needing to be rebuilt.
+--
+-- This is run after vos_count_cube.sql, and before vos_partitioned.sql, which adds the triggers to sadco.vos by
+-- calling sadco.create_vos_count_cube_triggers().
+
+CREATE TABLE IF NOT EXISTS sadco.vos_count_cube_change (
+    day DATE NOT NULL,
+    version BIGINT NOT NULL,
+    PRIMARY KEY (day)
+);
+
+CREATE OR REPLACE FUNCTION sadco.record_vos_count_cube_change() RETURNS TRIGGER
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'TRUNCATE' THEN
+        DELETE FROM sadco.vos_count_cube_refresh;
+    ELSE
+        INSERT INTO sadco.vos_count_cube_change (day, version)
+        SELECT DISTINCT date_time::DATE, txid_current() FROM changed_rows
+        ON CONFLICT (day) DO UPDATE SET version = excluded.version;
+    END IF;
+    RETURN NULL;
+END $$;
+
+-- The triggers are added to whichever of the VOS tables and sadco.vos are tables; the VOS tables are views of
+-- sadco.vos once that has been migrated to, and changes through them fire the triggers of sadco.vos
+CREATE OR REPLACE FUNCTION sadco.create_vos_count_cube_triggers() RETURNS VOID
+LANGUAGE plpgsql AS $$
+DECLARE
+    table_name TEXT;
+    events TEXT[];
+BEGIN
+    FOR table_name IN
+        SELECT relname FROM pg_class
+        WHERE relnamespace = 'sadco'::regnamespace AND relkind IN ('r', 'p')
+          AND relname IN ('vos', 'vos_main', 'vos_main2', 'vos_main68', 'vos_arch', 'vos_arch2')
+    LOOP
+        -- Transition tables can only be declared for a trigger of a single event, and a record that is updated may
+        -- move from one day to another
+        FOREACH events SLICE 1 IN ARRAY ARRAY[
+            ['insert', 'INSERT', 'NEW'], ['delete', 'DELETE', 'OLD'], ['update_old', 'UPDATE', 'OLD'],
+            ['update_new', 'UPDATE', 'NEW']
+        ] LOOP
+            EXECUTE 'DROP TRIGGER IF EXISTS vos_count_cube_' || events[1] || '_trigger ON sadco.'
+                || quote_ident(table_name);
+            EXECUTE 'CREATE TRIGGER vos_count_cube_' || events[1] || '_trigger AFTER ' || events[2]
+                || ' ON sadco.' || quote_ident(table_name) || ' REFERENCING ' || events[3]
+                || ' TABLE AS changed_rows FOR EACH STATEMENT EXECUTE FUNCTION sadco.record_vos_count_cube_change()';
+        END LOOP;
+
+        EXECUTE 'DROP TRIGGER IF EXISTS vos_count_cube_truncate_trigger ON sadco.' || quote_ident(table_name);
+        EXECUTE 'CREATE TRIGGER vos_count_cube_truncate_trigger AFTER TRUNCATE ON sadco.'
+            || quote_ident(table_name) || ' FOR EACH STATEMENT EXECUTE FUNCTION sadco.record_vos_count_cube_change()';
+    END LOOP;
+END $$;
+
+SELECT sadco.create_vos_count_cube_triggers();
@@ -0,0 +1,138 @@
+-- Consolidates the five VOS tables into sadco.vos, which is partitioned by the year of date_time, with each record
+-- tagged with the table that it came from. The old tables are replaced by views of their records, through which
+-- they are queried and loaded as before; a query that filters on date_time only reads the partitions of the years
+-- concerned.
+--
+-- Records of a year that has no partition are stored in the default partition. A year's partition is added, before
+-- its records are loaded, with:
+--   CREATE TABLE sadco.vos_y2025 PARTITION OF sadco.vos FOR VALUES FROM ('2025-01-01') TO ('2026-01-01');
+--
+-- The privileges granted on each of the old tables are granted on its view, and those granted on all of them on
+-- sadco.vos, which the API queries directly.
+--
+-- This depends on the scripts that are run before it, in this order:
+--   vos_zorder_key.sql and vos_zorder.sql, which add the z-order key to the VOS tables
+--   data_version.sql, which creates sadco.bump_data_version()
+--   vos_count_cube.sql and vos_count_cube_change.sql, which create sadco.create_vos_count_cube_triggers()
+
+BEGIN;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT FROM pg_attribute
+        WHERE attrelid = 'sadco.vos_main'::regclass AND attname = 'zorder_key' AND NOT attisdropped
+    ) THEN
+        RAISE EXCEPTION 'vos_zorder.sql must be run before vos_partitioned.sql';
+    END IF;
+
+    IF to_regprocedure('sadco.bump_data_version()') IS NULL THEN
+        RAISE EXCEPTION 'data_version.sql must be run before vos_partitioned.sql';
+    END IF;
+
+    IF to_regprocedure('sadco.create_vos_count_cube_triggers()') IS NULL THEN
+        RAISE EXCEPTION 'vos_count_cube_change.sql must be run before vos_partitioned.sql';
+    END IF;
+END $$;
+
+-- The privileges on the old tables, which are dropped with them
+CREATE TEMPORARY TABLE vos_grants ON COMMIT DROP AS
+SELECT relname AS source, acl.grantee, acl.privilege_type
+FROM pg_class, aclexplode(relacl) acl
+WHERE relnamespace = 'sadco'::regnamespace
+  AND relname IN ('vos_main', 'vos_main2', 'vos_main68', 'vos_arch', 'vos_arch2')
+  AND acl.grantee <> relowner;
+
+CREATE TABLE sadco.vos (
+    source VARCHAR(10) NOT NULL,
+    LIKE sadco.vos_main INCLUDING GENERATED
+) PARTITION BY RANGE (date_time);
+
+-- The copies of a record from other sources are looked up by the leading columns of the key
+ALTER TABLE sadco.vos ADD PRIMARY KEY (latitude, longitude, date_time, callsign, source);
+
+CREATE INDEX vos_lat_lon_idx ON sadco.vos (latitude, longitude);
+
+CREATE INDEX vos_zorder_key_idx ON sadco.vos (zorder_key);
+
+CREATE TABLE sadco.vos_default PARTITION OF sadco.vos DEFAULT;
+
+-- The version of sadco.vos's data is bumped by the function created by data_version.sql, as the old tables' were
+CREATE TRIGGER data_version_trigger AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON sadco.vos
+FOR EACH STATEMENT EXECUTE FUNCTION sadco.bump_data_version();
+
+DO $$
+DECLARE
+    year INTEGER;
+BEGIN
+    FOR year IN
+        SELECT DISTINCT extract(YEAR FROM date_time)::INTEGER FROM (
+            SELECT date_time FROM sadco.vos_main
+            UNION ALL SELECT date_time FROM sadco.vos_main2
+            UNION ALL SELECT date_time FROM sadco.vos_main68
+            UNION ALL SELECT date_time FROM sadco.vos_arch
+            UNION ALL SELECT date_time FROM sadco.vos_arch2
+        ) records
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE sadco.vos_y%s PARTITION OF sadco.vos FOR VALUES FROM (%L) TO (%L)',
+            year, make_date(year, 1, 1), make_date(year + 1, 1, 1)
+        );
+    END LOOP;
+END $$;
+
+DO $$
+DECLARE
+    columns TEXT;
+    stored_columns TEXT;
+    source TEXT;
+BEGIN
+    SELECT string_agg(quote_ident(attname), ', ' ORDER BY attnum),
+           string_agg(quote_ident(attname), ', ' ORDER BY attnum) FILTER (WHERE attgenerated = '')
+    INTO columns, stored_columns
+    FROM pg_attribute
+    WHERE attrelid = 'sadco.vos_main'::regclass AND attnum > 0 AND NOT attisdropped;
+
+    FOREACH source IN ARRAY ARRAY['vos_main', 'vos_main2', 'vos_main68', 'vos_arch', 'vos_arch2'] LOOP
+        EXECUTE format(
+            'INSERT INTO sadco.vos (source, %s) SELECT %L, %s FROM sadco.%I',
+            stored_columns, source, stored_columns, source
+        );
+        EXECUTE format('DROP TABLE sadco.%I', source);
+        -- The source is set by default on records that are loaded through the view
+        EXECUTE format(
+            'CREATE VIEW sadco.%I AS SELECT source, %s FROM sadco.vos WHERE source = %L WITH CHECK OPTION',
+            source, columns, source
+        );
+        EXECUTE format('ALTER VIEW sadco.%I ALTER COLUMN source SET DEFAULT %L', source, source);
+    END LOOP;
+END $$;
+
+-- The days of the records that change are recorded for the count cube by the triggers created by
+-- vos_count_cube_change.sql, as they were for the old tables; they are added once the records have been copied
+SELECT sadco.create_vos_count_cube_triggers();
+
+DO $$
+DECLARE
+    relation_name TEXT;
+    role_name TEXT;
+    privilege TEXT;
+BEGIN
+    FOR relation_name, role_name, privilege IN
+        WITH grants AS (
+            SELECT source, privilege_type,
+                   CASE grantee WHEN 0 THEN 'PUBLIC' ELSE quote_ident(pg_get_userbyid(grantee)) END AS role_name
+            FROM vos_grants
+        )
+        SELECT source, grants.role_name, privilege_type FROM grants
+        UNION
+        SELECT 'vos', grants.role_name, privilege_type FROM grants
+        GROUP BY grants.role_name, privilege_type HAVING count(DISTINCT source) = 5
+    LOOP
+        EXECUTE format('GRANT %s ON sadco.%I TO %s', privilege, relation_name, role_name);
+    END LOOP;
+END $$;
+
+ANALYZE sadco.vos;
+
+COMMIT;
@@ -0,0 +1,23 @@
+-- Adds a z-order key to the VOS tables, which interleaves the bits of the cells of each record's latitude,
+-- longitude and day, so that records that are close in space and time have close keys. A bounding box and date
+-- range are searched as a few ranges of keys on the key's index (see sadco.api.lib.zorder), instead of every
+-- record in the box's latitude band.
+
+-- The key is computed by the functions created by vos_zorder_key.sql, which is run first.
+
+ALTER TABLE sadco.vos_main ADD COLUMN zorder_key BIGINT
+    GENERATED ALWAYS AS (sadco.vos_zorder_key(latitude, longitude, date_time)) STORED;
+ALTER TABLE sadco.vos_main2 ADD COLUMN zorder_key BIGINT
+    GENERATED ALWAYS AS (sadco.vos_zorder_key(latitude, longitude, date_time)) STORED;
+ALTER TABLE sadco.vos_main68 ADD COLUMN zorder_key BIGINT
+    GENERATED ALWAYS AS (sadco.vos_zorder_key(latitude, longitude, date_time)) STORED;
+ALTER TABLE sadco.vos_arch ADD COLUMN zorder_key BIGINT
+    GENERATED ALWAYS AS (sadco.vos_zorder_key(latitude, longitude, date_time)) STORED;
+ALTER TABLE sadco.vos_arch2 ADD COLUMN zorder_key BIGINT
+    GENERATED ALWAYS AS (sadco.vos_zorder_key(latitude, longitude, date_time)) STORED;
+
+CREATE INDEX vos_main_zorder_key_idx ON sadco.vos_main (zorder_key);
+CREATE INDEX vos_main2_zorder_key_idx ON sadco.vos_main2 (zorder_key);
+CREATE INDEX vos_main68_zorder_key_idx ON sadco.vos_main68 (zorder_key);
+CREATE INDEX vos_arch_zorder_key_idx ON sadco.vos_arch (zorder_key);
+CREATE INDEX vos_arch2_zorder_key_idx ON sadco.vos_arch2 (zorder_key);
@@ -0,0 +1,23 @@
+-- Functions that compute the z-order key of a VOS record, interleaving the bits of the cells of its latitude,
+-- longitude and day, as sadco.api.lib.zorder does. These are created with the VOS tables by sadco.db.models.vos;
+-- on an existing database, this is run before vos_zorder.sql.
+
+CREATE OR REPLACE FUNCTION sadco.zorder_spread(value BIGINT) RETURNS BIGINT
+LANGUAGE plpgsql IMMUTABLE PARALLEL SAFE AS $$
+BEGIN
+    value := value & 2097151;
+    value := (value | (value << 32)) & 8725724278095871;
+    value := (value | (value << 16)) & 8725728556220671;
+    value := (value | (value << 8)) & 1157144660301377551;
+    value := (value | (value << 4)) & 1207822528635744451;
+    value := (value | (value << 2)) & 1317624576693539401;
+    RETURN value;
+END $$;
+
+CREATE OR REPLACE FUNCTION sadco.vos_zorder_key(latitude NUMERIC, longitude NUMERIC, date_time TIMESTAMP)
+RETURNS BIGINT
+LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$
+    SELECT (sadco.zorder_spread(least(greatest(floor((latitude + 90) / 180 * 2097152), 0), 2097151)::BIGINT) << 2)
+        | (sadco.zorder_spread(least(greatest(floor((longitude + 180) / 360 * 2097152), 0), 2097151)::BIGINT) << 1)
+        | sadco.zorder_spread(least(greatest(date_time::DATE - DATE '1800-01-01', 0), 2097151))
+$$;
@@ -1,4 +1,6 @@
 import sadco.api
+import sadco.api.lib.download_cache
+import sadco.api.lib.download_job
 from random import randint, choice
 from collections import namedtuple
 
@@ -64,6 +66,30 @@ def api(request, monkeypatch):
     return api_test_client
 
 
+@pytest.fixture(autouse=True)
+def download_cache(tmp_path, monkeypatch):
+    """An auto-use, per-test fixture that provides an empty download cache."""
+    cache_dir = tmp_path / 'downloads'
+    monkeypatch.setattr(sadco.api.lib.download_cache, 'DOWNLOAD_CACHE_DIR', str(cache_dir))
+    return cache_dir
+
+
+@pytest.fixture(autouse=True)
+def pregenerated_downloads(tmp_path, monkeypatch):
+    """An auto-use, per-test fixture that provides an empty directory for pre-rendered downloads."""
+    pregenerated_dir = tmp_path / 'pregenerated'
+    monkeypatch.setattr(sadco.api.lib.download_cache, 'PREGENERATED_DOWNLOAD_DIR', str(pregenerated_dir))
+    return pregenerated_dir
+
+
+@pytest.fixture(autouse=True)
+def download_job_dir(tmp_path, monkeypatch):
+    """An auto-use, per-test fixture that provides an empty directory for download job files."""
+    job_dir = tmp_path / 'jobs'
+    monkeypatch.setattr(sadco.api.lib.download_job, 'DOWNLOAD_JOB_DIR', str(job_dir))
+    return job_dir
+
+
 @pytest.fixture(params=[True, False])
 def planam(request):
     if request.param:
@@ -1,12 +1,36 @@
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
 import os
+import time
 import zipfile
-from datetime import date
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from itertools import product
 
+import netCDF4
+import numpy as np
 import pytest
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import zstandard
 import io
-
-from sadco.db.models import VosMain, VosMain2, VosMain68, VosArch, VosArch2, vos
+from sqlalchemy import delete, func, select, text, update
+
+import sadco.api.lib.download
+import sadco.api.lib.download_cache
+import sadco.api.lib.download_job
+import sadco.api.routers.vos_survey
+import sadco.db
+from sadco.api.routers.vos_survey import is_vos_count_cube_current, refresh_vos_count_cube, update_vos_count_cube
+from sadco.api.pregenerate_downloads import get_standard_downloads, pregenerate_download
+from sadco.api.routers.survey_download import (HYDRO_DATA_TYPE_RECORD_COUNTS, SurveyDownloadFilters,
+                                               get_waves_statement)
+from sadco.db.models import (VosMain, VosMain2, VosMain68, VosArch, VosArch2, DownloadAudit, DownloadJob, InvStats,
+                             SurveyType, VosCountCube, VosCountCubeChange, WavData, WavPeriod, vos)
 from test.factories import (SurveyFactory, StationFactory, WatphyFactory, Watchem1Factory, Watchem2Factory,
                             Watpol1Factory, Watpol2Factory, WatnutFactory, InventoryFactory, WatchlFactory,
                             CurrentsFactory, WeatherFactory,
@@ -15,7 +39,7 @@ from test.factories import (SurveyFactory, StationFactory, WatphyFactory, Watche
                             CurrentDepthFactory, EDMInstrument2Factory, CurrentDataFactory, CurrentWatphyFactory,
                             WetStationFactory, WetPeriodFactory, WetDataFactory, WavStationFactory, WavDataFactory)
 
-from sadco.const import SADCOScope
+from sadco.const import SADCOScope, DataType, SurveyType as ConstSurveyType
 from test.api import assert_forbidden
 from test import TestSession
 
@@ -746,6 +770,364 @@ def test_download_all_hydro_data_types(api, hydro_survey_download, scopes, hydro
         assert_download_result(r, f'hydro_{hydro_data_type}')
 
 
+def test_download_hydro_data_in_batches(api, hydro_survey_download, monkeypatch):
+    monkeypatch.setattr(sadco.api.lib.download, 'DOWNLOAD_BATCH_SIZE', 1)
+
+    route = '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        route,
+        params={
+            'data_type': 'water'
+        }
+    )
+
+    assert_download_result(r, 'hydro_water')
+
+
+def test_download_hydro_data_fast_csv(api, hydro_survey_download, hydro_data_type):
+    route = '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        route,
+        params={
+            'data_type': hydro_data_type,
+            'fast_csv': True
+        }
+    )
+
+    assert_download_result(r, f'hydro_{hydro_data_type}', normalize=True)
+
+
+def test_download_hydro_data_parquet(api, hydro_survey_download, hydro_data_type):
+    route = '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        route,
+        params={
+            'data_type': hydro_data_type,
+            'format': 'parquet'
+        }
+    )
+
+    assert r.status_code == 200
+
+    assert_parquet_result(r, f'hydro_{hydro_data_type}')
+
+
+@pytest.mark.parametrize('hydro_data_type', ['water', 'sediment', 'currents'])
+def test_download_hydro_data_netcdf(api, hydro_survey_download, hydro_data_type):
+    route = '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        route,
+        params={
+            'data_type': hydro_data_type,
+            'format': 'netcdf'
+        }
+    )
+
+    assert r.status_code == 200
+
+    compare_csv_data_frame = get_compare_data_frame(f'hydro_{hydro_data_type}')
+
+    with assert_netcdf_result(r, 'profile') as dataset:
+        assert dataset.dimensions['station'].size == compare_csv_data_frame['station_id'].nunique()
+        assert dataset['station_id'].dimensions == ('station',)
+        assert dataset['spldep'].dimensions == ('station', 'depth')
+        assert sorted(dataset['spldep'][:].compressed()) == sorted(compare_csv_data_frame['spldep'].dropna())
+        assert dataset['latitude'][:].tolist() == [-compare_csv_data_frame['latitude'][0]]
+
+
+def test_download_hydro_weather_data_netcdf(api, hydro_survey_download):
+    route = '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        route,
+        params={
+            'data_type': 'weather',
+            'format': 'netcdf'
+        }
+    )
+
+    assert r.status_code == 422
+
+
+@pytest.mark.parametrize('hydro_data_type', ['water', 'water_nutrients', 'water_chemistry'])
+def test_download_hydro_data_odv(api, hydro_survey_download, hydro_data_type):
+    route = '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(route, params={'data_type': hydro_data_type, 'format': 'odv'})
+
+    assert r.status_code == 200
+    assert r.headers['content-type'] == 'application/zip'
+    assert r.headers['content-disposition'].endswith('.odv.zip')
+
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zip_file:
+        lines = zip_file.read(zip_file.namelist()[0]).decode().splitlines()
+
+    compare_csv_data_frame = get_compare_data_frame(f'hydro_{hydro_data_type}')
+    labels = [line for line in lines if not line.startswith('//')][0].split('\t')
+    rows = [dict(zip(labels, line.split('\t'))) for line in lines if not line.startswith('//')][1:]
+
+    assert labels[:7] == ['Cruise', 'Station', 'Type', 'yyyy-mm-ddThh:mm:ss.sss', 'Longitude [degrees_east]',
+                          'Latitude [degrees_north]', 'station_name:METAVAR:TEXT:11']
+    assert 'Depth [m]' in labels
+    assert len(rows) == len(compare_csv_data_frame)
+
+    # The station's metadata is written on its first row only
+    assert rows[0]['Station'] == '22BG'
+    assert rows[0]['Type'] == 'B'
+    assert float(rows[0]['Latitude [degrees_north]']) == -compare_csv_data_frame['latitude'][0]
+    assert all(row['Station'] == '' and row['Cruise'] == '' for row in rows[1:])
+    assert [float(row['Depth [m]']) for row in rows] == sorted(compare_csv_data_frame['spldep'])
+
+
+@pytest.mark.parametrize('params', [
+    {'data_type': 'weather', 'format': 'odv'},
+    {'data_type': 'water', 'format': 'odv', 'columns': 'temperature'},
+])
+def test_download_hydro_data_odv_availability(api, hydro_survey_download, params):
+    route = '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(route, params=params)
+
+    if params['data_type'] == 'weather':
+        assert r.status_code == 422
+    else:
+        # The station's position and date are included whichever columns are selected
+        assert r.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(r.content)) as zip_file:
+            header = zip_file.read(zip_file.namelist()[0]).decode().splitlines()[2]
+        assert header.split('\t') == ['Cruise', 'Station', 'Type', 'yyyy-mm-ddThh:mm:ss.sss',
+                                      'Longitude [degrees_east]', 'Latitude [degrees_north]', 'Depth [m]', 'subdes',
+                                      'spldattim', 'temperature']
+
+
+def test_download_hydro_data_bundle(api, hydro_survey_download):
+    file_unique_name = hydro_survey_download.survey_id.replace('/', '-')
+    route = f'/survey/download/hydro/{file_unique_name}'
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(route, params={'data_type': 'all'})
+
+    assert r.status_code == 200
+    assert r.headers['content-disposition'] == f'attachment; filename=survey_{file_unique_name}_all.zip'
+
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zipped_file:
+        file_names = zipped_file.namelist()
+
+    assert file_names == [f'survey_{file_unique_name}_{data_type.value}.csv' for data_type in DataType]
+
+    for data_type in DataType:
+        downloaded_csv_data_frame = get_csv_from_zipped_file(
+            r.content, f'survey_{file_unique_name}_{data_type.value}.csv'
+        )
+        compare_csv_data_frame = get_compare_data_frame(f'hydro_{data_type.value}')
+
+        assert compare_csv_data_frame.compare(downloaded_csv_data_frame).empty
+
+
+@pytest.mark.parametrize('params', [{'format': 'parquet'}, {'compression': 'gzip'}])
+def test_download_hydro_data_bundle_format(api, hydro_survey_download, params):
+    route = '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(route, params={'data_type': 'all', **params})
+
+    assert r.status_code == 422
+
+
+@pytest.mark.parametrize('params', [{}, {'data_type': 'plankton'}])
+def test_download_hydro_data_invalid_data_type(api, hydro_survey_download, params):
+    route = '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(route, params=params)
+
+    assert r.status_code == 422
+    assert TestSession.execute(select(DownloadAudit)).first() is None
+
+
+def test_download_hydro_data_columns(api, hydro_survey_download):
+    file_unique_name = hydro_survey_download.survey_id.replace('/', '-')
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        f'/survey/download/hydro/{file_unique_name}',
+        params={
+            'data_type': 'water',
+            'columns': ['temperature,salinity', 'latitude']
+        }
+    )
+
+    assert r.status_code == 200
+
+    downloaded_csv_data_frame = get_csv_from_zipped_file(r.content, f'survey_{file_unique_name}.csv')
+    compare_csv_data_frame = get_compare_data_frame('hydro_water')[
+        ['latitude', 'station_id', 'subdes', 'spldattim', 'spldep', 'salinity', 'temperature']
+    ]
+
+    assert compare_csv_data_frame.compare(downloaded_csv_data_frame).empty
+
+
+def test_download_hydro_data_unknown_columns(api, hydro_survey_download):
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-')),
+        params={
+            'data_type': 'water',
+            'columns': 'temperature,no2'
+        }
+    )
+
+    assert r.status_code == 422
+    assert 'no2' in r.json()['detail']
+
+
+def test_download_hydro_data_repeated_samples(api, hydro_survey_download):
+    """Samples with the same values are distinct rows, since each has a code of its own."""
+    file_unique_name = hydro_survey_download.survey_id.replace('/', '-')
+    compare_csv_data_frame = get_compare_data_frame('hydro_water_nutrients')
+
+    for watphy in list(hydro_survey_download.stations[0].watphy_list):
+        if not (watnut := watphy.watnut):
+            continue
+
+        repeated_watphy = WatphyFactory.create(
+            watchem1=None, watchem2=None, watpol1=None, watpol2=None, watcurrents=None, watnut=None, watchl=None,
+            station=watphy.station, subdes=watphy.subdes, spldattim=watphy.spldattim, spldep=watphy.spldep,
+            filtered=watphy.filtered, disoxygen=watphy.disoxygen, salinity=watphy.salinity,
+            temperature=watphy.temperature, sound_flag=watphy.sound_flag, soundv=watphy.soundv,
+            turbidity=watphy.turbidity, pressure=watphy.pressure, fluorescence=watphy.fluorescence
+        )
+        WatnutFactory(
+            watphy=repeated_watphy, no2=watnut.no2, no3=watnut.no3, p=watnut.p, po4=watnut.po4, ptot=watnut.ptot,
+            sio3=watnut.sio3, sio4=watnut.sio4
+        )
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        f'/survey/download/hydro/{file_unique_name}',
+        params={'data_type': DataType.WATERNUTRIENTS.value}
+    )
+
+    assert r.status_code == 200
+
+    downloaded_csv_data_frame = get_csv_from_zipped_file(r.content, f'survey_{file_unique_name}.csv')
+
+    assert len(downloaded_csv_data_frame) == 2 * len(compare_csv_data_frame)
+    assert downloaded_csv_data_frame.drop_duplicates().reset_index(drop=True).compare(compare_csv_data_frame).empty
+
+
+def test_download_hydro_data_depth_range(api, hydro_survey_download):
+    file_unique_name = hydro_survey_download.survey_id.replace('/', '-')
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        f'/survey/download/hydro/{file_unique_name}',
+        params={
+            'data_type': 'water',
+            'min_depth': 0.6,
+            'max_depth': 1,
+        }
+    )
+
+    assert r.status_code == 200
+
+    downloaded_csv_data_frame = get_csv_from_zipped_file(r.content, f'survey_{file_unique_name}.csv')
+    compare_csv_data_frame = get_compare_data_frame('hydro_water')
+    compare_csv_data_frame = compare_csv_data_frame[compare_csv_data_frame['spldep'] >= 0.6].reset_index(drop=True)
+
+    assert len(compare_csv_data_frame) == 1
+    assert compare_csv_data_frame.compare(downloaded_csv_data_frame).empty
+
+
+@pytest.mark.parametrize('params', [
+    {'start': '2000-01-02T00:00:00', 'end': '2000-01-01T00:00:00'},
+    {'min_depth': 10, 'max_depth': 5},
+])
+def test_download_hydro_data_invalid_filters(api, hydro_survey_download, params):
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-')),
+        params={'data_type': 'water', **params}
+    )
+
+    assert r.status_code == 422
+
+
+@pytest.mark.parametrize('method, route', [
+    ('get', '/survey/download/hydro/{}'),
+    ('get', '/survey/download/hydro/{}/estimate'),
+    ('get', '/survey/download/hydro?survey_id={}'),
+    ('post', '/download_jobs/hydro/{}'),
+])
+def test_download_hydro_weather_depth_range(api, hydro_survey_download, method, route):
+    client = api([SADCOScope.HYDRO_DOWNLOAD])
+    route = route.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    # Weather is observed at the surface, so it is not silently left unfiltered by depth
+    r = getattr(client, method)(route, params={'data_type': DataType.WEATHER.value, 'min_depth': 300})
+
+    assert r.status_code == 422
+    assert r.json()['detail'] == 'The weather data type cannot be filtered by depth'
+
+
+def test_download_hydro_data_bundle_depth_range(api, hydro_survey_download):
+    file_unique_name = hydro_survey_download.survey_id.replace('/', '-')
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        f'/survey/download/hydro/{file_unique_name}', params={'data_type': 'all', 'min_depth': 0.6}
+    )
+
+    # The weather of a download of all data types is not filtered by depth
+    assert r.status_code == 200
+    downloaded_csv_data_frame = get_csv_from_zipped_file(r.content, f'survey_{file_unique_name}_weather.csv')
+    assert get_compare_data_frame('hydro_weather').compare(downloaded_csv_data_frame).empty
+
+
+def test_download_hydro_data_batch(api, hydro_survey_download):
+    file_unique_name = hydro_survey_download.survey_id.replace('/', '-')
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        '/survey/download/hydro',
+        params={
+            'survey_id': [file_unique_name, '1999-0002'],
+            'data_type': DataType.WATER.value
+        }
+    )
+
+    assert r.status_code == 200
+    assert r.headers['content-disposition'] == 'attachment; filename=survey_batch_water.zip'
+
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zipped_file:
+        assert zipped_file.namelist() == [f'survey_{file_unique_name}.csv']
+
+    downloaded_csv_data_frame = get_csv_from_zipped_file(r.content, f'survey_{file_unique_name}.csv')
+    assert get_compare_data_frame('hydro_water').compare(downloaded_csv_data_frame).empty
+
+    audit = TestSession.execute(select(DownloadAudit)).scalar_one()
+    assert audit.download_file_size == len(r.content)
+    assert json.loads(audit.parameters)['survey_ids'] == [file_unique_name, '1999-0002']
+
+
+@pytest.mark.parametrize('params, status_code', [
+    ({'survey_id': ['1999-0002', '1999-0003'], 'data_type': 'water'}, 404),
+    ({'survey_id': ['1999-0001'], 'data_type': 'all'}, 422),
+    ({'survey_id': [f'1999-{index:04}' for index in range(101)], 'data_type': 'water'}, 422),
+])
+def test_download_hydro_data_batch_invalid(api, params, status_code):
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get('/survey/download/hydro', params=params)
+
+    assert r.status_code == status_code
+
+
+@pytest.mark.parametrize('data_type, fast_csv', [('water', True), ('water', False), ('all', False)])
+def test_download_hydro_data_not_found(api, data_type, fast_csv):
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        '/survey/download/hydro/1999-0002',
+        params={
+            'data_type': data_type,
+            'fast_csv': fast_csv
+        }
+    )
+
+    assert r.status_code == 404
+
+
 @pytest.mark.require_scope(SADCOScope.UTR_DOWNLOAD)
 def test_download_utr_data(api, currents_survey_download, scopes):
     authorized = SADCOScope.UTR_DOWNLOAD in scopes
@@ -784,6 +1166,72 @@ def test_download_currents_data(api, currents_survey_download, scopes):
         assert_download_result(r, 'currents')
 
 
+def test_get_row_batches_unique(vos_data):
+    TestSession.add(VosMain(latitude=36, longitude=-10, date_time=datetime(1998, 1, 1), callsign='AD35', load_id=9934))
+    TestSession.commit()
+
+    # Duplicate rows are removed by the database, rather than remembered while the rows are streamed
+    statement = select(VosMain.callsign, VosMain.load_id)
+    rows = [row for rows in sadco.api.lib.download.get_row_batches(statement, unique=True) for row in rows]
+
+    assert [tuple(row) for row in rows] == [('AD35', 9934)]
+    assert len([row for rows in sadco.api.lib.download.get_row_batches(statement) for row in rows]) == 2
+
+
+def test_download_currents_data_time_window(api, currents_survey_download):
+    route = '/survey/download/currents/{}'.format(currents_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.CURRENTS_DOWNLOAD]).get(
+        route,
+        params={
+            'start': '1999-01-02T00:00:00',
+            'end': '1999-01-02T23:59:59',
+        }
+    )
+
+    assert r.status_code == 200
+
+    downloaded_csv_data_frame = get_csv_from_zipped_file(r.content, 'survey_{}.csv'.format(
+        currents_survey_download.survey_id.replace('/', '-')
+    ))
+    compare_csv_data_frame = get_compare_data_frame('currents')
+    compare_csv_data_frame = compare_csv_data_frame[
+        compare_csv_data_frame['datetime'] == '1999-01-02'
+    ].reset_index(drop=True)
+
+    assert len(compare_csv_data_frame) == 1
+    assert compare_csv_data_frame.compare(downloaded_csv_data_frame).empty
+
+
+def test_download_currents_data_netcdf(api, currents_survey_download):
+    route = '/survey/download/currents/{}'.format(currents_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.CURRENTS_DOWNLOAD]).get(
+        route,
+        params={
+            'format': 'netcdf'
+        }
+    )
+
+    assert r.status_code == 200
+
+    compare_csv_data_frame = get_compare_data_frame('currents')
+
+    with assert_netcdf_result(r, 'timeSeries') as dataset:
+        assert dataset.dimensions['depth'].size == 1
+        assert dataset.dimensions['time'].size == len(compare_csv_data_frame)
+        assert dataset['sampling_depth'][:].tolist() == compare_csv_data_frame['sampling_depth'][:1].tolist()
+        assert dataset['instrument'][:].tolist() == compare_csv_data_frame['instrument'][:1].tolist()
+
+        times = netCDF4.num2date(dataset['datetime'][0, :], dataset['datetime'].units)
+        assert [time.strftime('%Y-%m-%d') for time in times] == compare_csv_data_frame['datetime'].tolist()
+
+        np.testing.assert_array_equal(
+            dataset['speed'][0, :].filled(np.nan),
+            compare_csv_data_frame['speed'].to_numpy()
+        )
+
+
 @pytest.mark.require_scope(SADCOScope.WEATHER_DOWNLOAD)
 def test_download_weather_data(api, weather_survey_download, scopes):
     authorized = SADCOScope.WEATHER_DOWNLOAD in scopes
@@ -803,6 +1251,23 @@ def test_download_weather_data(api, weather_survey_download, scopes):
         assert_download_result(r, 'weather')
 
 
+def test_download_weather_data_time_window(api, weather_survey_download):
+    r = api([SADCOScope.WEATHER_DOWNLOAD]).get(
+        '/survey/download/weather/{}'.format(weather_survey_download.survey_id.replace('/', '-')),
+        params={
+            'end': '1995-01-01T00:00:00',
+        }
+    )
+
+    assert r.status_code == 200
+
+    downloaded_csv_data_frame = get_csv_from_zipped_file(r.content, 'survey_{}.csv'.format(
+        weather_survey_download.survey_id.replace('/', '-')
+    ))
+
+    assert downloaded_csv_data_frame['record_date'].tolist() == ['1991-01-01']
+
+
 @pytest.mark.require_scope(SADCOScope.WAVES_DOWNLOAD)
 def test_download_waves_data(api, waves_survey_download, scopes):
     authorized = SADCOScope.WAVES_DOWNLOAD in scopes
@@ -822,6 +1287,293 @@ def test_download_waves_data(api, waves_survey_download, scopes):
         assert_download_result(r, 'waves')
 
 
+@pytest.mark.parametrize('compression, compression_level, file_name', [
+    ('store', None, 'survey_1999-0001_None.zip'),
+    ('deflate', 9, 'survey_1999-0001_None.zip'),
+    ('gzip', 1, 'survey_1999-0001_None.csv.gz'),
+    ('zstd', 19, 'survey_1999-0001_None.csv.zst'),
+])
+def test_download_waves_data_compression(api, waves_survey_download, compression, compression_level, file_name):
+    r = api([SADCOScope.WAVES_DOWNLOAD]).get(
+        '/survey/download/waves/{}'.format(waves_survey_download.survey_id.replace('/', '-')),
+        params={'compression': compression} | ({'compression_level': compression_level} if compression_level else {})
+    )
+
+    assert r.status_code == 200
+    assert r.headers['content-disposition'] == f'attachment; filename={file_name}'
+
+    match compression:
+        case 'gzip':
+            downloaded_csv_data_frame = pd.read_csv(io.BytesIO(gzip.decompress(r.content)))
+        case 'zstd':
+            downloaded_csv_data_frame = pd.read_csv(zstandard.ZstdDecompressor().stream_reader(r.content))
+        case _:
+            downloaded_csv_data_frame = get_csv_from_zipped_file(r.content, 'survey_1999-0001.csv')
+
+    assert get_compare_data_frame('waves').compare(downloaded_csv_data_frame).empty
+
+
+@pytest.mark.parametrize('params', [
+    {'compression': 'gzip', 'compression_level': 10},
+    {'compression': 'zstd', 'compression_level': 0},
+    {'compression': 'store', 'compression_level': 6},
+    {'compression': 'lzma'},
+])
+def test_download_waves_data_invalid_compression(api, waves_survey_download, params):
+    r = api([SADCOScope.WAVES_DOWNLOAD]).get(
+        '/survey/download/waves/{}'.format(waves_survey_download.survey_id.replace('/', '-')),
+        params=params
+    )
+
+    assert r.status_code == 422
+
+
+def test_download_audit_file_info(api, waves_survey_download):
+    route = '/survey/download/waves/{}'.format(waves_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.WAVES_DOWNLOAD]).get(route)
+
+    assert r.status_code == 200
+
+    download_audit = TestSession.execute(select(DownloadAudit)).scalar_one()
+
+    assert download_audit.download_file_size == len(r.content)
+    assert download_audit.download_file_checksum == hashlib.md5(r.content).hexdigest()
+    assert download_audit.row_count == len(get_csv_from_zipped_file(r.content, 'survey_1999-0001.csv'))
+    assert download_audit.download_seconds >= 0
+
+
+def test_download_cache_hit(api, waves_survey_download, download_cache, monkeypatch):
+    monkeypatch.setattr(sadco.api.lib.download_cache, 'get_data_version', lambda statement, survey_id=None: 1)
+    route = '/survey/download/waves/{}'.format(waves_survey_download.survey_id.replace('/', '-'))
+
+    r_1 = api([SADCOScope.WAVES_DOWNLOAD]).get(route)
+    r_2 = api([SADCOScope.WAVES_DOWNLOAD]).get(route)
+
+    assert r_1.status_code == r_2.status_code == 200
+    assert 'content-length' not in r_1.headers
+    assert r_2.headers['content-length'] == str(len(r_1.content))
+    assert r_2.content == r_1.content
+    assert len([path for path in download_cache.iterdir() if not path.suffix]) == 1
+
+    audits = TestSession.execute(select(DownloadAudit).order_by(DownloadAudit.timestamp)).scalars().all()
+    assert len(audits) == 2
+    for audit in audits:
+        assert audit.download_file_size == len(r_1.content)
+        assert audit.download_file_checksum == hashlib.md5(r_1.content).hexdigest()
+
+    # Only the download whose file was produced for it is timed
+    assert audits[0].row_count > 0
+    assert audits[1].row_count is None and audits[1].download_seconds is None
+
+
+def test_download_head(api, waves_survey_download, download_cache, monkeypatch):
+    monkeypatch.setattr(sadco.api.lib.download_cache, 'get_data_version', lambda statement, survey_id=None: 1)
+    route = '/survey/download/waves/{}'.format(waves_survey_download.survey_id.replace('/', '-'))
+    client = api([SADCOScope.WAVES_DOWNLOAD])
+
+    get_file_chunks = sadco.api.lib.download.get_file_chunks
+
+    # A file that is not cached is not produced for a HEAD request, which is answered without its size
+    monkeypatch.setattr(sadco.api.lib.download, 'get_file_chunks', None)
+    r_head = client.head(route)
+
+    assert r_head.status_code == 200
+    assert r_head.content == b''
+    assert 'content-length' not in r_head.headers
+    assert r_head.headers['content-disposition'] == 'attachment; filename=survey_1999-0001_None.zip'
+    assert not download_cache.exists()
+
+    monkeypatch.setattr(sadco.api.lib.download, 'get_file_chunks', get_file_chunks)
+    r_get = client.get(route)
+
+    assert r_get.status_code == 200
+    assert TestSession.execute(select(DownloadAudit)).scalar_one().download_file_size == len(r_get.content)
+
+    # Once the file is cached, a HEAD request is answered with its size and checksum, and is not audited
+    monkeypatch.setattr(sadco.api.lib.download, 'get_file_chunks', None)
+    r_head = client.head(route)
+
+    assert r_head.status_code == 200
+    assert r_head.content == b''
+    assert r_head.headers['content-length'] == str(len(r_get.content))
+    assert r_head.headers['content-md5'] == base64.b64encode(hashlib.md5(r_get.content).digest()).decode()
+    assert len(TestSession.execute(select(DownloadAudit)).scalars().all()) == 1
+
+
+def test_download_head_hydro_data_bundle(api, hydro_survey_download):
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).head(
+        '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-')),
+        params={'data_type': 'all'}
+    )
+
+    assert r.status_code == 405
+
+
+def test_download_range(api, waves_survey_download, monkeypatch):
+    monkeypatch.setattr(sadco.api.lib.download_cache, 'get_data_version', lambda statement, survey_id=None: 1)
+    route = '/survey/download/waves/{}'.format(waves_survey_download.survey_id.replace('/', '-'))
+    client = api([SADCOScope.WAVES_DOWNLOAD])
+
+    r_full = client.get(route)
+    r_cached = client.get(route)
+    etag = r_cached.headers['etag']
+
+    assert r_cached.content == r_full.content
+    assert r_cached.headers['accept-ranges'] == 'bytes'
+
+    r_range = client.get(route, headers={'Range': 'bytes=10-', 'If-Range': etag})
+
+    assert r_range.status_code == 206
+    assert r_range.content == r_full.content[10:]
+    assert r_range.headers['content-range'] == f'bytes 10-{len(r_full.content) - 1}/{len(r_full.content)}'
+
+    r_suffix = client.get(route, headers={'Range': 'bytes=-5'})
+
+    assert r_suffix.status_code == 206
+    assert r_suffix.content == r_full.content[-5:]
+
+    r_changed = client.get(route, headers={'Range': 'bytes=10-', 'If-Range': '"changed"'})
+
+    assert r_changed.status_code == 200
+    assert r_changed.content == r_full.content
+
+    r_unsatisfiable = client.get(route, headers={'Range': f'bytes={len(r_full.content)}-'})
+
+    assert r_unsatisfiable.status_code == 416
+    assert r_unsatisfiable.headers['content-range'] == f'bytes */{len(r_full.content)}'
+
+    # The resumed requests are part of the downloads that they resume, so are not audited again
+    assert len(TestSession.execute(select(DownloadAudit)).scalars().all()) == 3
+
+
+def test_download_cache_data_version(api, waves_survey_download, download_cache, monkeypatch):
+    route = '/survey/download/waves/{}'.format(waves_survey_download.survey_id.replace('/', '-'))
+
+    monkeypatch.setattr(sadco.api.lib.download_cache, 'get_data_version', lambda statement, survey_id=None: 1)
+    r_1 = api([SADCOScope.WAVES_DOWNLOAD]).get(route)
+
+    monkeypatch.setattr(sadco.api.lib.download_cache, 'get_data_version', lambda statement, survey_id=None: 2)
+    r_2 = api([SADCOScope.WAVES_DOWNLOAD]).get(route)
+
+    assert r_1.status_code == r_2.status_code == 200
+    assert 'content-length' not in r_2.headers
+    assert len([path for path in download_cache.iterdir() if not path.suffix]) == 2
+
+
+def test_data_version(waves_survey_download):
+    sadco.api.lib.download_cache.get_versioned_tables.cache_clear()
+    statement = select(WavData.station_id)
+    version = sadco.api.lib.download_cache.get_data_version(statement)
+    period_version = sadco.api.lib.download_cache.get_data_version(select(WavPeriod.station_id))
+
+    TestSession.execute(update(WavData).values(number_readings=WavData.number_readings + 1))
+    TestSession.commit()
+
+    changed_version = sadco.api.lib.download_cache.get_data_version(statement)
+    assert changed_version > version
+
+    # The version is kept by the data's own triggers, not the database's statistics
+    TestSession.execute(text('SELECT pg_stat_reset()'))
+    TestSession.commit()
+
+    assert sadco.api.lib.download_cache.get_data_version(statement) == changed_version
+    assert sadco.api.lib.download_cache.get_data_version(select(WavPeriod.station_id)) == period_version
+
+    # The tables that store the data are looked up in the catalog once for each statement's set of tables
+    assert sadco.api.lib.download_cache.get_versioned_tables.cache_info().misses == 2
+
+
+def test_survey_data_version(waves_survey_download):
+    stmt = get_waves_statement(TEST_SURVEY_ID.replace('/', '-'), SurveyDownloadFilters())
+    get_data_version = sadco.api.lib.download_cache.get_data_version
+    survey_version = get_data_version(stmt, TEST_SURVEY_ID)
+    table_version = get_data_version(stmt)
+
+    # A change to the data of another survey changes the version of the tables, but not of the survey
+    inventory = InventoryFactory.create(survey_id='1999/0002', survey=None, cur_moorings=None, wet_stations=None,
+                                        wav_stations=None)
+    WavStationFactory.create(survey_id=inventory.survey_id, inventory=inventory, wav_data_list=None)
+
+    assert get_data_version(stmt, TEST_SURVEY_ID) == survey_version
+    assert get_data_version(stmt) > table_version
+
+    TestSession.execute(
+        update(WavData).where(WavData.station_id == waves_survey_download.station_id)
+        .values(number_readings=WavData.number_readings + 1)
+    )
+    TestSession.commit()
+
+    assert get_data_version(stmt, TEST_SURVEY_ID) > survey_version
+
+
+def test_download_cache_eviction(api, hydro_survey_download, download_cache, monkeypatch):
+    route = '/survey/download/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r_1 = api([SADCOScope.HYDRO_DOWNLOAD]).get(route, params={'data_type': 'water'})
+    monkeypatch.setattr(sadco.api.lib.download_cache, 'DOWNLOAD_CACHE_SIZE', len(r_1.content))
+    r_2 = api([SADCOScope.HYDRO_DOWNLOAD]).get(route, params={'data_type': 'sediment'})
+
+    assert r_1.status_code == r_2.status_code == 200
+    cached_files = [path for path in download_cache.iterdir() if not path.suffix]
+    assert [path.stat().st_size for path in cached_files] == [len(r_2.content)]
+
+
+def test_pregenerate_downloads(api, waves_survey_download, download_cache, pregenerated_downloads, monkeypatch):
+    TestSession.execute(update(SurveyType).values(name='Waves'))
+    TestSession.commit()
+    survey_id = waves_survey_download.survey_id.replace('/', '-')
+    route = f'/survey/download/waves/{survey_id}'
+
+    downloads = get_standard_downloads()
+    assert downloads == [('waves', survey_id, None)]
+    assert pregenerate_download(*downloads[0]) is True
+    assert pregenerate_download(*downloads[0]) is False
+    assert len([path for path in pregenerated_downloads.iterdir() if not path.suffix]) == 1
+
+    # Pre-rendered files are not evicted to make room for other downloads
+    monkeypatch.setattr(sadco.api.lib.download_cache, 'DOWNLOAD_CACHE_SIZE', 0)
+    assert api([SADCOScope.WAVES_DOWNLOAD]).get(route, params={'compression': 'gzip'}).status_code == 200
+    assert not [path for path in download_cache.iterdir() if not path.suffix]
+
+    # The pre-rendered file is sent without querying the data
+    get_file_chunks = sadco.api.lib.download.get_file_chunks
+
+    def get_file_chunks_uncached(*args, **kwargs):
+        raise AssertionError('The download was not found in the cache')
+
+    monkeypatch.setattr(sadco.api.lib.download, 'get_file_chunks', get_file_chunks_uncached)
+    r = api([SADCOScope.WAVES_DOWNLOAD]).get(route)
+
+    assert r.status_code == 200
+    assert r.headers['content-length'] == str(len(r.content))
+    assert_download_result(r, 'waves')
+
+    # Once the survey's data has changed, the download is rendered again, and the old file is removed
+    monkeypatch.setattr(sadco.api.lib.download, 'get_file_chunks', get_file_chunks)
+    TestSession.execute(update(WavData).values(number_readings=WavData.number_readings + 1))
+    TestSession.commit()
+    started = time.time() - 1
+    for path in pregenerated_downloads.iterdir():
+        os.utime(path, (started - 60, started - 60))
+
+    assert pregenerate_download(*downloads[0]) is True
+    assert sadco.api.lib.download_cache.remove_pregenerated_files('waves', started) == 1
+    assert len([path for path in pregenerated_downloads.iterdir() if not path.suffix]) == 1
+
+
+def test_pregenerate_downloads_hydro_data_types(hydro_survey_download):
+    TestSession.execute(update(SurveyType).values(name='Hydro'))
+    TestSession.commit()
+    inv_stats = TestSession.get(InvStats, TEST_SURVEY_ID)
+
+    assert get_standard_downloads() == [
+        ('hydro', TEST_SURVEY_ID.replace('/', '-'), data_type.value) for data_type in DataType
+        if getattr(inv_stats, HYDRO_DATA_TYPE_RECORD_COUNTS[data_type].key)
+    ]
+    assert get_standard_downloads([ConstSurveyType.WAVES.value]) == []
+
+
 @pytest.mark.require_scope(SADCOScope.VOS_DOWNLOAD)
 def test_download_vos_data(api, vos_data, scopes):
     authorized = SADCOScope.VOS_DOWNLOAD in scopes
@@ -844,6 +1596,602 @@ def test_download_vos_data(api, vos_data, scopes):
         assert_download_result(r, 'survey', 'VOS')
 
 
+def test_download_vos_data_columns(api, vos_data):
+    r = api([SADCOScope.VOS_DOWNLOAD]).get(
+        '/vos_survey/download/',
+        params={
+            'north_bound': vos_data['north_bound'],
+            'south_bound': vos_data['south_bound'],
+            'east_bound': vos_data['east_bound'],
+            'west_bound': vos_data['west_bound'],
+            'columns': 'surface_temperature'
+        }
+    )
+
+    assert r.status_code == 200
+
+    downloaded_csv_data_frame = get_csv_from_zipped_file(r.content, 'survey_VOS.csv')
+    compare_csv_data_frame = pd.read_csv('{}/api/data-extractions/survey_VOS.csv'.format(os.getcwd()))[
+        ['latitude', 'longitude', 'date_time', 'callsign', 'surface_temperature']
+    ]
+
+    assert compare_csv_data_frame.compare(downloaded_csv_data_frame).empty
+
+
+def test_download_vos_data_materialised(api, vos_data, monkeypatch):
+    monkeypatch.setattr(sadco.api.routers.vos_survey, 'VOS_MATERIALISE_LIMIT', 0)
+    get_file_chunks = sadco.api.lib.download.get_file_chunks
+    on_event_loop = []
+
+    def get_file_chunks_recording_loop(*args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+
+        return get_file_chunks(*args, **kwargs)
+
+    monkeypatch.setattr(sadco.api.lib.download, 'get_file_chunks', get_file_chunks_recording_loop)
+    client = api([SADCOScope.VOS_DOWNLOAD])
+
+    # The file is produced on a thread of its own, and sent as it is produced
+    r_full = client.get('/vos_survey/download/', headers={'Range': 'bytes=0-99'})
+
+    assert r_full.status_code == 200
+    assert 'content-length' not in r_full.headers
+    assert on_event_loop == [False]
+
+    # The produced file is kept in the cache, from which the download can be resumed
+    r = client.get('/vos_survey/download/', headers={'Range': 'bytes=0-99'})
+
+    assert r.status_code == 206
+    assert r.content == r_full.content[:100]
+    assert r.headers['accept-ranges'] == 'bytes'
+    assert r.headers['etag']
+    assert on_event_loop == [False]
+    assert len(TestSession.execute(select(DownloadAudit)).scalars().all()) == 2
+
+
+def test_download_materialising_stream_abandoned(download_cache, monkeypatch):
+    monkeypatch.setattr(sadco.api.lib.download_cache, 'MATERIALISE_QUEUE_SIZE', 1)
+    chunks = [bytes([value]) * 10 for value in range(10)]
+
+    stream = iter(sadco.api.lib.download_cache.MaterialisingStream('abandoned', lambda: iter(chunks)))
+    assert next(stream) == chunks[0]
+    stream.close()
+
+    # The file is still produced in full once its download is abandoned
+    deadline = time.monotonic() + 10
+    while not (cached_file := sadco.api.lib.download_cache.get_cached_file('abandoned')):
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+
+    with open(cached_file.path, 'rb') as file:
+        assert file.read() == b''.join(chunks)
+
+    assert cached_file.file_info == {'checksum': hashlib.md5(b''.join(chunks)).hexdigest(), 'size': 100}
+
+
+def test_download_vos_data_parquet(api, vos_data):
+    r = api([SADCOScope.VOS_DOWNLOAD]).get(
+        '/vos_survey/download/',
+        params={
+            'north_bound': vos_data['north_bound'],
+            'south_bound': vos_data['south_bound'],
+            'east_bound': vos_data['east_bound'],
+            'west_bound': vos_data['west_bound'],
+            'format': 'parquet'
+        }
+    )
+
+    assert r.status_code == 200
+
+    table = assert_parquet_result(r, 'survey', 'VOS')
+
+    assert table.schema.field('latitude').type == pa.decimal128(7, 5)
+    assert table.schema.field('date_time').type == pa.timestamp('us')
+    assert table.schema.field('callsign').type == pa.string()
+
+
+def test_download_vos_data_numeric_values(api, vos_data):
+    params = {'start_date': vos_data['start_date'], 'end_date': vos_data['end_date']}
+
+    r = api([SADCOScope.VOS_DOWNLOAD]).get('/vos_survey/download/', params=params)
+    assert r.status_code == 200
+
+    with zipfile.ZipFile(io.BytesIO(r.content)) as zip_file:
+        csv_data = zip_file.read(zip_file.namelist()[0]).decode()
+
+    header, row = csv_data.splitlines()[:2]
+    values = dict(zip(header.split(','), row.split(',')))
+    assert values['latitude'] == '-35.0'
+    assert values['atmospheric_pressure'] == '112.3'
+    assert values['wind_speed'] == '42.6'
+
+    r = api([SADCOScope.VOS_DOWNLOAD]).get('/vos_survey/download/', params=params | {'format': 'parquet'})
+    assert r.status_code == 200
+
+    table = pq.read_table(io.BytesIO(r.content))
+    assert table.schema.field('atmospheric_pressure').type == pa.decimal128(5, 1)
+    assert set(table.column('atmospheric_pressure').to_pylist()) == {Decimal('112.3')}
+    assert set(table.column('wind_speed').to_pylist()) == {Decimal('42.6')}
+
+
+def test_download_vos_data_arrow(api, vos_data):
+    r = api([SADCOScope.VOS_DOWNLOAD]).get(
+        '/vos_survey/download/',
+        params={
+            'start_date': vos_data['start_date'],
+            'end_date': vos_data['end_date'],
+            'format': 'arrow'
+        }
+    )
+
+    assert r.status_code == 200
+    assert r.headers['content-type'] == 'application/vnd.apache.arrow.stream'
+
+    table = pa.ipc.open_stream(r.content).read_all()
+
+    compare_csv_data_frame = pd.read_csv('{}/api/data-extractions/survey_VOS.csv'.format(os.getcwd()))
+
+    assert table.column_names == list(compare_csv_data_frame.columns)
+    assert table.num_rows == len(compare_csv_data_frame)
+    assert table.schema.field('wind_speed').type == pa.decimal128(3, 1)
+
+
+@pytest.mark.require_scope(SADCOScope.HYDRO_DOWNLOAD)
+def test_download_estimate_hydro_data(api, hydro_survey_download, scopes):
+    authorized = SADCOScope.HYDRO_DOWNLOAD in scopes
+
+    r = api(scopes).get(
+        '/survey/download/hydro/{}/estimate'.format(TEST_SURVEY_ID.replace('/', '-')),
+        params={'data_type': DataType.WATER.value, 'columns': ['temperature']}
+    )
+
+    if not authorized:
+        assert_forbidden(r)
+    else:
+        assert r.status_code == 200
+
+        inv_stats = TestSession.get(InvStats, TEST_SURVEY_ID)
+        estimate = r.json()
+        assert estimate['row_count'] == inv_stats.watphy_cnt
+        assert estimate['uncompressed_size'] > estimate['row_count'] > 0
+        assert estimate['generation_seconds'] >= 0
+
+
+def test_download_estimate_hydro_data_bundle_and_batch(api, hydro_survey_download):
+    inv_stats = TestSession.get(InvStats, TEST_SURVEY_ID)
+    survey_id = TEST_SURVEY_ID.replace('/', '-')
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        f'/survey/download/hydro/{survey_id}/estimate', params={'data_type': 'all'}
+    )
+    assert r.status_code == 200
+    assert r.json()['row_count'] == (
+        4 * int(inv_stats.watphy_cnt) + int(inv_stats.watnut_cnt) + int(inv_stats.watcurrents_cnt) +
+        int(inv_stats.weather_cnt) + 3 * int(inv_stats.sedphy_cnt)
+    )
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        '/survey/download/hydro/estimate',
+        params={'survey_id': [survey_id, survey_id, '1999-0002'], 'data_type': DataType.SEDIMENT.value}
+    )
+    assert r.status_code == 200
+    assert r.json()['row_count'] == inv_stats.sedphy_cnt
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).get(
+        f'/survey/download/hydro/{survey_id}/estimate', params={'data_type': 'plankton'}
+    )
+    assert r.status_code == 404
+
+
+def test_download_estimate_currents_data(api, currents_survey_download):
+    cur_depth = currents_survey_download.cur_depths[0]
+
+    r = api([SADCOScope.CURRENTS_DOWNLOAD]).get(
+        '/survey/download/currents/{}/estimate'.format(TEST_SURVEY_ID.replace('/', '-'))
+    )
+    assert r.status_code == 200
+    assert r.json()['row_count'] == cur_depth.number_of_records
+
+    r = api([SADCOScope.CURRENTS_DOWNLOAD]).get(
+        '/survey/download/currents/{}/estimate'.format(TEST_SURVEY_ID.replace('/', '-')),
+        params={'min_depth': 300}
+    )
+    assert r.status_code == 200
+    assert r.json()['row_count'] == 0
+
+
+def test_download_estimate_waves_data_time_window(api, waves_survey_download):
+    TestSession.execute(delete(WavPeriod))
+    TestSession.add(WavPeriod(station_id=waves_survey_download.station_id, yearp=1990,
+                              **{f'm{month:02}': month for month in range(1, 13)}))
+    TestSession.commit()
+
+    r = api([SADCOScope.WAVES_DOWNLOAD]).get(
+        '/survey/download/waves/{}/estimate'.format(TEST_SURVEY_ID.replace('/', '-')),
+        params={'start': '1990-03-15T00:00:00', 'end': '1990-05-01T00:00:00'}
+    )
+
+    assert r.status_code == 200
+    assert r.json()['row_count'] == 3 + 4 + 5
+
+
+def test_download_estimate_vos_data(api, vos_data):
+    TestSession.add(DownloadAudit(timestamp=datetime(2024, 1, 1), client_id='client', row_count=1000,
+                                  download_seconds=10))
+    # Downloads that were not timed, such as those sent from the download cache, are left out of the rate
+    TestSession.add(DownloadAudit(timestamp=datetime(2024, 1, 2), client_id='client'))
+    TestSession.commit()
+
+    params = {'start_date': vos_data['start_date'], 'end_date': vos_data['end_date']}
+    total = api([SADCOScope.VOS_READ]).get('/vos_survey/vos_surveys/search', params=params).json()['total']
+
+    r = api([SADCOScope.VOS_DOWNLOAD]).get('/vos_survey/download/estimate', params=params | {'columns': ['wind_speed']})
+
+    assert r.status_code == 200
+    # latitude, longitude, date_time, callsign and wind_speed, each followed by a separator
+    assert r.json() == {'row_count': total, 'uncompressed_size': total * (10 + 11 + 20 + 31 + 6),
+                        'generation_seconds': round(total / 100, 1)}
+
+
+def search_vos_total(api, **params) -> int:
+    r = api([SADCOScope.VOS_READ]).get('/vos_survey/vos_surveys/search', params=params)
+    assert r.status_code == 200
+    return r.json()['total']
+
+
+def test_search_vos_count_cube(api, vos_data):
+    bounds = {key: vos_data[key] for key in ('north_bound', 'south_bound', 'east_bound', 'west_bound')}
+
+    assert search_vos_total(api, **bounds) == 1
+
+    refresh_vos_count_cube()
+
+    # The counts of the cells wholly within the bounds are taken from the cube, without scanning the tables, which
+    # is seen once the changes that the cube is waiting to count are forgotten
+    for vos_model in (VosMain, VosMain2, VosMain68, VosArch, VosArch2):
+        TestSession.execute(delete(vos_model))
+    TestSession.execute(delete(VosCountCubeChange))
+    TestSession.commit()
+
+    assert search_vos_total(api, **bounds) == 1
+    assert search_vos_total(api, **bounds, end_date=date(1998, 1, 1)) == 1
+    assert search_vos_total(api, **bounds, start_date=date(1998, 1, 2)) == 0
+    assert search_vos_total(api, north_bound=-36, south_bound=-40) == 0
+
+
+def test_search_vos_count_cube_edges(api, vos_data):
+    refresh_vos_count_cube()
+
+    edge_data = dict(longitude=-10, date_time=datetime(1998, 1, 1), callsign='AD35', load_id=9934)
+    TestSession.add(VosMain(latitude=34.8, **edge_data))
+    TestSession.add(VosMain(latitude=37, **edge_data))
+    TestSession.commit()
+    update_vos_count_cube()
+
+    # The record in the cell that the bounds cut through is counted in the tables, and the other from the cube
+    assert is_vos_count_cube_current()
+    assert search_vos_total(api, north_bound=-34.5, south_bound=-40, east_bound=-5.5, west_bound=-15) == 1 + 2
+
+
+def test_search_vos_count_cube_stale(api, vos_data):
+    refresh_vos_count_cube()
+
+    for vos_model in (VosMain, VosMain2, VosMain68, VosArch, VosArch2):
+        TestSession.execute(delete(vos_model))
+    TestSession.commit()
+
+    assert not is_vos_count_cube_current()
+    assert search_vos_total(api, north_bound=-30, south_bound=-40) == 0
+
+
+def test_update_vos_count_cube(api, vos_data):
+    update_vos_count_cube()
+
+    # The cube is only brought up to date once it has been built
+    assert TestSession.execute(select(func.count()).select_from(VosCountCube)).scalar_one() == 0
+    refresh_vos_count_cube()
+    assert is_vos_count_cube_current()
+    counts = TestSession.execute(select(VosCountCube.day, VosCountCube.record_count)).all()
+
+    record_data = dict(latitude=35.5, longitude=-10, callsign='AD35', load_id=9934)
+    TestSession.add(VosMain(date_time=datetime(2001, 3, 4, 12), **record_data))
+    TestSession.add(VosMain2(date_time=datetime(2001, 3, 5), **record_data))
+    TestSession.commit()
+
+    assert not is_vos_count_cube_current()
+    assert TestSession.execute(select(VosCountCubeChange.day).order_by(VosCountCubeChange.day)).scalars().all() == [
+        date(2001, 3, 4), date(2001, 3, 5)
+    ]
+
+    update_vos_count_cube()
+
+    assert is_vos_count_cube_current()
+    assert TestSession.execute(select(VosCountCubeChange)).first() is None
+    assert sorted(TestSession.execute(select(VosCountCube.day, VosCountCube.record_count)).all()) == sorted(
+        counts + [(date(2001, 3, 4), 1), (date(2001, 3, 5), 1)]
+    )
+
+    TestSession.execute(delete(VosMain2).where(VosMain2.date_time == datetime(2001, 3, 5)))
+    TestSession.commit()
+    update_vos_count_cube()
+
+    assert is_vos_count_cube_current()
+    assert TestSession.execute(select(VosCountCube.day).where(VosCountCube.day == date(2001, 3, 5))).first() is None
+
+
+def test_download_vos_data_duplicates(api, vos_data):
+    # A record held in more than one table is taken from the first table whose copy is not flagged as a duplicate
+    TestSession.execute(update(VosMain).values(dupflag='Y', wind_speed=1))
+    TestSession.execute(update(VosMain2).values(wind_speed=2))
+    TestSession.execute(update(VosArch).values(callsign='AD36', wind_speed=3))
+    TestSession.commit()
+
+    params = {'start_date': vos_data['start_date'], 'end_date': vos_data['end_date']}
+
+    assert search_vos_total(api, **params) == 2
+
+    r = api([SADCOScope.VOS_DOWNLOAD]).get('/vos_survey/download', params=params | {'columns': 'callsign,wind_speed'})
+
+    assert r.status_code == 200
+    df = get_csv_from_zipped_file(r.content, 'survey_VOS.csv')
+    assert sorted(zip(df['callsign'], df['wind_speed'])) == [('AD35', 2), ('AD36', 3)]
+
+
+def test_search_vos_approximate(api, vos_data, monkeypatch):
+    params = {'start_date': vos_data['start_date'], 'end_date': vos_data['end_date']}
+    r = api([SADCOScope.VOS_READ]).get('/vos_survey/vos_surveys/search', params=params | {'approximate': True})
+
+    assert r.status_code == 200
+    assert r.json()['approximate'] is True
+    assert r.json()['total_lower'] <= 1 <= r.json()['total_upper']
+
+    # Sampling every page gives the exact total
+    monkeypatch.setattr(sadco.api.routers.vos_survey, 'VOS_SAMPLE_PERCENT', 100)
+    r = api([SADCOScope.VOS_READ]).get('/vos_survey/vos_surveys/search', params=params | {'approximate': True})
+
+    assert r.json() == {'total': 1, 'approximate': True, 'total_lower': 1, 'total_upper': 1}
+
+    # The download gate counts exactly
+    assert search_vos_total(api, **params) == 1
+    r = api([SADCOScope.VOS_READ]).get('/vos_survey/vos_surveys/search', params=params)
+    assert r.json()['approximate'] is False
+
+
+def test_search_vos_zorder_ranges(api):
+    bounds = dict(north_bound=-30.25, south_bound=-30.5, east_bound=18.5, west_bound=18.25,
+                  start_date=date(2001, 3, 1), end_date=date(2001, 3, 2))
+
+    for latitude, longitude, date_time in product(
+            (30.2, 30.25, 30.4, 30.5, 30.6),
+            (18.2, 18.25, 18.4, 18.5, 18.6),
+            (datetime(2001, 2, 28, 23), datetime(2001, 3, 1), datetime(2001, 3, 2), datetime(2001, 3, 2, 1)),
+    ):
+        TestSession.add(VosMain(latitude=latitude, longitude=longitude, date_time=date_time, callsign='AD35',
+                                load_id=1))
+    TestSession.commit()
+
+    zorder_ranges = sadco.api.routers.vos_survey.get_vos_zorder_ranges(*bounds.values())
+    assert 1 < len(zorder_ranges) <= sadco.api.routers.vos_survey.VOS_ZORDER_MAX_RANGES
+    # The records on and within the bounds are all found within the key ranges that cover the bounds
+    assert search_vos_total(api, **bounds) == 3 * 3 * 2
+
+
+@pytest.fixture
+def vos_partitioned(vos_data):
+    """Migrates the VOS tables to the partitioned VOS table, and restores them afterwards."""
+    vos_tables = [vos_model.__table__ for vos_model in sadco.api.routers.vos_survey.VOS_MODELS]
+    sql_path = os.path.join(os.path.dirname(__file__), '..', '..', 'sadco', 'sql', 'vos_partitioned.sql')
+
+    with sadco.db.engine.begin() as conn:
+        conn.exec_driver_sql("DO $$ BEGIN CREATE ROLE sadco_vos_reader; EXCEPTION WHEN duplicate_object THEN END $$")
+        for vos_table in vos_tables:
+            conn.exec_driver_sql(f'GRANT SELECT ON {vos_table.fullname} TO sadco_vos_reader')
+        conn.exec_driver_sql('GRANT INSERT ON sadco.vos_main TO sadco_vos_reader')
+
+    # Run without parameters, so that the script's format specifiers are passed through to the database
+    with open(sql_path) as sql_file, sadco.db.engine.begin() as conn:
+        conn.connection.cursor().execute(sql_file.read())
+
+    # The tables that store the VOS data are looked up once per process, which is restarted after a migration
+    sadco.api.lib.download_cache.get_versioned_tables.cache_clear()
+
+    try:
+        yield vos_data
+    finally:
+        TestSession.remove()
+        sadco.db.Session.remove()
+
+        with sadco.db.engine.begin() as conn:
+            for vos_table in vos_tables:
+                conn.exec_driver_sql(f'DROP VIEW {vos_table.fullname}')
+            conn.exec_driver_sql('DROP TABLE sadco.vos')
+            conn.exec_driver_sql('DROP ROLE sadco_vos_reader')
+
+        sadco.db.Base.metadata.create_all(sadco.db.engine, tables=vos_tables)
+        sadco.api.lib.download_cache.get_versioned_tables.cache_clear()
+
+
+def test_download_vos_data_partitioned(api, vos_partitioned, monkeypatch):
+    bounds = {key: vos_partitioned[key] for key in ('north_bound', 'south_bound', 'east_bound', 'west_bound')}
+
+    assert search_vos_total(api, **bounds) == 1
+    assert_download_result(api([SADCOScope.VOS_DOWNLOAD]).get('/vos_survey/download/', params=bounds), 'survey', 'VOS')
+
+    # Records loaded through a view are tagged with its table, and stored in the partition of their year
+    TestSession.add(VosMain2(latitude=35, longitude=-10, date_time=datetime(2001, 1, 1), callsign='AD36', load_id=1))
+    TestSession.commit()
+
+    assert TestSession.execute(
+        text("SELECT tableoid::regclass::text, source FROM sadco.vos WHERE callsign = 'AD36'")
+    ).one() == ('sadco.vos_default', 'vos_main2')
+    assert search_vos_total(api, **bounds) == 2
+
+    # The day of the record is recorded by the triggers of sadco.vos, for the count cube to count again
+    assert date(2001, 1, 1) in TestSession.execute(select(VosCountCubeChange.day)).scalars().all()
+
+    # A copy from a source of higher precedence supersedes the record, unless it is flagged as a duplicate
+    TestSession.add(VosMain(latitude=35, longitude=-10, date_time=datetime(2001, 1, 1), callsign='AD36', load_id=1,
+                            wind_speed=1))
+    TestSession.commit()
+
+    assert search_vos_total(api, **bounds) == 2
+    r = api([SADCOScope.VOS_DOWNLOAD]).get('/vos_survey/download', params=bounds | {'columns': 'wind_speed'})
+    df = get_csv_from_zipped_file(r.content, 'survey_VOS.csv')
+    assert df[df['callsign'] == 'AD36']['wind_speed'].tolist() == [1]
+
+    TestSession.execute(update(VosMain).where(VosMain.callsign == 'AD36').values(dupflag='Y'))
+    TestSession.commit()
+
+    assert search_vos_total(api, **bounds) == 2
+
+    # The privileges on the old tables are kept on their views, and those on all of them are granted on sadco.vos
+    assert TestSession.execute(text(
+        "SELECT has_table_privilege('sadco_vos_reader', 'sadco.vos', 'SELECT'),"
+        " has_table_privilege('sadco_vos_reader', 'sadco.vos', 'INSERT'),"
+        " has_table_privilege('sadco_vos_reader', 'sadco.vos_arch', 'SELECT'),"
+        " has_table_privilege('sadco_vos_reader', 'sadco.vos_main', 'INSERT')"
+    )).one() == (True, False, True, True)
+
+    # An approximate total is estimated from a sample of sadco.vos, rather than of its views
+    r = api([SADCOScope.VOS_READ]).get('/vos_survey/vos_surveys/search', params=bounds | {'approximate': True})
+    assert r.json()['approximate'] is True
+    assert r.json()['total_lower'] <= 2 <= r.json()['total_upper']
+
+    monkeypatch.setattr(sadco.api.routers.vos_survey, 'VOS_SAMPLE_PERCENT', 100)
+    r = api([SADCOScope.VOS_READ]).get('/vos_survey/vos_surveys/search', params=bounds | {'approximate': True})
+    assert r.json() == {'total': 2, 'approximate': True, 'total_lower': 2, 'total_upper': 2}
+
+    # A search of later years queries sadco.vos directly, and does not read the partition of 1998
+    stmt = sadco.api.routers.vos_survey.get_vos_union_statement(
+        *bounds.values(), date(1999, 1, 1), None, False, False
+    )
+    assert 'vos_main' not in str(stmt)
+    plan = TestSession.execute(
+        text('EXPLAIN ' + str(stmt.compile(sadco.db.engine, compile_kwargs={'literal_binds': True})))
+    ).scalars().all()
+
+    # The scan that applies the date filter is the scan of the records; the copies from other sources that each
+    # record is checked against are looked up by primary key
+    date_scans = [plan[index - 1] for index, line in enumerate(plan) if 'date_time >=' in line]
+    assert len(date_scans) == 1
+    assert all('vos_default' in line for line in date_scans)
+
+
+@pytest.mark.parametrize('params', [{}, {'data_type': 'all'}, {'data_type': 'plankton'}])
+def test_download_job_hydro_invalid_data_type(api, hydro_survey_download, params):
+    route = '/download_jobs/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r = api([SADCOScope.HYDRO_DOWNLOAD]).post(route, params=params)
+
+    assert r.status_code == 422
+    assert TestSession.execute(select(DownloadJob)).first() is None
+
+
+def test_download_job_hydro(api, hydro_survey_download):
+    client = api([SADCOScope.HYDRO_DOWNLOAD, SADCOScope.DOWNLOAD_READ])
+    route = '/download_jobs/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+
+    r = client.post(route, params={'data_type': 'water'})
+
+    assert r.status_code == 202
+    assert r.json()['status'] in ('pending', 'running', 'complete')
+
+    job = wait_for_download_job(client, r.json()['id'])
+
+    assert job['status'] == 'complete'
+    assert job['rows_processed'] == job['row_count']
+
+    r = client.get(f'/download_jobs/{job["id"]}/file')
+
+    assert_download_result(r, 'hydro_water')
+    assert job['download_file_size'] == len(r.content)
+
+    audit = TestSession.execute(select(DownloadAudit)).scalar_one()
+    assert audit.download_file_checksum == hashlib.md5(r.content).hexdigest()
+    assert json.loads(audit.parameters)['job_id'] == job['id']
+
+
+def test_download_job_vos(api, vos_data):
+    client = api([SADCOScope.VOS_DOWNLOAD, SADCOScope.DOWNLOAD_READ])
+
+    r = client.post(
+        '/download_jobs/vos',
+        params={
+            'north_bound': vos_data['north_bound'],
+            'south_bound': vos_data['south_bound'],
+            'east_bound': vos_data['east_bound'],
+            'west_bound': vos_data['west_bound']
+        }
+    )
+
+    assert r.status_code == 202
+
+    job = wait_for_download_job(client, r.json()['id'])
+
+    assert job['status'] == 'complete'
+
+    assert_download_result(client.get(f'/download_jobs/{job["id"]}/file'), 'survey', 'VOS')
+
+
+def test_download_job_not_found(api):
+    client = api([SADCOScope.HYDRO_DOWNLOAD, SADCOScope.DOWNLOAD_READ])
+
+    r = client.post('/download_jobs/hydro/1999-0002', params={'data_type': 'water'})
+
+    job = wait_for_download_job(client, r.json()['id'])
+
+    assert job['status'] == 'failed'
+    assert job['error'] == 'No data was found'
+    assert client.get(f'/download_jobs/{job["id"]}/file').status_code == 409
+
+
+def test_download_job_other_client(api, hydro_survey_download):
+    route = '/download_jobs/hydro/{}'.format(hydro_survey_download.survey_id.replace('/', '-'))
+    client = api([SADCOScope.HYDRO_DOWNLOAD, SADCOScope.DOWNLOAD_READ])
+
+    r = client.post(route, params={'data_type': 'water'})
+    job = wait_for_download_job(client, r.json()['id'])
+
+    other_client = api([SADCOScope.DOWNLOAD_READ], client_id='sadco.other.client', user_id='sadco.other.user')
+
+    assert other_client.get(f'/download_jobs/{job["id"]}').status_code == 404
+    assert other_client.get(f'/download_jobs/{job["id"]}/file').status_code == 404
+
+
+def test_download_job_maintenance(download_job_dir):
+    now = datetime.now()
+    job_params = dict(client_id='client', download_format='csv', file_name='VOS.zip', created=now - timedelta(days=8))
+    download_job_dir.mkdir()
+    (download_job_dir / 'expired').write_bytes(b'data')
+
+    TestSession.add_all([
+        # A job of this process, which is marked as alive however long ago it was queued
+        DownloadJob(id='own', status='running', worker_id=sadco.api.lib.download_job.DOWNLOAD_JOB_WORKER_ID,
+                    heartbeat=now - timedelta(hours=1), **job_params),
+        # A job of a process that is still running
+        DownloadJob(id='alive', status='pending', worker_id='other', heartbeat=now, **job_params),
+        # A job of a process that was restarted
+        DownloadJob(id='lost', status='running', worker_id='other', heartbeat=now - timedelta(hours=1), **job_params),
+        DownloadJob(id='expired', status='complete', completed=now - timedelta(days=8), **job_params),
+    ])
+    TestSession.commit()
+
+    sadco.api.lib.download_job.maintain_download_jobs()
+
+    jobs = {job.id: job for job in TestSession.execute(select(DownloadJob)).scalars()}
+
+    assert [jobs[job_id].status for job_id in ('own', 'alive', 'lost', 'expired')] == [
+        'running', 'pending', 'failed', 'expired'
+    ]
+    assert jobs['own'].heartbeat > now - timedelta(minutes=1)
+    assert jobs['lost'].error == 'The job was interrupted; please submit it again'
+    assert not (download_job_dir / 'expired').exists()
+
+
 @pytest.fixture(params=['temporal_extent', 'geographical_extent'])
 def download_vos_data(api, request, vos_data):
     download_params = {}
@@ -896,7 +2244,8 @@ def test_download_vos_audit(api, scopes, download_vos_data):
                     assert not value
 
 
-def assert_download_result(response, compare_file_name, file_unique_name: str = TEST_SURVEY_ID.replace('/', '-')):
+def assert_download_result(response, compare_file_name, file_unique_name: str = TEST_SURVEY_ID.replace('/', '-'),
+                           normalize: bool = False):
     assert response.status_code == 200
 
     current_dir = os.getcwd()
@@ -915,11 +2264,60 @@ def assert_download_result(response, compare_file_name, file_unique_name: str =
 
     compare_csv_data_frame = pd.read_csv(compare_csv_file_path)
 
+    if normalize:
+        downloaded_csv_data_frame = get_normalized_data_frame(downloaded_csv_data_frame)
+        compare_csv_data_frame = get_normalized_data_frame(compare_csv_data_frame)
+
     differences = compare_csv_data_frame.compare(downloaded_csv_data_frame)
 
     assert differences.empty
 
 
+def assert_parquet_result(response, compare_file_name, file_unique_name: str = TEST_SURVEY_ID.replace('/', '-')):
+    assert response.headers['content-type'] == 'application/vnd.apache.parquet'
+
+    table = pq.read_table(io.BytesIO(response.content))
+
+    compare_csv_data_frame = pd.read_csv(
+        '{}/api/data-extractions/{}_{}.csv'.format(os.getcwd(), compare_file_name, file_unique_name)
+    )
+
+    assert table.column_names == list(compare_csv_data_frame.columns)
+    assert table.num_rows == len(compare_csv_data_frame)
+
+    return table
+
+
+def assert_netcdf_result(response, feature_type: str) -> netCDF4.Dataset:
+    assert response.headers['content-type'] == 'application/x-netcdf'
+    assert response.headers['content-disposition'].endswith('.nc')
+
+    dataset = netCDF4.Dataset('download.nc', memory=response.content)
+
+    assert dataset.Conventions == 'CF-1.8'
+    assert dataset.featureType == feature_type
+
+    return dataset
+
+
+def get_compare_data_frame(compare_file_name, file_unique_name: str = TEST_SURVEY_ID.replace('/', '-')):
+    return pd.read_csv('{}/api/data-extractions/{}_{}.csv'.format(os.getcwd(), compare_file_name, file_unique_name))
+
+
+def wait_for_download_job(client, job_id, timeout: float = 10) -> dict:
+    deadline = time.monotonic() + timeout
+
+    while True:
+        r = client.get(f'/download_jobs/{job_id}')
+        assert r.status_code == 200
+
+        job = r.json()
+        if job['status'] not in ('pending', 'running') or time.monotonic() > deadline:
+            return job
+
+        time.sleep(0.1)
+
+
 def get_csv_from_zipped_file(zipped_data, csv_file_name):
     data_stream = io.BytesIO(zipped_data)
     downloaded_csv_file = None
@@ -930,3 +2328,15 @@ def get_csv_from_zipped_file(zipped_data, csv_file_name):
 
     data_frame = pd.read_csv(io.BytesIO(downloaded_csv_file))
     return data_frame
+
+
+def get_normalized_data_frame(data_frame):
+    """
+    Parses the date columns and sorts the rows, for comparing csv files that were encoded by the database,
+    which formats timestamps in full and does not guarantee row order.
+    """
+    for date_column in ('date', 'spldattim'):
+        if date_column in data_frame:
+            data_frame[date_column] = pd.to_datetime(data_frame[date_column])
+
+    return data_frame.sort_values(list(data_frame.columns)).reset_index(drop=True)
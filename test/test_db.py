@@ -1,5 +1,7 @@
 from decimal import Decimal
 
+from sadco.api.lib.zorder import (ZORDER_LATITUDE_RANGE, ZORDER_LONGITUDE_RANGE, get_zorder_cell, get_zorder_day,
+                                  get_zorder_key)
 from sadco.db.models import (Survey, Inventory, Watphy, Station, Sedphy, Watnut, Watchem1, Watchem2, Watpol1, Watpol2,
                              Watchl, Watcurrents, SamplingDevice, Sedpol1, Sedpol2, Sedchem1, Sedchem2, InvStats,
                              CurMooring, CurDepth, CurData, CurWatphy, EDMInstrument2, WetStation, WetPeriod,
@@ -286,6 +288,18 @@ def test_create_read_vos():
     assert_model_equality(fetched_vos_arch, VosArch(**vos_data))
     assert_model_equality(fetched_vos_arch_2, VosArch2(**vos_data))
 
+    zorder_key = get_zorder_key(
+        get_zorder_cell(vos_data['latitude'], ZORDER_LATITUDE_RANGE),
+        get_zorder_cell(vos_data['longitude'], ZORDER_LONGITUDE_RANGE),
+        get_zorder_day(vos_data['date_time'].date()),
+    )
+
+    assert all(
+        fetched_vos.zorder_key == zorder_key
+        for fetched_vos in (fetched_vos_main, fetched_vos_main_2, fetched_vos_main_68, fetched_vos_arch,
+                            fetched_vos_arch_2)
+    )
+
 
 def test_create_read_download_audit():
     created_download_audit = DownloadAuditFactory()
@@ -299,8 +313,9 @@ def test_create_read_download_audit():
 
 
 def assert_model_equality(model1, model2):
-    """Compares all attributes of two SQLAlchemy models for equality."""
+    """Compares all attributes of two SQLAlchemy models for equality, other than those computed by the database."""
 
     for attr in model1.__table__.columns:
-        assert getattr(model1, attr.name) == getattr(model2, attr.name)
+        if attr.computed is None:
+            assert getattr(model1, attr.name) == getattr(model2, attr.name)
 